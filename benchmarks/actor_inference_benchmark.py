@@ -0,0 +1,114 @@
+"""
+Benchmark of actor_inference_engine: the CPU time an actor spends per step running the model, eagerly versus as a
+frozen TorchScript export (with and without int8 Linear layers), for ImpalaNet with each conv_net_arch and for the PPO
+actor-critic. Also reports how long an export takes, which is paid each time an actor syncs its weights. Runs single
+threaded, as actors do.
+
+Usage (from the repository root):
+    python -m benchmarks.actor_inference_benchmark [--archs orig impala_res_cnn] [--batch_sizes 1 8]
+"""
+
+import argparse
+import time
+
+import gymnasium as gym
+import numpy as np
+import torch
+
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+from continual_rl.policies.impala.nets import ImpalaNet
+from continual_rl.policies.ppo.a2c_ppo_acktr_gail.model import Policy
+
+OBSERVATION_SHAPE = (4, 1, 84, 84)
+NUM_ACTIONS = 6
+
+
+def cpu_time_per_call(fn, steps):
+    for _ in range(5):
+        fn()
+
+    start = time.process_time()
+    for _ in range(steps):
+        fn()
+    return (time.process_time() - start) / steps
+
+
+def benchmark_impala(arch, batch_size, args):
+    model_flags = ImpalaPolicyConfig()
+    model_flags.device = torch.device("cpu")
+    model_flags.conv_net_arch = arch
+    observation_space = gym.spaces.Box(low=0, high=255, shape=OBSERVATION_SHAPE, dtype=np.uint8)
+    net = ImpalaNet(observation_space, {0: gym.spaces.Discrete(NUM_ACTIONS)}, model_flags)
+    inputs = {"frame": torch.randint(0, 256, (1, batch_size, *OBSERVATION_SHAPE), dtype=torch.uint8),
+              "last_action": torch.randint(0, NUM_ACTIONS, (1, batch_size)),
+              "reward": torch.randn((1, batch_size)),
+              "done": torch.zeros((1, batch_size), dtype=torch.bool)}
+
+    def eager_step():
+        with torch.no_grad():
+            net(inputs, 0)
+
+    results = {"eager": (cpu_time_per_call(eager_step, args.steps), None)}
+    for name, quantize in (("torchscript", False), ("torchscript_int8", True)):
+        start = time.process_time()
+        exported = net.export_for_inference(quantize=quantize)
+        export_time = time.process_time() - start
+        results[name] = (cpu_time_per_call(lambda: exported(inputs, 0), args.steps), export_time)
+
+    return results
+
+
+def benchmark_ppo(batch_size, args):
+    policy = Policy(obs_shape=[OBSERVATION_SHAPE[0] * OBSERVATION_SHAPE[1], *OBSERVATION_SHAPE[2:]],
+                    action_space=gym.spaces.Discrete(NUM_ACTIONS))
+    inputs = (torch.randint(0, 256, (batch_size, OBSERVATION_SHAPE[0], *OBSERVATION_SHAPE[2:])).float(),
+              torch.zeros((batch_size, 1)), torch.ones((batch_size, 1)))
+
+    def eager_step():
+        with torch.no_grad():
+            policy.act(*inputs)
+
+    results = {"eager": (cpu_time_per_call(eager_step, args.steps), None)}
+    for name, quantize in (("torchscript", False), ("torchscript_int8", True)):
+        start = time.process_time()
+        exported = policy.export_for_inference(inputs, quantize=quantize)
+        export_time = time.process_time() - start
+
+        def exported_step():
+            with torch.no_grad():
+                policy.act_from_logits(*exported(*inputs))
+
+        results[name] = (cpu_time_per_call(exported_step, args.steps), export_time)
+
+    return results
+
+
+def print_results(label, results):
+    eager_time = results["eager"][0]
+    summary = []
+    for name, (step_time, export_time) in results.items():
+        result = f"{name} {step_time * 1000:.2f}ms ({eager_time / step_time:.2f}x)"
+        if export_time is not None:
+            result += f" export {export_time * 1000:.0f}ms"
+        summary.append(result)
+    print(f"  {label:<28} " + "  ".join(summary))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--archs", nargs="+", default=["orig", "impala_res_cnn"])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8], help="Environments per actor")
+    parser.add_argument("--steps", type=int, default=100)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    print("CPU time per actor step (speedup over eager)")
+
+    for batch_size in args.batch_sizes:
+        for arch in args.archs:
+            print_results(f"ImpalaNet {arch} B={batch_size}", benchmark_impala(arch, batch_size, args))
+        print_results(f"PPO Policy B={batch_size}", benchmark_ppo(batch_size, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark of learner throughput as learner threads are added, for each learner_concurrency mode. Each thread calls
+Monobeast.learn on synthetic Atari-shaped batches (no actors or environments), so what's measured is how well the
+learner threads' steps overlap.
+
+Usage (from the repository root):
+    python -m benchmarks.learner_threads_benchmark [--max_threads 4] [--torch_threads 1] [--seconds 10]
+"""
+
+import argparse
+import tempfile
+import threading
+import time
+import types
+
+import gymnasium as gym
+import numpy as np
+import torch
+
+from continual_rl.policies.impala.impala_policy import ImpalaPolicy
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+
+
+def create_monobeast(args, learner_concurrency, output_dir):
+    config = ImpalaPolicyConfig()
+    config.device = "cpu"
+    config.batch_size = args.batch_size
+    config.unroll_length = args.unroll_length
+    config.learner_concurrency = learner_concurrency
+    config.set_output_dir(output_dir)
+
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(4, 1, 84, 84), dtype=np.uint8)
+    action_spaces = {0: gym.spaces.Discrete(6)}
+    return ImpalaPolicy(config, observation_space, action_spaces).impala_trainer
+
+
+def create_batch(monobeast, args):
+    specs = monobeast.create_buffer_specs(args.unroll_length, (4, 1, 84, 84), num_actions=6)
+    batch = {}
+    for key, spec in specs.items():
+        dtype = spec.get("gather_dtype", spec["dtype"])  # As get_batch would produce it
+        shape = (spec["size"][0], args.batch_size, *spec["size"][1:])
+        if dtype == torch.float32:
+            batch[key] = torch.randn(shape)
+        elif dtype == torch.bool:
+            batch[key] = torch.zeros(shape, dtype=torch.bool)
+        else:
+            batch[key] = torch.randint(0, 6, shape).to(dtype)
+    return batch
+
+
+def measure_steps_per_second(monobeast, num_threads, args):
+    task_flags = types.SimpleNamespace(action_space_id=0, task_id=0)
+    batch = create_batch(monobeast, args)
+    learn_lock = threading.Lock()
+    num_steps = [0] * num_threads
+    stop_time = [None]
+    start = threading.Barrier(num_threads + 1)
+
+    def learn_loop(thread_id):
+        learner_replica = monobeast._create_learner_replica(learn_lock)
+        start.wait()
+        while stop_time[0] is None or time.monotonic() < stop_time[0]:
+            monobeast.learn(monobeast._model_flags, task_flags, monobeast.actor_model, monobeast.learner_model,
+                            batch, (), monobeast.optimizer, None, learn_lock, learner_replica=learner_replica)
+            num_steps[thread_id] += 1
+
+    threads = [threading.Thread(target=learn_loop, args=(thread_id,)) for thread_id in range(num_threads)]
+    for thread in threads:
+        thread.start()
+
+    # Warm up, then count the steps taken in the measurement window
+    stop_time[0] = time.monotonic() + 1 + args.seconds
+    start.wait()
+    time.sleep(1)
+    steps_at_start = sum(num_steps)
+    time.sleep(args.seconds)
+    steps_taken = sum(num_steps) - steps_at_start
+
+    for thread in threads:
+        thread.join()
+
+    return steps_taken / args.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max_threads", type=int, default=4)
+    parser.add_argument("--torch_threads", type=int, default=1, help="Intra-op threads, shared by all learners")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--unroll_length", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.torch_threads)
+    print(f"Learner steps/s on CPU, T={args.unroll_length} B={args.batch_size}, torch_threads={args.torch_threads}")
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for learner_concurrency in ("serialized", "concurrent", "hogwild"):
+            monobeast = create_monobeast(args, learner_concurrency, output_dir)
+            results = []
+            for num_threads in range(1, args.max_threads + 1):
+                results.append(measure_steps_per_second(monobeast, num_threads, args))
+
+            scaling = "  ".join(f"{num_threads} threads: {steps_per_second:.2f} ({steps_per_second / results[0]:.2f}x)"
+                                for num_threads, steps_per_second in enumerate(results, start=1))
+            print(f"  {learner_concurrency:<10} {scaling}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark of compile_model and learner_bf16_autocast, for each conv_net_arch. Times a learner step (Monobeast.learn,
+so forward, losses, backward and optimizer step) on synthetic Atari-shaped batches, and an actor's forward pass (one
+step for envs_per_actor environments, without gradients), each eagerly in float32 and with the options enabled.
+
+Usage (from the repository root):
+    python -m benchmarks.model_acceleration_benchmark [--archs orig 8xorig 32xorig impala_res_cnn] [--device cpu]
+"""
+
+import argparse
+import tempfile
+import threading
+import timeit
+import types
+
+import gymnasium as gym
+import numpy as np
+import torch
+
+from continual_rl.policies.impala.impala_policy import ImpalaPolicy
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+
+OBSERVATION_SHAPE = (4, 1, 84, 84)
+NUM_ACTIONS = 6
+
+# (compile_model, learner_bf16_autocast)
+VARIANTS = {
+    "eager fp32": (False, False),
+    "compiled": (True, False),
+    "bf16": (False, True),
+    "compiled bf16": (True, True),
+}
+
+
+def create_monobeast(args, arch, compile_model, learner_bf16_autocast, output_dir):
+    config = ImpalaPolicyConfig()
+    config.device = args.device
+    config.batch_size = args.batch_size
+    config.unroll_length = args.unroll_length
+    config.conv_net_arch = arch
+    config.compile_model = compile_model
+    config.learner_bf16_autocast = learner_bf16_autocast
+    config.set_output_dir(output_dir)
+
+    observation_space = gym.spaces.Box(low=0, high=255, shape=OBSERVATION_SHAPE, dtype=np.uint8)
+    action_spaces = {0: gym.spaces.Discrete(NUM_ACTIONS)}
+    return ImpalaPolicy(config, observation_space, action_spaces).impala_trainer
+
+
+def create_batch(monobeast, T, B, device):
+    specs = monobeast.create_buffer_specs(T - 1, OBSERVATION_SHAPE, num_actions=NUM_ACTIONS)
+    batch = {}
+    for key, spec in specs.items():
+        dtype = spec.get("gather_dtype", spec["dtype"])  # As get_batch would produce it
+        shape = (T, B, *spec["size"][1:])
+        if dtype == torch.float32:
+            batch[key] = torch.randn(shape)
+        elif dtype == torch.bool:
+            batch[key] = torch.zeros(shape, dtype=torch.bool)
+        else:
+            batch[key] = torch.randint(0, NUM_ACTIONS, shape).to(dtype)
+    return {key: value.to(device) for key, value in batch.items()}
+
+
+def time_per_call(fn, args):
+    for _ in range(args.warmup):  # Including compilation, for the compiled variants
+        fn()
+
+    return min(timeit.repeat(fn, number=args.steps, repeat=3)) / args.steps
+
+
+def time_learner_step(monobeast, args):
+    task_flags = types.SimpleNamespace(action_space_id=0, task_id=0)
+    batch = create_batch(monobeast, args.unroll_length + 1, args.batch_size, monobeast._model_flags.device)
+    learn_lock = threading.Lock()
+
+    def step():
+        monobeast.learn(monobeast._model_flags, task_flags, monobeast.actor_model, monobeast.learner_model, batch,
+                        (), monobeast.optimizer, None, learn_lock)
+        if monobeast._model_flags.device.type == "cuda":
+            torch.cuda.synchronize()
+
+    return time_per_call(step, args)
+
+
+def time_actor_step(monobeast, args):
+    inputs = create_batch(monobeast, 1, args.envs_per_actor, "cpu")
+
+    def step():
+        with torch.no_grad():
+            monobeast.actor_model(inputs, 0)
+
+    return time_per_call(step, args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--archs", nargs="+", default=["orig", "8xorig", "32xorig", "impala_res_cnn"])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--unroll_length", type=int, default=20)
+    parser.add_argument("--envs_per_actor", type=int, default=1, help="The actor forward's batch size")
+    parser.add_argument("--torch_threads", type=int, default=None, help="Intra-op threads, default torch's")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.torch_threads is not None:
+        torch.set_num_threads(args.torch_threads)
+
+    print(f"ms per learner step (T={args.unroll_length} B={args.batch_size}, on {args.device}) and per actor "
+          f"forward (B={args.envs_per_actor}, on cpu), with speedups over eager fp32")
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for arch in args.archs:
+            print(f"  {arch}")
+            baseline = None
+            for name, (compile_model, learner_bf16_autocast) in VARIANTS.items():
+                monobeast = create_monobeast(args, arch, compile_model, learner_bf16_autocast, output_dir)
+                flags = monobeast._model_flags
+                if (compile_model and not flags.compile_model) or \
+                        (learner_bf16_autocast and not flags.learner_bf16_autocast):
+                    print(f"    {name:<14} unsupported here, skipped")
+                    continue
+
+                learner_time = time_learner_step(monobeast, args)
+                actor_time = time_actor_step(monobeast, args) if not learner_bf16_autocast else None
+                baseline = baseline or (learner_time, actor_time)
+
+                result = f"    {name:<14} learner {learner_time * 1000:8.2f} ({baseline[0] / learner_time:.2f}x)"
+                if actor_time is not None:  # Actors don't autocast, so the bf16 variants match the fp32 ones
+                    result += f"  actor {actor_time * 1000:7.2f} ({baseline[1] / actor_time:.2f}x)"
+                print(result)
+
+
+if __name__ == "__main__":
+    main()
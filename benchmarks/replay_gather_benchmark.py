@@ -0,0 +1,97 @@
+"""
+Benchmark of gathering a replay batch from file-backed replay buffers (as CLEAR and EWC do): stacking each sampled
+entry in the order sampled (as before), versus replay_storage's gather, in sorted order, with and without a
+preallocated destination, and versus one index_select per key (which needs a second copy to transpose the entries into
+the (T + 1, B, ...) layout). Reports the time per batch for each batch size and buffer size, with the buffers in the
+page cache (i.e. this measures the gather, not the disk).
+
+Usage (from the repository root):
+    python -m benchmarks.replay_gather_benchmark [--batch_sizes 8 32 128] [--buffer_frames 10000 40000]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from continual_rl.policies.impala.torchbeast.core import replay_storage
+
+NUM_ACTORS = 32
+UNROLL_LENGTH = 20
+OBSERVATION_SHAPE = (4, 84, 84)
+NUM_ACTIONS = 18
+
+
+def create_specs():
+    return dict(frame=dict(size=(UNROLL_LENGTH + 1, *OBSERVATION_SHAPE), dtype=torch.uint8),
+                reward=dict(size=(UNROLL_LENGTH + 1,), dtype=torch.float32),
+                done=dict(size=(UNROLL_LENGTH + 1,), dtype=torch.bool),
+                policy_logits=dict(size=(UNROLL_LENGTH + 1, NUM_ACTIONS), dtype=torch.float32),
+                action=dict(size=(UNROLL_LENGTH + 1,), dtype=torch.int64))
+
+
+def time_per_call(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark(buffers, batch_size, repeats):
+    num_actors, entries_per_actor = buffers["frame"].shape[:2]
+    random_state = np.random.RandomState(0)
+    actor_indices = random_state.randint(0, num_actors, size=batch_size)
+    entry_indices = random_state.randint(0, entries_per_actor, size=batch_size)
+    out = {key: torch.empty((buffer.shape[2], batch_size, *buffer.shape[3:]), dtype=buffer.dtype)
+           for key, buffer in buffers.items()}
+
+    def stacked():
+        return {key: torch.stack([buffers[key][actor_index][entry_index]
+                                  for actor_index, entry_index in zip(actor_indices, entry_indices)], dim=1)
+                for key in buffers}
+
+    def index_selected():
+        flat_indices, _ = torch.sort(torch.as_tensor(actor_indices * entries_per_actor + entry_indices))
+        return {key: buffer.view(-1, *buffer.shape[2:]).index_select(0, flat_indices).transpose(0, 1).contiguous()
+                for key, buffer in buffers.items()}
+
+    return {"stack": time_per_call(stacked, repeats),
+            "index_select": time_per_call(index_selected, repeats),
+            "gather": time_per_call(
+                lambda: replay_storage.gather_replay_entries(buffers, actor_indices, entry_indices), repeats),
+            "gather_out": time_per_call(
+                lambda: replay_storage.gather_replay_entries(buffers, actor_indices, entry_indices, out=out), repeats)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--buffer_frames", type=int, nargs="+", default=[10000, 40000],
+                        help="replay_buffer_frames, as CLEAR is configured")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    print("Time per replay batch (speedup over stack)")
+
+    for buffer_frames in args.buffer_frames:
+        entries_per_actor = max(buffer_frames // (UNROLL_LENGTH * NUM_ACTORS), 1)
+        with tempfile.TemporaryDirectory() as permanent_path:
+            buffers, _, _ = replay_storage.create_replay_buffers(permanent_path, create_specs(), NUM_ACTORS,
+                                                                 entries_per_actor)
+            for buffer in buffers.values():
+                buffer.view(-1).numpy()[:] = 1  # Touch every page, so it's resident
+
+            for batch_size in args.batch_sizes:
+                results = benchmark(buffers, batch_size, args.repeats)
+                summary = "  ".join(f"{name} {result * 1000:.2f}ms ({results['stack'] / result:.2f}x)"
+                                    for name, result in results.items())
+                print(f"  frames={buffer_frames:<9} B={batch_size:<4} {summary}")
+            del buffers
+
+
+if __name__ == "__main__":
+    main()
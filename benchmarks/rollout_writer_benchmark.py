@@ -0,0 +1,126 @@
+"""
+Microbenchmark of an actor's per-step overhead outside the model: stepping its environments and writing the step
+into the shared rollout buffers. Compares the original path (each Environment.step allocating its outputs, which are
+concatenated across envs and copied into each env's buffer slot key by key) against the RolloutWriter, where the
+environments write in place and each key is committed to every slot at once. The environment itself is a trivial
+frame-stacked one, so what's measured is the overhead.
+
+Usage (from the repository root):
+    python -m benchmarks.rollout_writer_benchmark [--envs_per_actor 1] [--frame_size 84] [--stack_size 4]
+"""
+
+import argparse
+import timeit
+
+import torch
+
+from continual_rl.policies.impala.torchbeast.core import environment
+from continual_rl.policies.impala.torchbeast.core.rollout_writer import RolloutWriter
+from continual_rl.utils.env_wrappers import LazyFrames
+
+
+class StackedFramesEnv(object):
+    """
+    Returns LazyFrames, like FrameStack, with a fixed-length episode.
+    """
+    def __init__(self, frame_size, stack_size, episode_length=1000):
+        self._frames = [torch.zeros((frame_size, frame_size), dtype=torch.uint8) for _ in range(stack_size)]
+        self._episode_length = episode_length
+        self._step = 0
+
+    def reset(self):
+        self._step = 0
+        return LazyFrames(list(self._frames))
+
+    def step(self, action):
+        self._step += 1
+        return LazyFrames(list(self._frames)), 1.0, self._step >= self._episode_length, {}
+
+    def close(self):
+        pass
+
+
+def create_buffers(num_buffers, unroll_length, observation_shape, num_actions):
+    T = unroll_length
+    specs = dict(
+        frame=dict(size=(T + 1, *observation_shape), dtype=torch.uint8),
+        reward=dict(size=(T + 1,), dtype=torch.float32),
+        done=dict(size=(T + 1,), dtype=torch.bool),
+        episode_return=dict(size=(T + 1,), dtype=torch.float32),
+        episode_step=dict(size=(T + 1,), dtype=torch.int32),
+        policy_logits=dict(size=(T + 1, num_actions), dtype=torch.float32),
+        baseline=dict(size=(T + 1,), dtype=torch.float32),
+        last_action=dict(size=(T + 1,), dtype=torch.int64),
+        action=dict(size=(T + 1,), dtype=torch.int64),
+    )
+    return {key: torch.zeros((num_buffers, *spec["size"]), dtype=spec["dtype"]).share_memory_()
+            for key, spec in specs.items()}
+
+
+def original_unroll(envs, buffers, indices, agent_output, unroll_length):
+    for t in range(unroll_length):
+        env_outputs = [env.step(agent_output["action"][:, env_id:env_id + 1]) for env_id, env in enumerate(envs)]
+        if len(env_outputs) == 1:
+            env_output = env_outputs[0]
+        else:
+            env_output = {key: torch.cat([output[key].reshape(1, 1, *output[key].shape[2:])
+                                          for output in env_outputs], dim=1)
+                          for key in env_outputs[0]}
+
+        for env_id, index in enumerate(indices):
+            for key in env_output:
+                buffers[key][index][t + 1, ...] = env_output[key][0, env_id]
+            for key in agent_output:
+                buffers[key][index][t + 1, ...] = agent_output[key][0, env_id]
+
+
+def rollout_writer_unroll(envs, rollout_writer, indices, agent_output, unroll_length):
+    rollout_writer.begin_unroll(indices)
+    for t in range(unroll_length):
+        for env_id, env in enumerate(envs):
+            env.step(agent_output["action"][:, env_id:env_id + 1], out=rollout_writer.env_output_views[env_id])
+
+        rollout_writer.write_env_output(t + 1)
+        rollout_writer.write_agent_output(t + 1, agent_output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--envs_per_actor", type=int, default=1)
+    parser.add_argument("--frame_size", type=int, default=84)
+    parser.add_argument("--stack_size", type=int, default=4)
+    parser.add_argument("--unroll_length", type=int, default=80)
+    parser.add_argument("--num_actions", type=int, default=18)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    B, T = args.envs_per_actor, args.unroll_length
+    observation_shape = (args.stack_size, args.frame_size, args.frame_size)
+    buffers = create_buffers(2 * B, T, observation_shape, args.num_actions)
+    indices = list(range(1, 2 * B, 2))  # Non-contiguous slots, as an actor would usually get
+    agent_output = dict(
+        policy_logits=torch.randn((1, B, args.num_actions)),
+        baseline=torch.randn((1, B)),
+        action=torch.randint(0, args.num_actions, (1, B)),
+    )
+
+    envs = [environment.Environment(StackedFramesEnv(args.frame_size, args.stack_size)) for _ in range(B)]
+    for env in envs:
+        env.initial()
+    original_time = min(timeit.repeat(lambda: original_unroll(envs, buffers, indices, agent_output, T),
+                                      number=args.repeats, repeat=5))
+
+    rollout_writer = RolloutWriter(buffers, B, observation_shape)
+    for env, env_output_view in zip(envs, rollout_writer.env_output_views):
+        env.initial(out=env_output_view)
+    writer_time = min(timeit.repeat(lambda: rollout_writer_unroll(envs, rollout_writer, indices, agent_output, T),
+                                    number=args.repeats, repeat=5))
+
+    num_steps = args.repeats * T
+    print(f"Actor step overhead (env step + buffer writes), envs_per_actor={B} observation={observation_shape}")
+    print(f"  original:      {original_time / num_steps * 1e6:.1f} us/step")
+    print(f"  RolloutWriter: {writer_time / num_steps * 1e6:.1f} us/step ({original_time / writer_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
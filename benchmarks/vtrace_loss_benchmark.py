@@ -0,0 +1,99 @@
+"""
+Microbenchmark of the IMPALA V-trace + loss computation. Compares the unfused path (vtrace.from_logits, then each
+loss computing its own log-softmax), with both the original Python-loop recursion and the TorchScript scan, against
+vtrace.fused_from_logits_and_loss. Times forward and backward together.
+
+Usage (from the repository root):
+    python -m benchmarks.vtrace_loss_benchmark [--unroll_length 80] [--batch_size 32] [--device cpu]
+"""
+
+import argparse
+import timeit
+
+import torch
+from torch.nn import functional as F
+
+from continual_rl.policies.impala.torchbeast.core import vtrace
+
+
+def python_loop_vs_minus_v_xs(deltas, discounts, cs):
+    acc = torch.zeros_like(deltas[0])
+    result = []
+    for t in range(discounts.shape[0] - 1, -1, -1):
+        acc = deltas[t] + discounts[t] * cs[t] * acc
+        result.append(acc)
+    result.reverse()
+    return torch.stack(result)
+
+
+def unfused_loss(behavior_policy_logits, target_policy_logits, actions, discounts, rewards, values, bootstrap_value):
+    vtrace_returns = vtrace.from_logits(behavior_policy_logits, target_policy_logits, actions, discounts, rewards,
+                                        values, bootstrap_value)
+    cross_entropy = F.nll_loss(F.log_softmax(torch.flatten(target_policy_logits, 0, 1), dim=-1),
+                               target=torch.flatten(actions, 0, 1), reduction="none").view_as(actions)
+    pg_loss = torch.sum(cross_entropy * vtrace_returns.pg_advantages.detach())
+    baseline_loss = 0.5 * 0.5 * torch.sum((vtrace_returns.vs - values) ** 2)
+    entropy_loss = 0.0006 * torch.sum(F.softmax(target_policy_logits, dim=-1) *
+                                      F.log_softmax(target_policy_logits, dim=-1))
+    return pg_loss + baseline_loss + entropy_loss
+
+
+def fused_loss(behavior_policy_logits, target_policy_logits, actions, discounts, rewards, values, bootstrap_value):
+    fused = vtrace.fused_from_logits_and_loss(behavior_policy_logits, target_policy_logits, actions, discounts,
+                                              rewards, values, bootstrap_value, baseline_cost=0.5,
+                                              entropy_cost=0.0006)
+    return fused.pg_loss + fused.baseline_loss + fused.entropy_loss
+
+
+def benchmark(loss_fn, inputs, device, repeats):
+    def step():
+        target_policy_logits = inputs[1].detach().requires_grad_()
+        values = inputs[5].detach().requires_grad_()
+        loss = loss_fn(inputs[0], target_policy_logits, inputs[2], inputs[3], inputs[4], values, inputs[6])
+        loss.backward()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    for _ in range(10):  # Warmup (including the TorchScript compilation)
+        step()
+
+    return min(timeit.repeat(step, number=repeats, repeat=5)) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unroll_length", type=int, default=80)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--num_actions", type=int, default=18)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    T, B, A = args.unroll_length, args.batch_size, args.num_actions
+    inputs = (
+        torch.randn((T, B, A), device=device),  # behavior_policy_logits
+        torch.randn((T, B, A), device=device),  # target_policy_logits
+        torch.randint(0, A, (T, B), device=device),  # actions
+        (torch.rand((T, B), device=device) > 0.05).float() * 0.99,  # discounts
+        torch.randn((T, B), device=device),  # rewards
+        torch.randn((T, B), device=device),  # values
+        torch.randn((B,), device=device),  # bootstrap_value
+    )
+
+    scan = vtrace._vs_minus_v_xs_scan
+    vtrace._vs_minus_v_xs_scan = python_loop_vs_minus_v_xs
+    original_time = benchmark(unfused_loss, inputs, device, args.repeats)
+    vtrace._vs_minus_v_xs_scan = scan
+
+    unfused_time = benchmark(unfused_loss, inputs, device, args.repeats)
+    fused_time = benchmark(fused_loss, inputs, device, args.repeats)
+
+    print(f"V-trace + loss, forward and backward, T={T} B={B} actions={A} on {device}")
+    print(f"  original (Python loop): {original_time * 1000:.3f} ms")
+    print(f"  unfused (scan):         {unfused_time * 1000:.3f} ms ({original_time / unfused_time:.2f}x)")
+    print(f"  fused (scan):           {fused_time * 1000:.3f} ms ({original_time / fused_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
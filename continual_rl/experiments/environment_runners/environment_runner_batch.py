@@ -14,13 +14,14 @@ class EnvironmentRunnerBatch(EnvironmentRunnerBase):
     The arguments provided to collect_data are from the task.
     """
     def __init__(self, policy, num_parallel_envs, timesteps_per_collection, render_collection_freq=None,
-                 output_dir=None):
+                 output_dir=None, resource_planner=None):
         super().__init__()
         self._policy = policy
         self._num_parallel_envs = num_parallel_envs
         self._timesteps_per_collection = timesteps_per_collection
         self._render_collection_freq = render_collection_freq  # In timesteps
         self._output_dir = output_dir
+        self._resource_planner = resource_planner  # Sets each environment worker's threads and CPUs, if provided
 
         self._parallel_env = None
         self._last_observations = None  # To allow returning mid-episode
@@ -39,7 +40,7 @@ class EnvironmentRunnerBatch(EnvironmentRunnerBase):
     def _initialize_envs(self, env_spec, preprocessor):
         if self._parallel_env is None:
             env_specs = [env_spec for _ in range(self._num_parallel_envs)]
-            self._parallel_env = ParallelEnv(env_specs, self._output_dir)
+            self._parallel_env = ParallelEnv(env_specs, self._output_dir, self._resource_planner)
 
         # Initialize the observation time-batch with n of the first observation.
         results = self._parallel_env.reset()
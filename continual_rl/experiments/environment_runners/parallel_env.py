@@ -31,7 +31,10 @@ import cloudpickle
 from continual_rl.utils.utils import Utils
 
 
-def worker(conn, env_spec, output_dir):
+def worker(conn, env_spec, output_dir, resource_planner, worker_index):
+    if resource_planner is not None:
+        resource_planner.apply("env_worker", worker_index)
+
     env_spec = cloudpickle.loads(env_spec)
     env, seed = Utils.make_env(env_spec, create_seed=True)
 
@@ -59,7 +62,7 @@ def worker(conn, env_spec, output_dir):
 class ParallelEnv(gym.Env):
     """A concurrent execution of environments in multiple processes."""
 
-    def __init__(self, envs, output_dir):
+    def __init__(self, envs, output_dir, resource_planner=None):
         assert len(envs) >= 1, "No environment given."
 
         self._env_specs = envs
@@ -75,12 +78,12 @@ class ParallelEnv(gym.Env):
             logger.info(f"Created env with seed {seed}")
 
         self.locals = []
-        for env_spec in self._env_specs[1:]:
+        for worker_index, env_spec in enumerate(self._env_specs[1:]):
             local, remote = Pipe()
             self.locals.append(local)
 
             pickled_spec = cloudpickle.dumps(env_spec)
-            p = Process(target=worker, args=(remote, pickled_spec, output_dir))
+            p = Process(target=worker, args=(remote, pickled_spec, output_dir, resource_planner, worker_index))
             p.daemon = True
             p.start()
             remote.close()
@@ -1,5 +1,6 @@
 import os
 import json
+from continual_rl.utils.checkpoint_writer import CheckpointFile, get_checkpoint_writer, write_json
 
 
 class RunMetadata(object):
@@ -28,6 +29,7 @@ class RunMetadata(object):
         return os.path.join(self._output_dir, "run_metadata.json")
 
     def load(self):
+        get_checkpoint_writer().flush()  # In case it's still being written
         path = self._get_path()
         if os.path.exists(path):
             with open(path, "r") as metadata_file:
@@ -41,6 +43,5 @@ class RunMetadata(object):
         self._metadata["task_timesteps"] = task_timesteps
         self._metadata["total_train_timesteps"] = total_train_timesteps
 
-        path = self._get_path()
-        with open(path, "w+") as metadata_file:
-            json.dump(self._metadata, metadata_file)
+        # Written by the same writer as the policy's checkpoints, so in order with them
+        get_checkpoint_writer().submit([CheckpointFile(self._get_path(), write_json, dict(self._metadata))])
@@ -69,6 +69,8 @@ class TaskBase(ABC):
             summary_writer.add_scalar(tag, value, global_step=timestep)
         elif type == "image":
             summary_writer.add_image(tag, value, global_step=timestep)
+        elif type == "histogram":
+            summary_writer.add_histogram(tag, np.array(value), global_step=timestep)
 
         summary_writer.flush()
 
@@ -2,17 +2,33 @@ import numpy as np
 import torch
 import threading
 import os
+import time
 from torch.nn import functional as F
 import queue
-from continual_rl.policies.impala.torchbeast.monobeast import Monobeast, Buffers
+from continual_rl.policies.clear.reservoir_index import ReservoirIndex
+from continual_rl.policies.impala.torchbeast.core import replay_storage
+from continual_rl.policies.impala.torchbeast.core.batch_prefetcher import BatchPrefetcher
+from continual_rl.policies.impala.torchbeast.monobeast import Monobeast
 from continual_rl.utils.utils import Utils
 
 
+class ReplayAugmentedBatch(dict):
+    """
+    A batch augmented with replay entries, which keeps the replay batch it was augmented with, so the cloning losses
+    can be computed on exactly the entries it's trained with.
+    """
+    def __init__(self, batch, replay_batch):
+        super().__init__(batch)
+        self.replay_batch = replay_batch
+
+
 class ClearMonobeast(Monobeast):
     """
     An implementation of Experience Replay for Continual Learning (Rolnick et al, 2019):
     https://arxiv.org/pdf/1811.11682.pdf
     """
+    # The cloning losses also need the baselines the replayed unrolls were acted with
+    BUFFER_FIELDS = Monobeast.BUFFER_FIELDS + ("baseline",)
 
     def __init__(self, model_flags, observation_space, action_spaces, policy_class):
         super().__init__(model_flags, observation_space, action_spaces, policy_class)
@@ -53,13 +69,33 @@ class ClearMonobeast(Monobeast):
             buffers_existed,
         )
         self._replay_lock = threading.Lock()
+        self._replay_lock_pid = os.getpid()
+
+        # Which entries of each actor's section are filled, and which is next to be replaced (rebuilt from the
+        # reservoir values if the buffers are being reloaded)
+        self._reservoir_indices = [ReservoirIndex(reservoir_vals)
+                                   for reservoir_vals in self._replay_buffers["reservoir_val"]]
+
+        # One random generator per thread of each process (np.random directly is not thread-safe)
+        self._random_states = threading.local()
+        self._replay_destinations = threading.local()
 
-        # Each replay batch needs to also have cloning losses applied to it
-        # Keep track of them as they're generated, to ensure we apply losses to all. This doesn't currently
-        # guarantee order - i.e. one learner thread might get one replay batch for training and a different for cloning
-        self._replay_batches_for_loss = queue.Queue()
+        # If replay_prefetch_queue_depth is set, replay batches are sampled ahead of the learners (see
+        # _get_replay_sampler)
+        self._replay_sampler = None
+        self._replay_sampler_lock = threading.Lock()
+        self._replay_sampler_pid = os.getpid()
+
+        # The replay batch of the batch each learner thread is computing the loss of (see compute_loss)
+        self._loss_replay_batches = threading.local()
+
+    def cleanup(self):
+        super().cleanup()
+        self._stop_replay_sampler()
 
     def permanent_delete(self):
+        self._stop_replay_sampler()
+        super().permanent_delete()
         for file_path in self._temp_files:
             os.remove(file_path)
 
@@ -84,58 +120,65 @@ class ClearMonobeast(Monobeast):
 
         Each buffer entry has unroll_length size, so the number of frames stored is (roughly, because of integer
         rounding): num_actors * entries_per_buffer * unroll_length
+
+        Each key's num_actors buffers are sections of one contiguous file, so a batch can be gathered from all of them
+        at once (see replay_storage). If compress_replay_frames is set, frames are instead stored compressed.
         """
         # Get the standard specs, and also add the CLEAR-specific reservoir value
         specs = self.create_buffer_specs(model_flags.unroll_length, obs_shape, num_actions)
         # Note: one reservoir value per row
         specs["reservoir_val"] = dict(size=(1,), dtype=torch.float32)
-        buffers: Buffers = {key: [] for key in specs}
-
-        # Hold on to the file handle so it does not get deleted. Technically optional, as at least linux will
-        # keep the file open even after deletion, but this way it is still visible in the location it was created
-        temp_files = []
-
-        for actor_id in range(model_flags.num_actors):
-            for key in buffers:
-                shape = (entries_per_buffer, *specs[key]["size"])
-                permanent_file_name = f"replay_{actor_id}_{key}.fbt"
-                new_tensor, file_name, temp_file = Utils.create_file_backed_tensor(
-                    permanent_path,
-                    shape,
-                    specs[key]["dtype"],
-                    permanent_file_name=permanent_file_name,
-                )
-
-                # reservoir_val needs to be 0'd out so we can use it to see if a row is filled
-                # but this operation is slow, so leave the rest as-is
-                # Only do this if we created the buffers anew
-                if not buffers_existed and key == "reservoir_val":
-                    new_tensor.zero_()
-
-                buffers[key].append(new_tensor)
-                temp_files.append(file_name)
 
-        return buffers, temp_files
+        buffers, temp_files, created_keys = replay_storage.create_replay_buffers(
+            permanent_path, specs, model_flags.num_actors, entries_per_buffer,
+            compressed_keys=("frame",) if model_flags.compress_replay_frames else (),
+            compression_level=model_flags.replay_compression_level,
+            decompression_workers=model_flags.replay_decompression_workers)
 
-    def _get_replay_buffer_filled_indices(self, replay_buffers, actor_index):
-        """
-        Get the indices in the replay buffer corresponding to the actor_index.
-        """
-        # We know that the reservoir value > 0 if it's been filled, so check for entries where it == 0
-        buffer_indicator = replay_buffers['reservoir_val'][actor_index].squeeze(1)
-        replay_indices = np.where(buffer_indicator != 0)[0]
-        return replay_indices
+        # reservoir_val needs to be 0'd out so we can use it to see if a row is filled
+        # but this operation is slow, so leave the rest as-is
+        # Only do this if we created the buffers anew (including if only some are new, e.g. because frames were
+        # previously stored uncompressed, since then the entries are incomplete)
+        if not buffers_existed or len(created_keys) > 0:
+            buffers["reservoir_val"].zero_()
 
-    def _get_actor_unfilled_indices(self, actor_index, entries_per_buffer):
+        return buffers, temp_files
+
+    def _get_replay_destination(self, entry_count):
         """
-        Get the unfilled entries in the actor's subset of the replay buffer using a set difference.
+        Replay batches are gathered into pinned memory kept per learner thread, if they're being moved to the GPU, so
+        they can be copied without first being staged. (On the CPU the gathered batch is what's trained on, and stored
+        for the cloning losses, so it can't be reused.)
         """
-        filled_indices = set(
-            self._get_replay_buffer_filled_indices(self._replay_buffers, actor_index)
-        )
-        actor_id_set = set(range(0, entries_per_buffer))
-        unfilled_indices = actor_id_set - filled_indices
-        return unfilled_indices
+        if torch.device(self._model_flags.device).type != "cuda" or not torch.cuda.is_available():
+            return None
+
+        destinations = getattr(self._replay_destinations, "by_count", None)
+        if destinations is None:
+            destinations = {}
+            self._replay_destinations.by_count = destinations
+
+        if entry_count not in destinations:
+            destinations[entry_count] = {key: torch.empty((buffer.shape[2], entry_count, *buffer.shape[3:]),
+                                                          dtype=buffer.dtype, pin_memory=True)
+                                         for key, buffer in self._replay_buffers.items()}
+
+        return destinations[entry_count]
+
+    def _get_replay_lock(self):
+        # Serializes the replay buffers' use within a process. A forked process (e.g. an actor) gets its own, since the
+        # one it was forked with may have been held by a thread (e.g. the replay sampler) that doesn't exist in it.
+        if self._replay_lock_pid != os.getpid():
+            self._replay_lock_pid = os.getpid()
+            self._replay_lock = threading.Lock()
+        return self._replay_lock
+
+    def _get_random_state(self):
+        # Created on first use in each thread, and again in forked processes, so they don't share a sequence
+        if getattr(self._random_states, "pid", None) != os.getpid():
+            self._random_states.pid = os.getpid()
+            self._random_states.random_state = np.random.RandomState()
+        return self._random_states.random_state
 
     def _compute_policy_cloning_loss(self, old_logits, curr_logits):
         # KLDiv requires inputs to be log-probs, and targets to be probs
@@ -148,15 +191,9 @@ class ClearMonobeast(Monobeast):
         return torch.sum((curr_value - old_value.detach()) ** 2)
 
     def get_min_reservoir_val_greater_than_zero(self):
-        reservoir_vals = torch.stack(self._replay_buffers['reservoir_val'])
-        vals_gt_zero = reservoir_vals[reservoir_vals > 0]
-
-        if len(vals_gt_zero) > 0:
-            min_val = vals_gt_zero.min()
-        else:
-            min_val = 0
-
-        return min_val
+        min_vals = [reservoir_index.min_reservoir_val() for reservoir_index in self._reservoir_indices]
+        min_vals = [min_val for min_val in min_vals if min_val is not None]
+        return min(min_vals) if len(min_vals) > 0 else 0
 
     def on_act_unroll_complete(self, task_flags, actor_index, agent_output, env_output, new_buffers):
         """
@@ -164,39 +201,59 @@ class ClearMonobeast(Monobeast):
         """
         # Compute a reservoir_val for the new entry, then, if the buffer is filled, throw out the entry with the lowest
         # reservoir_val and replace it with the new one. If the buffer it not filled, simply put it in the next spot
-        # Using a new RandomState() because using np.random directly is not thread-safe
-        random_state = np.random.RandomState()
+        random_state = self._get_random_state()
 
         # > 0 so we can use reservoir_val==0 to indicate unfilled
         new_entry_reservoir_val = random_state.uniform(0.001, 1.0) if "reservoir_val" not in new_buffers.keys() else new_buffers["reservoir_val"].item()
-        to_populate_replay_index = None
-        unfilled_indices = self._get_actor_unfilled_indices(actor_index, self._entries_per_buffer)
+        reservoir_index = self._reservoir_indices[actor_index]
+        to_populate_replay_index = reservoir_index.get_entry_to_fill(new_entry_reservoir_val)
 
-        actor_replay_reservoir_vals = self._replay_buffers['reservoir_val'][actor_index]
+        # Do the replacement into the buffer, then record it (updating the reservoir_vals)
+        if to_populate_replay_index is not None:
+            with self._get_replay_lock():
+                replay_storage.write_replay_entry(
+                    self._replay_buffers, actor_index, to_populate_replay_index,
+                    {key: value for key, value in new_buffers.items() if key != 'reservoir_val'})
+                reservoir_index.set_entry(to_populate_replay_index, new_entry_reservoir_val)
 
-        if len(unfilled_indices) > 0:
-            current_replay_index = min(unfilled_indices)
-            to_populate_replay_index = current_replay_index
+    def get_batch_for_training(self, batch, reuse_actor_indices=False, replay_entry_scale=1.0):
+        """
+        Augment the batch with entries from our replay buffer. The augmented batch keeps the replay batch, for
+        custom_loss to compute the cloning losses on.
+        """
+        replay_entry_count = int(self._model_flags.batch_size * self._model_flags.batch_replay_ratio * replay_entry_scale)
+        assert replay_entry_count > 0, "Attempting to run CLEAR without actually using any replay buffer entries."
+
+        # Training batches take a replay batch sampled ahead of time, if there's anything to sample. (If one's
+        # somehow not ready in time, sample it here instead.)
+        replay_batch = None
+        replay_sampler = self._get_replay_sampler() if batch is not None else None
+        if replay_sampler is not None and not reuse_actor_indices and replay_entry_scale == 1.0:
+            any_filled = any(reservoir_index.num_filled > 0 for reservoir_index in self._reservoir_indices)
+            try:
+                replay_batch = replay_sampler.get(timeout=1 if any_filled else 0)
+            except queue.Empty:
+                pass
+
+        if replay_batch is None:
+            replay_batch = self._sample_replay_batch(replay_entry_count, reuse_actor_indices)
+
+        if replay_batch is None:
+            combo_batch = batch
+        elif batch is not None:
+            # Combine the replay in with the recent entries
+            combo_batch = ReplayAugmentedBatch({
+                key: torch.cat((batch[key], replay_batch[key]), dim=1) for key in batch
+            }, replay_batch)
         else:
-            # If we've filled our quota, we need to find something to throw out.
-            reservoir_threshold = actor_replay_reservoir_vals.min()
+            combo_batch = replay_batch
 
-            # If our new value is higher than our existing minimum, replace that one with this new data
-            if new_entry_reservoir_val > reservoir_threshold:
-                to_populate_replay_index = np.argmin(actor_replay_reservoir_vals)
+        return combo_batch
 
-        # Do the replacement into the buffer, and update the reservoir_vals list
-        if to_populate_replay_index is not None:
-            with self._replay_lock:
-                actor_replay_reservoir_vals[to_populate_replay_index][0] = new_entry_reservoir_val
-                for key in new_buffers.keys():
-                    if key == 'reservoir_val':
-                        continue
-                    self._replay_buffers[key][actor_index][to_populate_replay_index][...] = new_buffers[key]
-
-    def get_batch_for_training(self, batch, store_for_loss=True, reuse_actor_indices=False, replay_entry_scale=1.0):
+    def _sample_replay_batch(self, replay_entry_count, reuse_actor_indices):
         """
-        Augment the batch with entries from our replay buffer.
+        :return: A batch of up to replay_entry_count replay entries, on the learner's device, or None if there are
+        none yet
         """
         # Select a random batch set of replay buffers to add also. Only select from ones that have been filled
         shuffled_subset = []  # Will contain a list of tuples of (actor_index, buffer_index)
@@ -204,12 +261,9 @@ class ClearMonobeast(Monobeast):
         # We only allow each actor to be sampled from once, to reduce variance, and for parity with the original
         # paper
         actor_indices = list(range(self._model_flags.num_actors))
-        replay_entry_count = int(self._model_flags.batch_size * self._model_flags.batch_replay_ratio * replay_entry_scale)
-        assert replay_entry_count > 0, "Attempting to run CLEAR without actually using any replay buffer entries."
+        random_state = self._get_random_state()
 
-        random_state = np.random.RandomState()
-
-        with self._replay_lock:
+        with self._get_replay_lock():
             # Select a random actor, and from that, a random buffer entry.
             for _ in range(replay_entry_count):
                 # Pick an actor and remove it from our options
@@ -218,62 +272,98 @@ class ClearMonobeast(Monobeast):
                 if not reuse_actor_indices and not self._model_flags.always_reuse_actor_indices:
                     actor_indices.remove(actor_index)
 
-                # From that actor's set of available indices, pick one randomly.
-                replay_indices = self._get_replay_buffer_filled_indices(self._replay_buffers, actor_index=actor_index)
-                if len(replay_indices) > 0:
-                    buffer_index = random_state.choice(replay_indices)
+                # From that actor's set of filled entries, pick one randomly.
+                buffer_index = self._reservoir_indices[actor_index].sample(random_state)
+                if buffer_index is not None:
                     shuffled_subset.append((actor_index, buffer_index))
 
-            if len(shuffled_subset) > 0:
-                replay_batch = {
-                    # Get the actor_index and entry_id from the raw id
-                    key: torch.stack([self._replay_buffers[key][actor_id][buffer_id]
-                                      for actor_id, buffer_id in shuffled_subset], dim=1)
-                    for key in self._replay_buffers
-                }
-
-                replay_entries_retrieved = torch.sum(replay_batch["reservoir_val"] > 0)
-                assert replay_entries_retrieved <= replay_entry_count, \
-                    f"Incorrect replay entries retrieved. Expected at most {replay_entry_count} got {replay_entries_retrieved}"
-
-                replay_batch = {
-                    k: t.to(device=self._model_flags.device, non_blocking=True)
-                    for k, t in replay_batch.items()
-                }
-
-                # Combine the replay in with the recent entries
-                if batch is not None:
-                    combo_batch = {
-                        key: torch.cat((batch[key], replay_batch[key]), dim=1) for key in batch
-                    }
-                else:
-                    combo_batch = replay_batch
-
-                # Store the batch so we can generate some losses with it
-                if store_for_loss:
-                    self._replay_batches_for_loss.put(replay_batch)
-
-            else:
-                combo_batch = batch
+            if len(shuffled_subset) == 0:
+                return None
 
-        return combo_batch
+            actor_ids, buffer_ids = zip(*shuffled_subset)
+            destination = self._get_replay_destination(len(shuffled_subset))
+            replay_batch = replay_storage.gather_replay_entries(self._replay_buffers, actor_ids, buffer_ids,
+                                                               out=destination)
 
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
+            replay_batch = self.expand_deduplicated_frames(replay_batch)
+
+            replay_entries_retrieved = torch.sum(replay_batch["reservoir_val"] > 0)
+            assert replay_entries_retrieved <= replay_entry_count, \
+                f"Incorrect replay entries retrieved. Expected at most {replay_entry_count} got {replay_entries_retrieved}"
+
+            replay_batch = self.move_batch_to_device(replay_batch)
+
+            # The copies to the device are asynchronous, so make sure they're done before the destination is reused
+            if destination is not None:
+                torch.cuda.current_stream().synchronize()
+
+        return replay_batch
+
+    def _get_replay_sampler(self):
+        """
+        If replay_prefetch_queue_depth is set, a background thread samples replay batches (gathering them, and moving
+        them to the device) ahead of the learners, which otherwise each sample their own. Started on first use in
+        each task, since it's only needed while training.
+        """
+        if self._model_flags.replay_prefetch_queue_depth <= 0:
+            return None
+
+        # A forked process (e.g. a learner process) doesn't have the thread, so needs its own
+        if self._replay_sampler_pid != os.getpid():
+            self._replay_sampler_pid = os.getpid()
+            self._replay_sampler = None
+            self._replay_sampler_lock = threading.Lock()
+
+        with self._replay_sampler_lock:
+            if self._replay_sampler is None:
+                replay_entry_count = int(self._model_flags.batch_size * self._model_flags.batch_replay_ratio)
+
+                def produce_replay_batch(timeout):
+                    replay_batch = self._sample_replay_batch(replay_entry_count, reuse_actor_indices=False)
+                    if replay_batch is None:  # Nothing has been stored yet
+                        time.sleep(timeout)
+                        raise queue.Empty()
+                    return replay_batch
+
+                self._replay_sampler = BatchPrefetcher(produce_replay_batch,
+                                                       self._model_flags.replay_prefetch_queue_depth)
+                self._replay_sampler.start()
+
+        return self._replay_sampler
+
+    def _stop_replay_sampler(self):
+        with self._replay_sampler_lock:
+            if self._replay_sampler is not None and self._replay_sampler_pid == os.getpid():
+                self._replay_sampler.stop()
+                self._replay_sampler = None
+
+    def compute_loss(self, model_flags, task_flags, learner_model, batch, initial_agent_state, with_custom_loss=True):
+        # custom_loss is given a copy of the batch, so gets the replay batch this batch was augmented with from here
+        self._loss_replay_batches.replay_batch = getattr(batch, "replay_batch", None)
+        try:
+            return super().compute_loss(model_flags, task_flags, learner_model, batch, initial_agent_state,
+                                        with_custom_loss=with_custom_loss)
+        finally:
+            self._loss_replay_batches.replay_batch = None
+
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs):
         """
         Compute the policy and value cloning losses
         """
-        # If the get doesn't happen basically immediately, it's not happening
         cloning_loss = torch.Tensor([0]).to(batch['frame'].device)
         stats = {}
 
-        try:
-            replay_batch = self._replay_batches_for_loss.get(timeout=5)
-        except queue.Empty:
-            replay_batch = None
+        # The replay batch the batch being trained on was augmented with, so the losses are always computed on the
+        # same replay entries the batch was trained with
+        replay_batch = getattr(self._loss_replay_batches, "replay_batch", None)
+        if replay_batch is None:
             print("Skipping CLEAR custom loss due to lack of replay_batch")
 
         if replay_batch is not None:
-            replay_learner_outputs, unused_state = model(replay_batch, task_flags.action_space_id, initial_agent_state)
+            # The replay entries were trained on as the last columns of the batch, so the outputs for them were
+            # already computed
+            num_replay_entries = replay_batch['policy_logits'].shape[1]
+            replay_learner_outputs = {key: value[:, -num_replay_entries:] for key, value in learner_outputs.items()}
 
             replay_batch_policy = replay_batch['policy_logits']
             current_policy = replay_learner_outputs['policy_logits']
@@ -290,5 +380,14 @@ class ClearMonobeast(Monobeast):
                 "policy_cloning_loss": policy_cloning_loss.item(),
                 "value_cloning_loss": value_cloning_loss.item(),
             }
+            stats.update(replay_storage.get_replay_stats(self._replay_buffers))
+
+            # How often, and how long, learners waited for a replay batch to be sampled
+            replay_sampler = self._replay_sampler
+            if replay_sampler is not None:
+                replay_sampler_stats = replay_sampler.get_stats()
+                if not np.isnan(replay_sampler_stats["prefetch_starved_fraction"]):
+                    stats["replay_prefetch_starved_fraction"] = replay_sampler_stats["prefetch_starved_fraction"]
+                    stats["replay_prefetch_wait_ms"] = replay_sampler_stats["prefetch_wait_ms_mean"]
 
         return cloning_loss, stats
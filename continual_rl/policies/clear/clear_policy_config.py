@@ -10,12 +10,23 @@ class ClearPolicyConfig(ImpalaPolicyConfig):
 
         self.replay_buffer_frames = 1e8
 
+        # If set, replay frames are stored zlib-compressed (at replay_compression_level, 0-9), each entry
+        # variable-length, trading CPU (compressing in the actors, and decompressing in replay_decompression_workers
+        # threads while sampling) for disk space. The compression ratio and batch read time are logged.
+        self.compress_replay_frames = False
+        self.replay_compression_level = 1
+        self.replay_decompression_workers = 2
+
         # The number of replay entries added to the batch = batch_replay_ratio * batch_size
         # CLEAR reports using a 50-50 mixture of novel and replay experiences
         # which corresponds to a batch_replay_ratio of 1.0
         self.batch_replay_ratio = 1.0
         self.always_reuse_actor_indices = False
 
+        # Sample (gather, and move to the device) up to this many replay batches in a background thread ahead of the
+        # learners. 0 samples each in the learner thread, while preparing its batch.
+        self.replay_prefetch_queue_depth = 0
+
         self.policy_cloning_cost = 0.01
         self.value_cloning_cost = 0.005
         self.large_file_path = None  # No default, since it can be very large and we want no surprises
@@ -0,0 +1,119 @@
+import numpy as np
+import torch
+
+
+class ReservoirIndex(object):
+    """
+    Tracks which entries of one actor's section of the replay buffer are filled, and which has the lowest reservoir
+    value (the next to be replaced), without scanning the section.
+
+    The filled entries are kept as a min-heap ordered by reservoir value, so the lowest is always at the root:
+    filling an entry or replacing the root is O(log n), and since the heap is also the list of filled entries, sampling
+    one uniformly is O(1). The heap lives in shared memory, so the actor process that writes the section and the
+    learner that samples from it see the same one.
+
+    reservoir_vals (file-backed, 0 for unfilled entries) remains the record of what's stored, and the heap is rebuilt
+    from it when the replay buffer is reloaded.
+    """
+
+    def __init__(self, reservoir_vals):
+        """
+        :param reservoir_vals: The section's (entries, 1) reservoir values, which are kept up to date
+        """
+        self._reservoir_vals = reservoir_vals
+        num_entries = reservoir_vals.shape[0]
+
+        self._num_filled = torch.zeros((1,), dtype=torch.int64).share_memory_()
+        self._heap_vals = torch.zeros((num_entries,), dtype=torch.float32).share_memory_()
+        self._heap_entries = torch.zeros((num_entries,), dtype=torch.int64).share_memory_()
+
+        self.rebuild()
+
+    @property
+    def num_filled(self):
+        return int(self._num_filled[0])
+
+    def rebuild(self):
+        """
+        Recreate the heap from the reservoir values, e.g. as loaded from the file-backed replay buffer.
+        """
+        reservoir_vals = self._reservoir_vals.numpy().reshape(-1)
+        filled_entries = np.flatnonzero(reservoir_vals > 0)
+        filled_entries = filled_entries[np.argsort(reservoir_vals[filled_entries], kind="stable")]  # Sorted is a heap
+
+        num_filled = len(filled_entries)
+        self._heap_entries.numpy()[:num_filled] = filled_entries
+        self._heap_vals.numpy()[:num_filled] = reservoir_vals[filled_entries]
+        self._num_filled[0] = num_filled
+
+    def min_reservoir_val(self):
+        """
+        :return: The lowest reservoir value of the filled entries, or None if there are none
+        """
+        return float(self._heap_vals[0]) if self.num_filled > 0 else None
+
+    def get_entry_to_fill(self, reservoir_val):
+        """
+        :return: Which entry a new one with this reservoir value should be written to: the first unfilled one, or if
+        they're all filled, the one with the lowest reservoir value, if this one's is higher. Otherwise None.
+        """
+        # Entries are filled in order, and only ever replaced, never emptied, so the filled ones are always the first
+        num_filled = self.num_filled
+        if num_filled < len(self._heap_entries):
+            return num_filled
+
+        return int(self._heap_entries[0]) if reservoir_val > self._heap_vals[0] else None
+
+    def set_entry(self, entry, reservoir_val):
+        """
+        Record that the entry given by get_entry_to_fill has been written, with this reservoir value.
+        """
+        heap_vals = self._heap_vals.numpy()
+        heap_entries = self._heap_entries.numpy()
+        num_filled = self.num_filled
+        self._reservoir_vals[entry, 0] = reservoir_val
+
+        if num_filled < len(heap_entries):
+            heap_vals[num_filled] = reservoir_val
+            heap_entries[num_filled] = entry
+            self._num_filled[0] = num_filled + 1
+            self._sift_up(heap_vals, heap_entries, num_filled)
+        else:
+            assert heap_entries[0] == entry, "Only the entry with the lowest reservoir value may be replaced"
+            heap_vals[0] = reservoir_val
+            self._sift_down(heap_vals, heap_entries, 0, num_filled)
+
+    def sample(self, random_state):
+        """
+        :return: A uniformly random filled entry, or None if there are none
+        """
+        num_filled = self.num_filled
+        if num_filled == 0:
+            return None
+        return int(self._heap_entries[random_state.randint(num_filled)])
+
+    @staticmethod
+    def _sift_up(heap_vals, heap_entries, position):
+        while position > 0:
+            parent = (position - 1) // 2
+            if heap_vals[parent] <= heap_vals[position]:
+                break
+            ReservoirIndex._swap(heap_vals, heap_entries, position, parent)
+            position = parent
+
+    @staticmethod
+    def _sift_down(heap_vals, heap_entries, position, num_filled):
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < num_filled and heap_vals[child] < heap_vals[smallest]:
+                    smallest = child
+            if smallest == position:
+                break
+            ReservoirIndex._swap(heap_vals, heap_entries, position, smallest)
+            position = smallest
+
+    @staticmethod
+    def _swap(heap_vals, heap_entries, first, second):
+        heap_vals[first], heap_vals[second] = heap_vals[second], heap_vals[first]
+        heap_entries[first], heap_entries[second] = heap_entries[second], heap_entries[first]
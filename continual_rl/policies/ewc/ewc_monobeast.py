@@ -2,9 +2,10 @@ import numpy as np
 import torch
 import threading
 import json
-import shutil
 import os
-from continual_rl.policies.impala.torchbeast.monobeast import Monobeast, Buffers
+from continual_rl.policies.impala.torchbeast.core import replay_storage
+from continual_rl.policies.impala.torchbeast.monobeast import Monobeast
+from continual_rl.utils.checkpoint_writer import CheckpointFile, snapshot, write_torch
 from continual_rl.utils.utils import Utils
 
 
@@ -29,7 +30,7 @@ class EWCTaskInfo(object):
         buffers_existed = os.path.exists(permanent_path)
         os.makedirs(permanent_path, exist_ok=True)
 
-        self.replay_buffers, self.temp_files = self._create_replay_buffers(
+        self.replay_buffers, self.temp_files, created_keys = self._create_replay_buffers(
             model_flags, buffer_specs, entries_per_buffer, permanent_path
         )
         self.total_steps, _, total_step_file = Utils.create_file_backed_tensor(
@@ -45,7 +46,8 @@ class EWCTaskInfo(object):
         self.temp_files.append(total_step_file)
         self.temp_files.append(replay_counter_file)
 
-        if not buffers_existed:
+        # If only some buffers are new (e.g. frames were previously stored uncompressed), the entries are incomplete
+        if not buffers_existed or len(created_keys) > 0:
             # Set to 0, since they're both counters.
             self.total_steps.zero_()
             self.replay_buffer_counters.zero_()
@@ -62,26 +64,13 @@ class EWCTaskInfo(object):
         Each buffer entry has unroll_length size, so the number of frames stored is (roughly, because of integer
         rounding): num_actors * entries_per_buffer * unroll_length
         """
-        buffers: Buffers = {key: [] for key in specs}
-
-        # Hold on to the file handle so it does not get deleted. Technically optional, as at least linux will
-        # keep the file open even after deletion, but this way it is still visible in the location it was created
-        temp_files = []
-
-        for actor_id in range(model_flags.num_actors):
-            for key in buffers:
-                shape = (entries_per_buffer, *specs[key]["size"])
-                permanent_file_name = f"replay_{actor_id}_{key}.fbt"
-                new_tensor, _, temp_file = Utils.create_file_backed_tensor(
-                    permanent_path,
-                    shape,
-                    specs[key]["dtype"],
-                    permanent_file_name=permanent_file_name,
-                )
-                buffers[key].append(new_tensor.share_memory_())
-                temp_files.append(temp_file)
-
-        return buffers, temp_files
+        # Each key's num_actors buffers are sections of one contiguous file (see replay_storage), except frames, which
+        # are stored compressed if compress_replay_frames is set
+        return replay_storage.create_replay_buffers(
+            permanent_path, specs, model_flags.num_actors, entries_per_buffer,
+            compressed_keys=("frame",) if model_flags.compress_replay_frames else (),
+            compression_level=model_flags.replay_compression_level,
+            decompression_workers=model_flags.replay_decompression_workers)
 
 
 class EWCMonobeast(Monobeast):
@@ -111,22 +100,21 @@ class EWCMonobeast(Monobeast):
 
         self._tasks = None  # If you observe this never getting set, make sure initialize_tasks is getting called
 
-    def save(self, output_path):
-        super().save(output_path)
-        ewc_metadata_path = os.path.join(output_path, "ewc_metadata.tar")
-
-        # Back up previous model (sometimes they can get corrupted)
-        if os.path.exists(ewc_metadata_path):
-            shutil.copyfile(ewc_metadata_path, os.path.join(output_path, "ewc_metadata_bak.tar"))
+    def get_checkpoint_files(self, output_path):
+        checkpoint_files = super().get_checkpoint_files(output_path)
 
         metadata = {"prev_task_id": self._prev_task_id}
         per_task_metadata = {}
 
         for task_id, task_info in self._tasks.items():
-            per_task_metadata[task_id] = task_info.ewc_regularization_terms
+            per_task_metadata[task_id] = snapshot(task_info.ewc_regularization_terms)
 
         metadata["per_task_metadata"] = per_task_metadata
-        torch.save(metadata, ewc_metadata_path)
+
+        # Back up previous metadata (sometimes they can get corrupted)
+        checkpoint_files.append(CheckpointFile(os.path.join(output_path, "ewc_metadata.tar"), write_torch, metadata,
+                                               backup_path=os.path.join(output_path, "ewc_metadata_bak.tar")))
+        return checkpoint_files
 
     def load(self, output_path):
         super().load(output_path)
@@ -198,7 +186,7 @@ class EWCMonobeast(Monobeast):
 
         return final_ewc_loss / 2.0
 
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs):
         """
         Use the learner_model to save off Fisher information/mean params (via "checkpointing"), and use those
         to compute the EWC loss. Both use the learner_model for consistency (specifically device consistency).
@@ -216,6 +204,10 @@ class EWCMonobeast(Monobeast):
                 # nans logged so to not appear like actors are dead. 
                 with self._stats_lock:
                     self.checkpoint_task(self._prev_task_id, task_flags, model, online=self._model_flags.online_ewc)
+
+                # Each learner process estimated the Fisher from its own samples, so they all use rank 0's
+                task_params, importance = self._get_task(self._prev_task_id).ewc_regularization_terms
+                self.synchronize_from_rank_0([*task_params.values(), *importance.values()])
             self._prev_task_id = cur_task_id
 
         if self._model_flags.online_ewc or self._get_task(cur_task_id).total_steps >= self._model_flags.ewc_per_task_min_frames:
@@ -246,9 +238,11 @@ class EWCMonobeast(Monobeast):
             # NOTE: setting initial_agent_state to an empty list, not sure if this is correct?
             # Calling Monobeast's loss explicitly to make sure the loss is the right one (PnC overrides it)
             # This uses pg_loss and baseline_loss as the signals for importance of parameters (omitting entropy)
-            _, stats, pg_loss, baseline_loss = super().compute_loss(self._model_flags, task_flags, model, task_replay_batch, [], with_custom_loss=False)
+            # Replayed rewards aren't new experience, so don't count towards the reward moments
+            _, stats, pg_loss, baseline_loss = super().compute_loss(self._model_flags, task_flags, model, task_replay_batch, [], with_custom_loss=False,
+                                                                    update_reward_moments=False)
             loss = pg_loss + baseline_loss
-            self.optimizer.zero_grad()
+            model.zero_grad()
             loss.backward()
 
             for n, p in model.named_parameters():
@@ -257,6 +251,9 @@ class EWCMonobeast(Monobeast):
 
         # Normalize by sample size used for estimation
         task_info = self._get_task(task_id)
+        replay_stats = replay_storage.get_replay_stats(task_info.replay_buffers)
+        if len(replay_stats) > 0:
+            self.logger.info(f"EWC replay sampled for the Fisher: {replay_stats}")
         importance = {n: p / self._model_flags.n_fisher_samples for n, p in importance.items()}
 
         if online and task_info.ewc_regularization_terms is not None:
@@ -295,8 +292,8 @@ class EWCMonobeast(Monobeast):
 
             # update the task replay buffer
             to_populate_replay_index = task_info.replay_buffer_counters[actor_index] % self._entries_per_buffer
-            for key in new_buffers.keys():
-                task_info.replay_buffers[key][actor_index][to_populate_replay_index][...] = new_buffers[key]
+            replay_storage.write_replay_entry(task_info.replay_buffers, actor_index, to_populate_replay_index,
+                                              new_buffers)
 
             # should only be getting 1 unroll for any key
             task_info.replay_buffer_counters[actor_index] += 1
@@ -308,27 +305,18 @@ class EWCMonobeast(Monobeast):
     def _sample_from_task_replay_buffer(self, task_id, batch_size):
         task_info = self._get_task(task_id)
         replay_entry_count = batch_size
-        shuffled_subset = []  # Will contain a list of tuples of (actor_index, buffer_index)
         random_state = np.random.RandomState()
 
-        # Select a random actor, and from that, a random buffer entry.
-        for _ in range(replay_entry_count):
-            actor_index = random_state.randint(0, self._model_flags.num_actors)
-
-            # We may not have anything in this buffer yet, so check for that (randint complains)
-            entries_in_buffer = min(task_info.replay_buffer_counters[actor_index], self._entries_per_buffer)
-            if entries_in_buffer > 0:
-                buffer_index = random_state.randint(0, entries_in_buffer)
-                shuffled_subset.append((actor_index, buffer_index))
-
-        replay_batch = {
-            # Get the actor_index and entry_id from the raw id
-            key: torch.stack([task_info.replay_buffers[key][actor_id][buffer_id]
-                              for actor_id, buffer_id in shuffled_subset], dim=1) for key in task_info.replay_buffers
-        }
-
-        replay_batch = {
-            k: t.to(device=self._model_flags.device, non_blocking=True)
-            for k, t in replay_batch.items()
-        }
+        # Select a random actor for each, and from that, a random buffer entry.
+        actor_indices = random_state.randint(0, self._model_flags.num_actors, size=replay_entry_count)
+
+        # We may not have anything in this buffer yet, so check for that (randint complains)
+        entries_in_buffer = np.minimum(task_info.replay_buffer_counters.numpy()[actor_indices], self._entries_per_buffer)
+        actor_indices = actor_indices[entries_in_buffer > 0]
+        buffer_indices = random_state.randint(0, entries_in_buffer[entries_in_buffer > 0])
+
+        replay_batch = replay_storage.gather_replay_entries(task_info.replay_buffers, actor_indices, buffer_indices)
+        replay_batch = self.expand_deduplicated_frames(replay_batch)
+
+        replay_batch = self.move_batch_to_device(replay_batch)
         return replay_batch
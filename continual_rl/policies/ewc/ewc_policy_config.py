@@ -18,6 +18,13 @@ class EWCPolicyConfig(ImpalaPolicyConfig):
         self.replay_buffer_frames = int(1e6)  # save a buffer per task for computing Fisher estimates
         self.large_file_path = None  # No default, since it can be very large and we want no surprises
 
+        # If set, replay frames are stored zlib-compressed (at replay_compression_level, 0-9), each entry
+        # variable-length, trading CPU (compressing in the actors, and decompressing in replay_decompression_workers
+        # threads while sampling) for disk space. The compression ratio and batch read time are logged.
+        self.compress_replay_frames = False
+        self.replay_compression_level = 1
+        self.replay_decompression_workers = 2
+
         self.n_fisher_samples = 100  # num of batches to draw to recompute the diagonal of the Fisher
 
         self.ewc_lambda = 500  # "tuned choosing from [500, 1000, 1500, 2000, 2500, 3000]? exact value not specified by Progress & Compress"
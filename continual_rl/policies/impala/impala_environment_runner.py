@@ -120,6 +120,8 @@ class ImpalaEnvironmentRunner(EnvironmentRunnerBase):
             for key in stats.keys():
                 if key.endswith("loss") or key == "total_norm":
                     logs_to_report.append({"type": "scalar", "tag": key, "value": stats[key]})
+                elif key.endswith("_hist") and len(stats[key]) > 0:
+                    logs_to_report.append({"type": "histogram", "tag": key, "value": stats[key]})
 
             if "video" in stats and stats["video"] is not None:
                 video_log = self._render_video(task_spec.preprocessor, stats["video"])
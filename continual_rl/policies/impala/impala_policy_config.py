@@ -5,16 +5,30 @@ class ImpalaPolicyConfig(ConfigBase):
     def __init__(self):
         super().__init__()
         self.num_actors = 4
+        self.envs_per_actor = 1  # Each actor process steps this many environments in lockstep, with batched forwards
         self.batch_size = 8
         self.unroll_length = 80
         self.num_buffers = None
         self.num_learner_threads = 2
+        self.learner_concurrency = "serialized"  # "serialized", "concurrent", or "hogwild" (see LearnerReplica)
+        # Data-parallel learning: this many learner processes (the main one included, as rank 0) each learn from their
+        # own batches, averaging gradients over localhost (gloo) before each step. Requires one learner thread each.
+        self.num_learner_processes = 1
         self.use_lstm = False  # Not presently fully supported
         self.entropy_cost = 0.0006
         self.baseline_cost = 0.5
         self.discounting = 0.99
         self.reward_clipping = "abs_one"
         self.normalize_reward = False
+        self.use_fused_vtrace_loss = False  # Compute V-trace and the losses together, sharing each log-softmax
+        self.compile_model = False  # torch.compile the network's trunk and heads, where supported
+        self.learner_bf16_autocast = False  # Run the learner's forward pass in bfloat16, where natively supported
+        # Store each frame of a frame-stacked observation once, rather than once per stack it's in, in the rollout and
+        # replay buffers. Stacks are rebuilt when batches are gathered. Observations must be (stack_size, ...).
+        self.deduplicate_frames = False
+        # Store the actors' policy logits and baselines in float16 in the rollout (and replay) buffers. They're cast
+        # back to float32 as batches are gathered.
+        self.store_outputs_in_float16 = False
         self.learning_rate = 0.00048
         self.optimizer = "rmsprop"
         self.use_scheduler = True
@@ -24,16 +38,73 @@ class ImpalaPolicyConfig(ConfigBase):
         self.grad_norm_clipping = 40.0
         self.device = "cuda:0"
         self.disable_checkpoint = False
+        # Write checkpoints in the background (see CheckpointWriter), rather than blocking whoever is saving until
+        # they're on disk. Either way, each file is replaced atomically.
+        self.checkpoint_asynchronously = True
         self.comment = ""
         self.render_freq = 200000  # Timesteps between outputting a video to the tensorboard log
+        # "pause": every seconds_between_yields, stop the learners (and the actors, if pause_actors_during_yield) for
+        # as long as we're yielded. "async": yield every steps_between_yields steps, and keep training while yielded.
+        self.yield_mode = "pause"
         self.seconds_between_yields = 5
         self.pause_actors_during_yield = True
+        self.steps_between_yields = 20000
         self.eval_episode_num_parallel = 10  # The number to run in parallel at a time
+        # "process_pool": run each episode in its own process, with a newly created environment. "batched": step
+        # eval_episode_num_parallel environments (kept, per task, between evaluations) in lockstep in this process,
+        # acting for all of them with one batched forward pass.
+        self.eval_engine = "process_pool"
         self.conv_net_arch = "orig"
         self.sep_critic_conv_net = False
         self.baseline_extended_arch = False
         self.baseline_includes_uncertainty = False
 
+        # Actors send observations to centralized inference workers, which batch requests across actors, rather than
+        # each actor running its own forward pass.
+        self.use_inference_server = False
+        self.num_inference_workers = 1
+        self.inference_batch_deadline_ms = 2.0  # How long a worker waits for more requests before running a batch
+
+        # Assemble (dequeue, gather, move to device, and augment via get_batch_for_training) up to this many batches
+        # in a background thread ahead of the learner threads. 0 assembles each batch in the learner thread itself.
+        self.prefetch_queue_depth = 0
+
+        self.use_param_store = False  # Actors act with private copies of the weights, synced from a ParamStore
+        self.param_sync_every_n_steps = 1  # Learner steps between publishing the weights to the actors (0 to ignore)
+        self.param_sync_every_ms = 0  # Milliseconds between publishing the weights to the actors (0 to ignore)
+
+        # What actors (and test episodes) run the model with. "eager": the model itself. "torchscript": a frozen
+        # TorchScript export of it, re-exported each time an actor pulls new weights from the param store (so
+        # requires use_param_store, and a sync cadence that amortizes the export). "torchscript_int8": the same, with
+        # the Linear layers dynamically quantized to int8.
+        self.actor_inference_engine = "eager"
+
+        # Intra-op (torch) threads per process, by role. 0 learner threads gives the learner processes whatever CPUs
+        # the actors' threads leave (at least one each). Test episode processes use the actor setting.
+        self.learner_intra_op_threads = 0
+        self.actor_intra_op_threads = 1
+        # Pin each learner process and actor to its own CPUs (NUMA node by node, learners first), and the test episode
+        # processes to the CPUs the actors use. The layout is logged at startup either way.
+        self.pin_cpu_affinity = False
+
+        # Keep the actor processes alive between tasks (and cycles): at the end of a task they finish their unroll and
+        # park, then at the start of the next they're sent its task_flags and swap their environments in place, rather
+        # than being joined and re-forked. Doesn't apply to use_inference_server.
+        self.persistent_actors = False
+
+        # Vary the number of running actors between autoscale_min_actors and num_actors, one at a time. An actor is
+        # retired when the learner is the bottleneck: on average more than autoscale_queue_threshold of the buffers
+        # are waiting to be learned from, or (if autoscale_max_policy_lag > 0, and with use_param_store) rollouts are
+        # learned from that many weight versions after they were collected. One is added when the actors are the
+        # bottleneck: the learner spends more than autoscale_learner_wait_threshold of its time waiting for batches.
+        # Each decision, with the SPS, is appended to actor_autoscaling.csv in the output directory.
+        self.autoscale_actors = False
+        self.autoscale_min_actors = 1
+        self.autoscale_interval_seconds = 10
+        self.autoscale_queue_threshold = 0.5
+        self.autoscale_max_policy_lag = 0
+        self.autoscale_learner_wait_threshold = 0.1
+
         # Does not call eval() on the policy before evaluation,
         # use when you want the same policy to run on the environment in eval as it does in test.
         self.no_eval_mode = False
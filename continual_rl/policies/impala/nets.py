@@ -5,7 +5,9 @@ import copy
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from continual_rl.policies.impala.torchbeast.core import model_acceleration
 from continual_rl.utils.common_nets import get_network_for_size
+from continual_rl.utils.inference_export import freeze_for_inference
 from continual_rl.utils.utils import Utils
 
 
@@ -58,6 +60,15 @@ class ImpalaNet(nn.Module):
         self.register_buffer("reward_m2", torch.zeros(()))
         self.register_buffer("reward_count", torch.zeros(()).fill_(1e-8))
 
+    def compile_trunk_and_heads(self, logger=None):
+        """
+        Compile the conv net and the policy and baseline heads with torch.compile. They're compiled in place, so the
+        state dict (and so checkpoints) are unchanged. Compilation happens lazily, on each one's first forward.
+        :param logger: Where to report any that fall back to running eagerly
+        """
+        for module in (self._conv_net, self.policy, self.baseline):
+            model_acceleration.compile_in_place(module, logger)
+
     def initial_state(self, batch_size):
         assert not self.use_lstm, "LSTM not currently implemented. Ensure this gets initialized correctly when it is" \
                                   "implemented."
@@ -66,17 +77,8 @@ class ImpalaNet(nn.Module):
     def forward(self, inputs, action_space_id, core_state=()):
         x = inputs["frame"]  # [T, B, S, C, H, W]. T=timesteps in collection, S=stacked frames
         T, B, *_ = x.shape
-        x = torch.flatten(x, 0, 1)  # Merge time and batch.
-        x = torch.flatten(x, 1, 2)  # Merge stacked frames and channels.
-        x = x.float() / self._observation_space.high.max()
-        x = self._conv_net(x)
-        x = F.relu(x)
-
-        one_hot_last_action = F.one_hot(
-            inputs["last_action"].view(T * B), self.num_actions
-        ).float()
-        clipped_reward = torch.clamp(inputs["reward"], -1, 1).view(T * B, 1).float()
-        core_input = torch.cat([x, clipped_reward, one_hot_last_action], dim=-1)
+        core_input = self._compute_core_input(torch.flatten(x, 0, 1),  # Merge time and batch.
+                                              inputs["last_action"].view(T * B), inputs["reward"].view(T * B))
 
         if self.use_lstm:
             core_input = core_input.view(T, B, -1)
@@ -98,11 +100,38 @@ class ImpalaNet(nn.Module):
         policy_logits = self.policy(core_output)
         baseline = self.baseline(core_output)
 
+        return (
+            self.create_output_dict(policy_logits, baseline, T, B, action_space_id, sample_action=self.training),
+            core_state,
+        )
+
+    def _compute_core_input(self, frame, last_action, reward):
+        """
+        :param frame: [N, S, C, H, W], where N is time and batch merged
+        """
+        x = torch.flatten(frame, 1, 2)  # Merge stacked frames and channels.
+        x = x.float() / self._observation_space.high.max()
+        x = self._conv_net(x)
+        x = F.relu(x)
+
+        one_hot_last_action = F.one_hot(last_action, self.num_actions).float()
+        clipped_reward = torch.clamp(reward, -1, 1).view(-1, 1).float()
+        return torch.cat([x, clipped_reward, one_hot_last_action], dim=-1)
+
+    def compute_logits_and_baseline(self, frame, last_action, reward):
+        """
+        The (non-recurrent) forward pass without its sampling, which is what gets exported for inference. Inputs and
+        outputs have time and batch merged.
+        """
+        core_output = self._compute_core_input(frame, last_action, reward)
+        return self.policy(core_output), self.baseline(core_output)
+
+    def create_output_dict(self, policy_logits, baseline, T, B, action_space_id, sample_action):
         # Used to select the action appropriate for this task (might be from a reduced set)
         current_action_size = self._action_spaces[action_space_id].n
         policy_logits_subset = policy_logits[:, :current_action_size]
 
-        if self.training:
+        if sample_action:
             action = torch.multinomial(F.softmax(policy_logits_subset, dim=1), num_samples=1)
         else:
             # Don't sample when testing.
@@ -117,31 +146,82 @@ class ImpalaNet(nn.Module):
         if self._model_flags.baseline_includes_uncertainty:
             output_dict["uncertainty"] = baseline[:, :, 1]
 
-        return (
-            output_dict,
-            core_state,
-        )
+        return output_dict
+
+    def export_for_inference(self, quantize=False):
+        """
+        An inference-only copy of this net, called the same way, but faster on CPU (see FrozenImpalaNet). It's a
+        snapshot of the current weights and mode (train or eval), so must be re-exported to pick up new ones.
+        """
+        return FrozenImpalaNet(self, quantize)
 
     # from https://github.com/MiniHackPlanet/MiniHack/blob/e124ae4c98936d0c0b3135bf5f202039d9074508/minihack/agent/polybeast/models/base.py#L67
     @torch.no_grad()
-    def update_running_moments(self, reward_batch):
-        """Maintains a running mean of reward."""
+    def update_running_moments(self, reward_batch, reward_sums=None):
+        """
+        Maintains a running mean of reward.
+        :param reward_sums: If given, the get_reward_sums to update with, in place of reward_batch's own. E.g. summed
+        over several batches of the same number of steps, to update as if they were one batch, concatenated along the
+        batch dimension.
+        """
+        if reward_sums is None:
+            reward_sums = self.get_reward_sums(reward_batch)
+
         new_count = len(reward_batch)
-        new_sum = torch.sum(reward_batch)
+        new_sum, new_sum_of_squares, num_rewards = reward_sums
         new_mean = new_sum / new_count
 
         curr_mean = self.reward_sum / self.reward_count
-        new_m2 = torch.sum((reward_batch - new_mean) ** 2) + (
+        new_m2 = new_sum_of_squares - 2 * new_mean * new_sum + num_rewards * new_mean ** 2 + (
             (self.reward_count * new_count)
             / (self.reward_count + new_count)
             * (new_mean - curr_mean) ** 2
         )
 
         self.reward_count += new_count
-        self.reward_sum += new_sum
-        self.reward_m2 += new_m2
+        self.reward_sum += new_sum.to(self.reward_sum.dtype)
+        self.reward_m2 += new_m2.to(self.reward_m2.dtype)
+
+    @staticmethod
+    def get_reward_sums(reward_batch):
+        """
+        What update_running_moments needs of a batch of rewards, besides its length: (sum, sum of squares, number of
+        rewards), in float64, so summing them over batches stays exact enough.
+        """
+        reward_batch = reward_batch.double()
+        return torch.stack((reward_batch.sum(), (reward_batch ** 2).sum(),
+                            torch.tensor(float(reward_batch.numel()), dtype=torch.float64, device=reward_batch.device)))
 
     @torch.no_grad()
     def get_running_std(self):
         """Returns standard deviation of the running mean of the reward."""
         return torch.sqrt(self.reward_m2 / self.reward_count)
+
+
+class FrozenImpalaNet(object):
+    """
+    An ImpalaNet's forward pass, exported as frozen TorchScript (optionally with its Linear layers dynamically
+    quantized to int8), for acting on CPU. Only the action sampling still runs eagerly. Created by
+    ImpalaNet.export_for_inference.
+    """
+    def __init__(self, net, quantize):
+        assert not net.use_lstm, "LSTMs are not supported for inference export"
+        self._net = net  # Only used for its (weightless) output creation
+        self._sample_action = net.training
+
+        observation_shape = net._observation_space.shape
+        example_inputs = (torch.zeros((1, *observation_shape), dtype=torch.uint8),
+                          torch.zeros((1,), dtype=torch.int64),
+                          torch.zeros((1,)))
+        self._compute_logits_and_baseline = freeze_for_inference(net, "compute_logits_and_baseline", example_inputs,
+                                                                 quantize=quantize)
+
+    def __call__(self, inputs, action_space_id, core_state=()):
+        T, B, *_ = inputs["frame"].shape
+        with torch.no_grad():
+            policy_logits, baseline = self._compute_logits_and_baseline(torch.flatten(inputs["frame"], 0, 1),
+                                                                        inputs["last_action"].view(T * B),
+                                                                        inputs["reward"].view(T * B))
+
+        return self._net.create_output_dict(policy_logits, baseline, T, B, action_space_id,
+                                            sample_action=self._sample_action), core_state
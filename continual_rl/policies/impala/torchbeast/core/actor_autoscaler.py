@@ -0,0 +1,149 @@
+"""
+Decides how many actors should be running, from whether the learner or the actors are the bottleneck. If the learner is
+(rollouts pile up in the full queue, or are learned from many weight versions after they were collected) an actor is
+retired. If the actors are (the learner spends its time waiting for batches) one is added. Each decision, with the SPS
+over the window it was made from, is appended to a CSV timeline.
+"""
+
+import csv
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class ActorState(object):
+    """
+    The values of the shared per-actor state the autoscaler's decisions are carried out through. Only an ACTIVE actor
+    is asked to retire, and only once it has RETIRED (which it marks itself, as it stops) is it restarted.
+    """
+    ACTIVE, RETIRING, RETIRED = range(3)
+
+
+class ActorAutoscaler(object):
+    TIMELINE_FIELDS = ("time", "step", "num_actors", "sps", "learner_wait_fraction", "full_queue_occupancy",
+                       "mean_policy_lag", "new_num_actors")
+
+    def __init__(self, min_actors, max_actors, num_batch_consumers, interval_seconds, learner_wait_threshold,
+                 queue_occupancy_threshold, max_policy_lag=0, timeline_path=None):
+        """
+        :param num_batch_consumers: How many threads wait on the full queue for batches (the learner threads, or the
+        prefetch thread), which the learner wait fraction is relative to
+        :param interval_seconds: The (unpaused) time between decisions
+        :param learner_wait_threshold: Add an actor if the batch consumers spend more than this fraction of their time
+        waiting on the full queue
+        :param queue_occupancy_threshold: Retire an actor if, on average, more than this fraction of the buffers are
+        waiting in the full queue
+        :param max_policy_lag: Retire an actor if rollouts are learned from a mean of more than this many weight
+        versions after they were collected. 0 ignores policy lag.
+        :param timeline_path: The CSV file each decision is appended to, if any
+        """
+        self.num_actors = max_actors
+        self._min_actors = min_actors
+        self._max_actors = max_actors
+        self._num_batch_consumers = num_batch_consumers
+        self._interval_seconds = interval_seconds
+        self._learner_wait_threshold = learner_wait_threshold
+        self._queue_occupancy_threshold = queue_occupancy_threshold
+        self._max_policy_lag = max_policy_lag
+        self._timeline_path = timeline_path
+
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._reset_window(step=None, window_start_time=None)  # The start time is None while paused
+
+    def start(self, step):
+        """
+        Start measuring afresh, e.g. at the start of a task (whose steps are counted from its own start).
+        """
+        with self._lock:
+            self._reset_window(step, window_start_time=time.monotonic())
+
+    def resume(self, step):
+        """
+        Start (or continue) measuring. Time spent paused (e.g. yielded, with the actors suspended) isn't measured.
+        """
+        with self._lock:
+            self._window_start_time = time.monotonic()
+            if self._window_start_step is None:
+                self._window_start_step = step
+
+    def pause(self):
+        with self._lock:
+            if self._window_start_time is not None:
+                self._window_seconds += time.monotonic() - self._window_start_time
+                self._window_start_time = None
+
+    def record_learner_wait(self, seconds):
+        with self._lock:
+            if self._window_start_time is not None:
+                self._learner_wait_seconds += seconds
+
+    def record_policy_lags(self, policy_lags):
+        with self._lock:
+            if self._window_start_time is not None:
+                self._policy_lags.extend(policy_lags)
+
+    def maybe_rescale(self, step, full_queue_occupancy):
+        """
+        Called periodically, while measuring. Samples the full queue's occupancy, and once interval_seconds have been
+        measured, decides how many actors there should be.
+        :return: The number of actors there should be
+        """
+        with self._lock:
+            if self._window_start_time is None:
+                return self.num_actors
+
+            self._queue_occupancies.append(full_queue_occupancy)
+            now = time.monotonic()
+            window_seconds = self._window_seconds + now - self._window_start_time
+            if window_seconds < self._interval_seconds:
+                return self.num_actors
+            window_seconds = max(window_seconds, 1e-6)  # Only 0 if interval_seconds is
+
+            sps = (step - self._window_start_step) / window_seconds
+            learner_wait_fraction = self._learner_wait_seconds / (window_seconds * self._num_batch_consumers)
+            mean_occupancy = float(np.mean(self._queue_occupancies))
+            mean_policy_lag = float(np.mean(self._policy_lags)) if len(self._policy_lags) > 0 else np.nan
+            new_num_actors = self._decide(learner_wait_fraction, mean_occupancy, mean_policy_lag)
+
+            self._write_timeline_row(dict(time=now - self._start_time, step=step, num_actors=self.num_actors, sps=sps,
+                                          learner_wait_fraction=learner_wait_fraction,
+                                          full_queue_occupancy=mean_occupancy, mean_policy_lag=mean_policy_lag,
+                                          new_num_actors=new_num_actors))
+
+            self.num_actors = new_num_actors
+            self._reset_window(step, window_start_time=now)
+
+            return self.num_actors
+
+    def _reset_window(self, step, window_start_time):
+        self._window_start_time = window_start_time
+        self._window_seconds = 0
+        self._window_start_step = step
+        self._learner_wait_seconds = 0
+        self._policy_lags = []
+        self._queue_occupancies = []
+
+    def _decide(self, learner_wait_fraction, mean_occupancy, mean_policy_lag):
+        learner_bound = mean_occupancy > self._queue_occupancy_threshold or \
+            (self._max_policy_lag > 0 and mean_policy_lag > self._max_policy_lag)  # False if the lag is nan
+
+        if learner_bound:
+            return max(self.num_actors - 1, self._min_actors)
+        elif learner_wait_fraction > self._learner_wait_threshold:
+            return min(self.num_actors + 1, self._max_actors)
+
+        return self.num_actors
+
+    def _write_timeline_row(self, row):
+        if self._timeline_path is None:
+            return
+
+        write_header = not os.path.exists(self._timeline_path)
+        with open(self._timeline_path, "a", newline="") as timeline_file:
+            writer = csv.DictWriter(timeline_file, fieldnames=self.TIMELINE_FIELDS)
+            if write_header:
+                writer.writeheader()
+            writer.writerow(row)
@@ -0,0 +1,126 @@
+"""
+A background stage that assembles learner batches ahead of time, so the learner threads' optimizer steps don't wait
+on dequeueing, gathering, moving to the device, or augmenting (e.g. with replay) the next batch.
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class BatchPrefetcher(object):
+    # Caps on how many samples are held between calls to get_stats(), so a long gap between yields can't grow
+    # the stats without bound.
+    MAX_STATS_SAMPLES = 10000
+
+    def __init__(self, produce_batch, depth, discard_batch=None, poll_interval=0.1):
+        """
+        :param produce_batch: Called as produce_batch(timeout) on the prefetch thread. Returns the next batch, or
+        None if there will be no more. Raises queue.Empty if nothing was available within the timeout.
+        :param depth: The maximum number of assembled batches waiting to be consumed.
+        :param discard_batch: Called with each batch that gets discarded by stop() without being consumed.
+        :param poll_interval: How often (in seconds) blocked operations check whether a stop was requested.
+        """
+        self._produce_batch = produce_batch
+        self._discard_batch = discard_batch
+        self._poll_interval = poll_interval
+        self._batches = queue.Queue(maxsize=depth)
+
+        self._thread = None
+        self._stop_requested = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._wait_times_ms = []
+        self._num_gets = 0
+        self._num_starved = 0
+
+    def start(self):
+        self._stop_requested.clear()
+        self._thread = threading.Thread(target=self._prefetch, name="batch-prefetcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop prefetching, and discard any batches that have been assembled but not consumed.
+        """
+        self._stop_requested.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        while True:
+            try:
+                batch = self._batches.get(block=False)
+            except queue.Empty:
+                break
+
+            if batch is not None and self._discard_batch is not None:
+                self._discard_batch(batch)
+
+    def get(self, timeout=None):
+        """
+        :return: The next assembled batch, or None if there will be no more
+        :raises queue.Empty: if no batch was ready within the timeout
+        """
+        start_time = time.monotonic()
+        starved = self._batches.empty()
+        batch = self._batches.get(timeout=timeout)
+        wait_time_ms = (time.monotonic() - start_time) * 1000
+
+        # Leave the end marker for any other consumers
+        if batch is None:
+            self._batches.put(None)
+        else:
+            with self._stats_lock:
+                self._num_gets += 1
+                self._num_starved += int(starved)
+                if len(self._wait_times_ms) < self.MAX_STATS_SAMPLES:
+                    self._wait_times_ms.append(wait_time_ms)
+
+        return batch
+
+    def _put(self, batch):
+        while not self._stop_requested.is_set():
+            try:
+                self._batches.put(batch, timeout=self._poll_interval)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _prefetch(self):
+        while not self._stop_requested.is_set():
+            try:
+                batch = self._produce_batch(self._poll_interval)
+            except queue.Empty:
+                continue
+
+            if not self._put(batch):
+                if batch is not None and self._discard_batch is not None:
+                    self._discard_batch(batch)
+                break
+
+            if batch is None:
+                break
+
+    def get_stats(self):
+        """
+        Returns (and resets) the starvation stats collected since the last call. A get is "starved" if no batch was
+        ready when it was requested, i.e. the learner had to wait on batch assembly.
+        """
+        with self._stats_lock:
+            wait_times_ms = self._wait_times_ms
+            num_gets = self._num_gets
+            num_starved = self._num_starved
+            self._wait_times_ms = []
+            self._num_gets = 0
+            self._num_starved = 0
+
+        stats = {
+            "prefetch_wait_ms_hist": wait_times_ms,
+            "prefetch_wait_ms_mean": np.mean(wait_times_ms) if len(wait_times_ms) > 0 else np.nan,
+            "prefetch_starved_fraction": num_starved / num_gets if num_gets > 0 else np.nan,
+        }
+        return stats
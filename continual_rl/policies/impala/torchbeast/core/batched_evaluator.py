@@ -0,0 +1,118 @@
+"""
+Runs evaluation episodes in the calling process, stepping a set of environments in lockstep so one batched forward pass
+computes all their actions. The environments are kept (per task) between calls, so each evaluation only resets them,
+rather than creating them anew.
+"""
+
+import random
+
+import numpy as np
+import torch
+
+from continual_rl.policies.impala.torchbeast.core import environment
+from continual_rl.utils.utils import Utils
+
+
+class BatchedEvaluator(object):
+
+    def __init__(self, num_envs, observation_shape, logger):
+        """
+        :param num_envs: How many environments (so episodes) are stepped at once, per task
+        """
+        self._num_envs = num_envs
+        self._observation_shape = observation_shape
+        self._logger = logger
+        self._envs_by_task = {}
+
+    def _make_env(self, env_spec):
+        # Seeding the env also seeds the global generators, which belong to whatever else this process is doing (e.g.
+        # training), so put them back afterwards
+        numpy_state, random_state = np.random.get_state(), random.getstate()
+        with torch.random.fork_rng():
+            gym_env, seed = Utils.make_env(env_spec, create_seed=True)
+        np.random.set_state(numpy_state)
+        random.setstate(random_state)
+
+        self._logger.info(f"Evaluation environment created with seed {seed}")
+        return environment.Environment(gym_env)
+
+    def _get_envs(self, task_flags, num_envs):
+        envs = self._envs_by_task.setdefault(task_flags.task_id, [])
+        while len(envs) < num_envs:
+            envs.append(self._make_env(task_flags.env_spec))
+        return envs[:num_envs]
+
+    def evaluate(self, task_flags, model, num_episodes, acting_model=None):
+        """
+        Run num_episodes episodes of the task, with up to num_envs at a time. Each environment moves on to the next
+        episode as it finishes one, until every episode has been started, at which point it stops being stepped.
+        :param model: What to act with (not changed while evaluating, e.g. a snapshot of the weights)
+        :param acting_model: If given, an inference-only export of model to act with instead
+        :return: The total number of steps taken, and the returns of the episodes, in the order they finished
+        """
+        num_envs = min(self._num_envs, num_episodes)
+        envs = self._get_envs(task_flags, num_envs)
+
+        # Each env writes its output into its own column of the batch the model acts on, as in RolloutWriter
+        env_output = {key: torch.zeros((1, num_envs), dtype=dtype)
+                      for key, dtype in environment.Environment.OUTPUT_DTYPES.items()}
+        env_output["frame"] = torch.zeros((1, num_envs, *self._observation_shape), dtype=torch.uint8)
+        env_output_views = [{key: value[:, env_id:env_id + 1] for key, value in env_output.items()}
+                            for env_id in range(num_envs)]
+        for env, env_output_view in zip(envs, env_output_views):
+            env.initial(out=env_output_view)
+
+        agent_state = model.initial_state(batch_size=num_envs)
+        acting_model = acting_model if acting_model is not None else model
+        episodes_started = num_envs
+        active_env_ids = list(range(num_envs))
+        step = 0
+        returns = []
+
+        while len(active_env_ids) > 0:
+            if task_flags.mode == "test_render":
+                for env_id in active_env_ids:
+                    envs[env_id].gym_env.render()
+
+            # Only the envs still running are acted on (agent state is (layers, B, ...), as in torchbeast)
+            active_ids = torch.tensor(active_env_ids)
+            active_output = env_output if len(active_env_ids) == num_envs else \
+                {key: value[:, active_ids] for key, value in env_output.items()}
+            active_state = tuple(state[:, active_ids] for state in agent_state)
+
+            with torch.no_grad():
+                agent_output, active_state = acting_model(active_output, task_flags.action_space_id, active_state)
+
+            for state, new_state in zip(agent_state, active_state):
+                state[:, active_ids] = new_state
+
+            finished_env_ids = []
+            for batch_id, env_id in enumerate(active_env_ids):
+                observation = envs[env_id].step(agent_output["action"][:, batch_id:batch_id + 1],
+                                                out=env_output_views[env_id])
+                step += 1
+
+                # NaN if the done was "fake" (e.g. Atari). We want real scores here so wait for the real return.
+                if observation["done"].item() and not torch.isnan(observation["episode_return"]).item():
+                    returns.append(observation["episode_return"].item())
+                    self._logger.info(
+                        "Episode ended after %d steps. Return: %.1f",
+                        observation["episode_step"].item(),
+                        observation["episode_return"].item(),
+                    )
+
+                    # The env has already been reset, so carries straight on with the next episode, if there is one
+                    if episodes_started < num_episodes:
+                        episodes_started += 1
+                    else:
+                        finished_env_ids.append(env_id)
+
+            active_env_ids = [env_id for env_id in active_env_ids if env_id not in finished_env_ids]
+
+        return step, returns
+
+    def close(self):
+        for envs in self._envs_by_task.values():
+            for env in envs:
+                env.close()
+        self._envs_by_task = {}
@@ -19,25 +19,50 @@ import torch
 import numpy as np
 
 
-def _format_frame(frame):
+def _format_frame(frame, out=None):
+    if out is not None:
+        frame.to_tensor(out=out[0, 0])  # Stack straight into the (T,B,...) output
+        return out
+
     frame = frame.to_tensor()  # Convert from LazyFrames
     return frame.view((1, 1) + frame.shape)  # (...) -> (T,B,...).
 
 
 class Environment:
+    # The keys of the dicts returned by initial() and step()
+    OUTPUT_KEYS = ("frame", "reward", "done", "episode_return", "episode_step", "last_action")
+    # The dtype of each output, as the model acts on it (and as the out tensors given to initial() and step() are)
+    OUTPUT_DTYPES = dict(frame=torch.uint8, reward=torch.float32, done=torch.bool, episode_return=torch.float32,
+                         episode_step=torch.int32, last_action=torch.int64)
+
     def __init__(self, gym_env):
         self.gym_env = gym_env
         self.episode_return = None
         self.episode_step = None
 
-    def initial(self):
+    def initial(self, out=None):
+        """
+        :param out: Optionally, a dict of (T=1, B=1, ...) tensors (one per OUTPUT_KEYS) to write the output into, in
+        place, and return, instead of allocating new ones.
+        """
+        self.episode_return = torch.zeros(1, 1)
+        self.episode_step = torch.zeros(1, 1, dtype=torch.int32)
+        frame = self.gym_env.reset()
+
+        if out is not None:
+            _format_frame(frame, out["frame"])
+            out["reward"].zero_()
+            out["done"].zero_()
+            out["episode_return"].zero_()
+            out["episode_step"].zero_()
+            out["last_action"].zero_()
+            return out
+
         initial_reward = torch.zeros(1, 1)
         # This supports only single-tensor actions ATM.
         initial_last_action = torch.zeros(1, 1, dtype=torch.int64)
-        self.episode_return = torch.zeros(1, 1)
-        self.episode_step = torch.zeros(1, 1, dtype=torch.int32)
         initial_done = torch.zeros(1, 1, dtype=torch.uint8)  # Originally this was ones, which makes there be 0 reward episodes
-        initial_frame = _format_frame(self.gym_env.reset())
+        initial_frame = _format_frame(frame)
         return dict(
             frame=initial_frame,
             reward=initial_reward,
@@ -47,7 +72,11 @@ class Environment:
             last_action=initial_last_action,
         )
 
-    def step(self, action):
+    def step(self, action, out=None):
+        """
+        :param out: Optionally, a dict of (T=1, B=1, ...) tensors (one per OUTPUT_KEYS) to write the output into, in
+        place, and return, instead of allocating new ones.
+        """
         frame, reward, done, prior_info = self.gym_env.step(action.item())
         self.episode_step += 1
         self.episode_return += reward
@@ -63,8 +92,23 @@ class Environment:
             # The episode_return will be None until the episode is done. We make it a NaN so we can still use the
             # numpy buffer.
             prior_return = prior_info["episode_return"]
-            episode_return = torch.tensor(prior_return if prior_return is not None else np.nan)
-            self.episode_return = episode_return
+            prior_return = prior_return if prior_return is not None else np.nan
+
+            if out is not None:
+                self.episode_return.fill_(prior_return)
+                episode_return = self.episode_return
+            else:
+                episode_return = torch.tensor(prior_return)
+                self.episode_return = episode_return
+
+        if out is not None:
+            _format_frame(frame, out["frame"])
+            out["reward"].fill_(reward)
+            out["done"].fill_(done)
+            out["episode_return"].copy_(episode_return)
+            out["episode_step"].copy_(episode_step)
+            out["last_action"].copy_(action)
+            return out
 
         frame = _format_frame(frame)
         reward = torch.tensor(reward).view(1, 1)
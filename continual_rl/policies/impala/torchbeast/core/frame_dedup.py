@@ -0,0 +1,90 @@
+"""
+Frame-deduplicated storage of frame-stacked observations.
+
+A stacked observation is (S, ...), where S is the stack size, and consecutive observations share S - 1 frames. Rather
+than store all S frames at each of the T + 1 steps of a rollout, a deduplicated rollout stores (T + S, ...): the S - 1
+older frames of the first step's stack, followed by the newest frame of each step. Step t's stack is then the S frames
+ending at stored index t + S - 1, except that frames from before an episode reset are replaced by the reset frame
+(which is what FrameStack fills the stack with on reset).
+"""
+
+import torch
+
+
+def deduplicated_frame_size(unroll_length, obs_shape):
+    return (unroll_length + obs_shape[0], *obs_shape[1:])
+
+
+def write_frames(frame_buffers, rollout_indices, t, frames):
+    """
+    Write a step's stacked frames into deduplicated rollout frame buffers.
+    :param frame_buffers: (num_buffers, T + S, ...) deduplicated frames
+    :param rollout_indices: The B buffers being written
+    :param frames: (B, S, ...) the stacked frames of step t
+    """
+    # Frames are large enough that a copy per buffer beats index_copy_
+    stack_size = frames.shape[1]
+    for frame, index in zip(frames, rollout_indices):
+        if t == 0:
+            frame_buffers[index][:stack_size].copy_(frame)
+        else:
+            frame_buffers[index][stack_size - 1 + t].copy_(frame[-1])
+
+
+def stacked_frame_indices(done, stack_size):
+    """
+    :param done: (T + 1, B), as stored alongside the frames
+    :return: (T + 1, B, S) indices into the deduplicated time dimension, of the frames making up each step's stack
+    """
+    num_steps = done.shape[0]
+    steps = torch.arange(num_steps, device=done.device).view(-1, 1)
+
+    # The most recent reset at or before each step. A reset at step 0 is already reflected in the stored stack.
+    reset_steps = torch.where(done.bool() & (steps > 0), steps, torch.full_like(steps, -stack_size))
+    reset_steps = reset_steps.cummax(dim=0).values
+
+    offsets = torch.arange(-(stack_size - 1), 1, device=done.device)
+    source_steps = torch.maximum(steps.unsqueeze(-1) + offsets, reset_steps.unsqueeze(-1))
+    return source_steps + stack_size - 1
+
+
+def rebuild_frame_stacks(frames, done, out=None):
+    """
+    :param frames: (T + S, B, ...) deduplicated frames
+    :param done: (T + 1, B)
+    :param out: Optionally, the (T + 1, B, S, ...) tensor to write the result into
+    :return: (T + 1, B, S, ...) stacked frames
+    """
+    stack_size = frames.shape[0] - done.shape[0] + 1
+    batch_size = frames.shape[1]
+    indices = stacked_frame_indices(done, stack_size)
+
+    # Index into frames flattened over (time, batch)
+    flat_indices = indices * batch_size + torch.arange(batch_size, device=indices.device).view(1, -1, 1)
+    return _gather(frames.reshape(-1, *frames.shape[2:]), flat_indices, out)
+
+
+def gather_frame_stacks(frame_buffers, rollout_indices, done, out=None):
+    """
+    Gather and rebuild stacked frames straight from the rollout buffers, with no intermediate deduplicated batch.
+    :param frame_buffers: (num_buffers, T + S, ...) deduplicated frames
+    :param rollout_indices: (B,) the buffers to gather
+    :param done: (T + 1, B) the done flags of the buffers being gathered
+    :param out: Optionally, the (T + 1, B, S, ...) tensor to write the result into
+    :return: (T + 1, B, S, ...) stacked frames
+    """
+    stack_size = frame_buffers.shape[1] - done.shape[0] + 1
+    indices = stacked_frame_indices(done, stack_size)
+
+    # Index into frame_buffers flattened over (buffer, time)
+    flat_indices = rollout_indices.view(1, -1, 1) * frame_buffers.shape[1] + indices
+    return _gather(frame_buffers.view(-1, *frame_buffers.shape[2:]), flat_indices, out)
+
+
+def _gather(flat_frames, flat_indices, out):
+    result_shape = (*flat_indices.shape, *flat_frames.shape[1:])
+    if out is not None:
+        torch.index_select(flat_frames, 0, flat_indices.view(-1), out=out.view(-1, *flat_frames.shape[1:]))
+        return out
+
+    return flat_frames.index_select(0, flat_indices.view(-1)).view(result_shape)
@@ -0,0 +1,131 @@
+"""
+A FIFO of buffer indices held in shared memory, used by MonoBeast to pass rollout buffer indices between actors
+and learners.
+
+Compared to a Manager().Queue() this requires no server process, and a get() or put() is a few shared-memory
+operations under a (futex-backed) lock, rather than a socket round-trip through a proxy.
+"""
+
+import queue
+
+
+class SharedIndexQueue(object):
+    _HEAD, _TAIL, _CLOSED = range(3)
+
+    def __init__(self, capacity, ctx):
+        """
+        :param capacity: The maximum number of indices the queue holds at once. MonoBeast's indices are each only
+        ever in one place at a time, so num_buffers is sufficient.
+        :param ctx: The multiprocessing context processes using this queue will be created with. They must be
+        created after this queue.
+        """
+        self._capacity = capacity
+        self._ring = ctx.RawArray("i", capacity)
+        self._state = ctx.RawArray("q", 3)  # Head and tail are monotonically increasing counters
+        self._not_empty = ctx.Condition(ctx.RLock())
+
+    @property
+    def lock(self):
+        """
+        Hold this while suspending processes that use the queue, so none gets suspended partway through an
+        operation (which would leave the queue locked until it's resumed). Re-entrant, so the holder can still use
+        the queue. Note that a put that wakes a suspended getter blocks until that getter is resumed.
+        """
+        return self._not_empty
+
+    def _size(self):
+        return self._state[self._TAIL] - self._state[self._HEAD]
+
+    def _is_closed(self):
+        return self._state[self._CLOSED] != 0
+
+    def _pop(self, count):
+        head = self._state[self._HEAD]
+        indices = [self._ring[(head + offset) % self._capacity] for offset in range(count)]
+        self._state[self._HEAD] = head + count
+        return indices
+
+    def put(self, index):
+        with self._not_empty:
+            tail = self._state[self._TAIL]
+            if tail - self._state[self._HEAD] >= self._capacity:
+                raise queue.Full(f"SharedIndexQueue is at capacity ({self._capacity})")
+
+            self._ring[tail % self._capacity] = index
+            self._state[self._TAIL] = tail + 1
+            self._not_empty.notify()
+
+    def put_many(self, indices):
+        with self._not_empty:
+            tail = self._state[self._TAIL]
+            if tail + len(indices) - self._state[self._HEAD] > self._capacity:
+                raise queue.Full(f"SharedIndexQueue is at capacity ({self._capacity})")
+
+            for offset, index in enumerate(indices):
+                self._ring[(tail + offset) % self._capacity] = index
+            self._state[self._TAIL] = tail + len(indices)
+            self._not_empty.notify()
+
+    def get_many(self, count, timeout=None):
+        """
+        Atomically retrieve count indices, blocking until that many are available. Because none are taken until all
+        are available, multiple callers can't each hold a partial set while waiting on each other.
+        Wakeups are passed from one waiter to the next, so all callers waiting on the same queue at once should be
+        requesting the same count.
+        :return: The list of indices, or None if the queue was closed
+        :raises queue.Empty: if the timeout expires first
+        """
+        assert count <= self._capacity, f"Cannot wait for {count} indices from a queue of capacity {self._capacity}"
+        with self._not_empty:
+            ready = self._not_empty.wait_for(lambda: self._is_closed() or self._size() >= count, timeout)
+
+            if self._is_closed():
+                result = None
+            elif not ready:
+                raise queue.Empty
+            else:
+                result = self._pop(count)
+
+                # We may have been woken for several puts at once, so pass the wakeup along if more remain
+                if self._size() > 0:
+                    self._not_empty.notify()
+
+        return result
+
+    def get(self, block=True, timeout=None):
+        """
+        :return: The next index, or None if the queue was closed
+        """
+        indices = self.get_many(1, timeout=timeout if block else 0)
+        return indices[0] if indices is not None else None
+
+    def drain(self):
+        """
+        Remove and return everything currently in the queue, atomically with respect to puts and gets.
+        """
+        with self._not_empty:
+            return self._pop(self._size())
+
+    def close(self):
+        """
+        Wake every waiter, and make all current and future gets return None (until reset).
+        """
+        with self._not_empty:
+            self._state[self._CLOSED] = 1
+            self._not_empty.notify_all()
+
+    def reset(self):
+        """
+        Empty and re-open the queue.
+        """
+        with self._not_empty:
+            self._state[self._HEAD] = 0
+            self._state[self._TAIL] = 0
+            self._state[self._CLOSED] = 0
+
+    def qsize(self):
+        with self._not_empty:
+            return self._size()
+
+    def empty(self):
+        return self.qsize() == 0
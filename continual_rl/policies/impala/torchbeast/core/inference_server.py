@@ -0,0 +1,158 @@
+"""
+Centralized, dynamically batched inference for MonoBeast actors (in the style of SEED RL:
+https://arxiv.org/abs/1910.06591).
+
+Rather than every actor process running its own batch-1 forward pass, actors write their latest observation into a
+shared-memory slot and request an action. One or more inference workers (threads in the learner process) collect
+requests across actors until either every actor is waiting or a latency deadline passes, run a single batched
+forward, and write the outputs back into each actor's output slot.
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+
+class InferenceServer(object):
+    # Caps on how many samples are held between calls to get_stats(), so a long gap between yields can't grow
+    # the stats without bound.
+    MAX_STATS_SAMPLES = 10000
+
+    def __init__(self, model, action_space_id, input_examples, output_examples, num_clients, ctx, num_workers=1,
+                 batch_deadline_ms=2.0):
+        """
+        :param model: The (shared) actor model used to compute actions.
+        :param action_space_id: Passed through to the model.
+        :param input_examples: Dict of example per-request inputs with shape (1, B, ...), where B is the number of
+        environments a single client steps at once. Used to allocate the shared request slots.
+        :param output_examples: Dict of example per-request model outputs, with shape (1, B, ...).
+        :param num_clients: The number of actors that will make requests.
+        :param ctx: The multiprocessing context the actors will be created with.
+        """
+        self._model = model
+        self._action_space_id = action_space_id
+        self._num_clients = num_clients
+        self._num_workers = num_workers
+        self._batch_deadline = batch_deadline_ms / 1000
+
+        # Slots are laid out (client, T=1, B, ...)
+        self._inputs = {key: torch.zeros((num_clients, *tensor.shape), dtype=tensor.dtype).share_memory_()
+                        for key, tensor in input_examples.items()}
+        self._outputs = {key: torch.zeros((num_clients, *tensor.shape), dtype=tensor.dtype).share_memory_()
+                         for key, tensor in output_examples.items()}
+        self._request_times = torch.zeros((num_clients,), dtype=torch.float64).share_memory_()
+
+        self._request_queue = ctx.Queue()
+        self._responses_ready = [ctx.Semaphore(0) for _ in range(num_clients)]
+
+        # Only used on the learner process
+        self._workers = []
+        self._stop_requested = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = []
+        self._latencies_ms = []
+
+    def start(self):
+        self._stop_requested.clear()
+        for worker_id in range(self._num_workers):
+            worker = threading.Thread(target=self._serve, name=f"inference-worker-{worker_id}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        self._stop_requested.set()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def reset_client(self, client_id):
+        """
+        Called by a (possibly recreated) client before its first request, so a response that was released to a
+        previous process using the same slot isn't mistaken for a response to the new request.
+        """
+        while self._responses_ready[client_id].acquire(block=False):
+            pass
+
+    def infer(self, client_id, env_output):
+        """
+        Called from the actor process. Blocks until the agent output for env_output has been computed.
+        """
+        for key, slot in self._inputs.items():
+            slot[client_id].copy_(env_output[key])
+
+        self._request_times[client_id] = time.monotonic()
+        self._request_queue.put(client_id)
+        self._responses_ready[client_id].acquire()
+
+        # Clone, because the slot gets overwritten on this client's next request
+        return {key: slot[client_id].clone() for key, slot in self._outputs.items()}
+
+    def _serve(self):
+        while not self._stop_requested.is_set():
+            try:
+                client_ids = [self._request_queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            # Keep collecting requests until everyone is waiting on us, or we've hit our deadline
+            deadline = time.monotonic() + self._batch_deadline
+            while len(client_ids) < self._num_clients:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        client_ids.append(self._request_queue.get(timeout=remaining))
+                    else:
+                        client_ids.append(self._request_queue.get(block=False))
+                except queue.Empty:
+                    break
+
+            self._process_batch(client_ids)
+
+    def _process_batch(self, client_ids):
+        num_requests = len(client_ids)
+        indices = torch.tensor(client_ids, dtype=torch.int64)
+
+        # (client, 1, B, ...) -> (1, client * B, ...)
+        inputs = {key: slot.index_select(0, indices).transpose(0, 1).flatten(1, 2)
+                  for key, slot in self._inputs.items()}
+
+        with torch.no_grad():
+            outputs, _ = self._model(inputs, self._action_space_id)
+
+        for key, slot in self._outputs.items():
+            output = outputs[key].view(1, num_requests, *slot.shape[2:]).transpose(0, 1)
+            slot.index_copy_(0, indices, output.to(slot.dtype))
+
+        now = time.monotonic()
+        latencies_ms = (now - self._request_times[indices].numpy()) * 1000
+
+        for client_id in client_ids:
+            self._responses_ready[client_id].release()
+
+        with self._stats_lock:
+            if len(self._batch_sizes) < self.MAX_STATS_SAMPLES:
+                self._batch_sizes.append(num_requests)
+            if len(self._latencies_ms) < self.MAX_STATS_SAMPLES:
+                self._latencies_ms.extend(latencies_ms.tolist())
+
+    def get_stats(self):
+        """
+        Returns (and resets) the batch size and latency histograms collected since the last call.
+        """
+        with self._stats_lock:
+            batch_sizes = self._batch_sizes
+            latencies_ms = self._latencies_ms
+            self._batch_sizes = []
+            self._latencies_ms = []
+
+        stats = {
+            "inference_batch_size_hist": batch_sizes,
+            "inference_latency_ms_hist": latencies_ms,
+            "inference_batch_size_mean": np.mean(batch_sizes) if len(batch_sizes) > 0 else np.nan,
+            "inference_latency_ms_p50": np.percentile(latencies_ms, 50) if len(latencies_ms) > 0 else np.nan,
+            "inference_latency_ms_p95": np.percentile(latencies_ms, 95) if len(latencies_ms) > 0 else np.nan,
+        }
+        return stats
@@ -0,0 +1,96 @@
+"""
+Data-parallel learning across several learner processes on one machine. Each process learns from its own batches,
+and the gradients are averaged (all-reduced, via torch.distributed's gloo backend) before every optimizer step, so
+every process takes the same step and their weights stay identical. The processes step in lockstep: each step
+starts with them agreeing to continue, so they all stop together as soon as any runs out of batches.
+"""
+
+import datetime
+import socket
+
+import torch
+from torch import distributed as dist
+
+# Rank 0 can spend a long time not learning, e.g. while yielded to run evaluations, during which the other processes
+# wait on it. (They don't otherwise wait on each other for long.)
+COLLECTIVE_TIMEOUT = datetime.timedelta(days=1)
+
+
+class LearnerProcessGroup(object):
+
+    def __init__(self, rank, world_size, port):
+        """
+        Blocks until all world_size processes have joined.
+        :param port: A free localhost port, the same for every process. Rank 0 listens on it.
+        """
+        self.rank = rank
+        self.world_size = world_size
+        self.stopped = False  # Whether the processes have agreed to stop
+
+        dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size,
+                                timeout=COLLECTIVE_TIMEOUT)
+
+    @staticmethod
+    def find_free_port():
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    @property
+    def is_rank_0(self):
+        return self.rank == 0
+
+    def all_continue(self, can_continue, timeout=None):
+        """
+        Called by every process at the start of each step. Returns True only if every process can continue.
+        :param timeout: A datetime.timedelta to wait at most, after which a RuntimeError is raised
+        """
+        flag = torch.tensor([int(can_continue)])
+        work = dist.all_reduce(flag, op=dist.ReduceOp.MIN, async_op=True)
+        if timeout is not None:
+            work.wait(timeout=timeout)
+        else:
+            work.wait()
+
+        self.stopped = not bool(flag.item())
+        return not self.stopped
+
+    def all_reduce_gradients(self, model):
+        """
+        Replace each parameter's gradient with its mean over the processes. A parameter with no gradient in any
+        process is left with none.
+        """
+        parameters = [parameter for parameter in model.parameters() if parameter.requires_grad]
+        gradients = [parameter.grad if parameter.grad is not None else torch.zeros_like(parameter)
+                     for parameter in parameters]
+        has_gradient = torch.tensor([float(parameter.grad is not None) for parameter in parameters],
+                                    dtype=gradients[0].dtype, device=gradients[0].device)
+
+        # One collective for everything, rather than one per parameter
+        flat = torch.cat([gradient.reshape(-1) for gradient in gradients] + [has_gradient])
+        dist.all_reduce(flat)
+        flat_gradients = flat[:-len(parameters)] / self.world_size
+        has_gradient = flat[-len(parameters):] > 0
+
+        offset = 0
+        for parameter, gradient, parameter_has_gradient in zip(parameters, gradients, has_gradient):
+            mean_gradient = flat_gradients[offset:offset + gradient.numel()].view_as(gradient)
+            offset += gradient.numel()
+            parameter.grad = mean_gradient if parameter_has_gradient else None
+
+    def broadcast_from_rank_0(self, tensors):
+        """
+        Overwrite the tensors, in place, with rank 0's.
+        """
+        with torch.no_grad():
+            for tensor in tensors:
+                dist.broadcast(tensor, src=0)
+
+    def all_reduce_sum(self, tensor):
+        """
+        Replace the tensor, in place, with its sum over the processes.
+        """
+        dist.all_reduce(tensor)
+
+    def close(self):
+        dist.destroy_process_group()
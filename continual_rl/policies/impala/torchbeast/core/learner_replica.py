@@ -0,0 +1,80 @@
+"""
+A learner thread's own copy of the learner model. Each learner thread computes its loss and gradients on its
+replica, so the threads' forward and backward passes can run concurrently, instead of all being serialized on the
+learner model (learner_concurrency "serialized", where there are no replicas).
+
+A replica either has its own copy of the weights ("concurrent"), which the thread refreshes from the learner model
+(under the learn lock) before each step and whose gradients it hands back to the learner model's optimizer, or it
+shares the learner model's weight storage outright ("hogwild"). Shared weights are never stale, but are updated in
+place by every thread's optimizer step (each taken under the learn lock), including partway through another thread's
+forward or backward pass.
+
+Either way, the replica's buffers (e.g. the running reward moments) are the learner model's own, which are only
+updated under the learn lock, so every thread's updates accumulate there.
+"""
+
+import copy
+
+import torch
+
+
+class LearnerReplica(object):
+
+    def __init__(self, learner_model, share_weights=False):
+        """
+        Must be created while nothing is updating learner_model.
+        """
+        self.model = copy.deepcopy(learner_model)
+        self.share_weights = share_weights
+        self.optimizer = None  # Only used when sharing weights, see create_optimizer
+        self._learner_parameters = [*learner_model.parameters()]
+
+        # Assigning .data aliases the storage, but keeps the replica's own autograd version counters, so the learner's
+        # in-place updates don't invalidate graphs this thread has in flight.
+        aliased_pairs = [*zip(self.model.buffers(), learner_model.buffers())]
+        if share_weights:
+            aliased_pairs.extend(zip(self.model.parameters(), self._learner_parameters))
+
+        for tensor, learner_tensor in aliased_pairs:
+            tensor.data = learner_tensor.data
+        self.model.is_learner_replica = True
+
+    def create_optimizer(self, create_optimizer, learner_optimizer):
+        """
+        Create this replica's own optimizer, for stepping the shared weights directly. Its per-parameter state (e.g.
+        RMSprop's running averages) is the learner optimizer's, so every thread updates the same state, and the
+        learner optimizer remains the one to save and load.
+        :param create_optimizer: Called with an iterable of parameters, returns an optimizer configured like
+        learner_optimizer
+        """
+        assert self.share_weights, "Only replicas sharing the learner's weights step them directly."
+        self.optimizer = create_optimizer(self.model.parameters())
+
+        for parameter, learner_parameter in zip(self.model.parameters(), self._learner_parameters):
+            # Indexing the state creates the (empty) entry if the learner optimizer hasn't stepped yet, and whichever
+            # optimizer steps first fills it in place
+            self.optimizer.state[parameter] = learner_optimizer.state[learner_parameter]
+
+    def sync_learning_rate(self, learner_optimizer):
+        """
+        Follow the learner optimizer's learning rate, which its scheduler may be changing.
+        """
+        for group, learner_group in zip(self.optimizer.param_groups, learner_optimizer.param_groups):
+            group["lr"] = learner_group["lr"]
+
+    def pull(self):
+        """
+        Refresh the replica's weights from the learner model. Must be called under the learn lock.
+        """
+        if not self.share_weights:
+            with torch.no_grad():
+                for parameter, learner_parameter in zip(self.model.parameters(), self._learner_parameters):
+                    parameter.copy_(learner_parameter)
+
+    def push_gradients(self):
+        """
+        Hand the gradients computed on the replica to the learner model, for its optimizer. Must be called under the
+        learn lock.
+        """
+        for parameter, learner_parameter in zip(self.model.parameters(), self._learner_parameters):
+            learner_parameter.grad = parameter.grad
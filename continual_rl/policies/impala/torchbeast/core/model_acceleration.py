@@ -0,0 +1,94 @@
+"""
+Optional ways of speeding up the model: compiling its modules with torch.compile, and running the learner's forward
+pass in bfloat16 under autocast. Autocast only changes the dtype of the computation, so the weights, their gradients
+and the optimizer state all stay float32. Neither is supported everywhere, so check before enabling them (Monobeast
+falls back to running eagerly, or in float32, where they aren't).
+"""
+
+import logging
+
+import torch
+from torch import nn
+
+
+def compile_supported(device):
+    """
+    Whether torch.compile can compile a module on this platform, and run forward and backward through it. (E.g. it
+    needs a working C++ compiler to generate CPU kernels, and Triton for CUDA ones.)
+    """
+    if not hasattr(nn.Module, "compile"):  # Compiling in place (which keeps the state dict's keys) needs torch 2.2+
+        return False
+
+    try:
+        probe = nn.Linear(2, 1).to(device)
+        probe.compile()
+        probe(torch.ones((1, 2), device=device)).sum().backward()
+    except Exception:
+        return False
+
+    return True
+
+
+def compile_in_place(module, logger=None):
+    """
+    Compile module's forward with torch.compile. Only the forward is replaced, so the state dict is unchanged. A graph
+    can still fail to compile (e.g. one first run with autograd in a learner process, which is forked after this
+    process has used autograd), in which case module runs eagerly from then on, rather than raising. Nothing else
+    compiled in the process is affected, and errors that aren't compilation failures are raised as usual.
+    :param logger: Where to report falling back to eager. Defaults to this module's logger.
+    """
+    module.forward = _CompiledForward(module.forward, logger or logging.getLogger(__name__))
+
+
+class _CompiledForward(object):
+    """
+    A module's compiled forward, until it first fails to compile, then its eager one. A copy of the module (e.g. a
+    learner replica, or one pickled for test episodes) gets its own, compiled from the copy's eager forward.
+    """
+    COMPILE_FAILURES = (torch._dynamo.exc.BackendCompilerFailed, torch._dynamo.exc.InternalTorchDynamoError)
+
+    def __init__(self, eager_forward, logger):
+        self._eager_forward = eager_forward
+        self._compiled_forward = torch.compile(eager_forward)
+        self._logger = logger
+
+    def __call__(self, *args, **kwargs):
+        if self._compiled_forward is not None:
+            try:
+                return self._compiled_forward(*args, **kwargs)
+            except self.COMPILE_FAILURES as e:
+                self._logger.warning(f"Compiling {type(self._eager_forward.__self__).__name__} failed, running it "
+                                     f"eagerly: {type(e).__name__}: {e}")
+                self._compiled_forward = None
+
+        return self._eager_forward(*args, **kwargs)
+
+    def __reduce__(self):
+        # Compiled again when copied or unpickled. The eager forward is a bound method, so a copy is bound to the
+        # module's copy.
+        return _CompiledForward, (self._eager_forward, self._logger)
+
+
+def bf16_autocast_supported(device):
+    """
+    Whether the device natively supports the bfloat16 ops autocast would use. (Autocasting to bfloat16 on a CPU
+    without them runs, but is slower than float32.)
+    """
+    if device.type == "cuda":
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+
+    if device.type == "cpu":
+        try:
+            return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        except (AttributeError, RuntimeError):
+            return False
+
+    return False
+
+
+def learner_autocast(model_flags):
+    """
+    The context the learner's forward pass runs in: bfloat16 autocast, if enabled, otherwise a no-op.
+    """
+    return torch.autocast(device_type=model_flags.device.type, dtype=torch.bfloat16,
+                          enabled=model_flags.learner_bf16_autocast)
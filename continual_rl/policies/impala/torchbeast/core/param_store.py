@@ -0,0 +1,82 @@
+"""
+A versioned, double-buffered copy of a model's weights in shared memory, used to broadcast the learner's weights to
+the actors (with use_param_store). Each actor acts with its own private copy of the weights, refreshed from the store
+once per unroll, rather than reading the shared actor model while the learner writes it.
+
+The learner publishes by copying its parameters and buffers into whichever of the two slots is not the latest, then
+bumping the version. Actors copy the latest slot into their own private model. Since the learner only ever writes
+the slot readers aren't directed to, a reader is only torn if the learner publishes twice during a single read,
+which the reader detects (seqlock-style) and retries.
+"""
+
+import collections
+
+import torch
+
+
+class ParamStore(object):
+
+    def __init__(self, model, ctx):
+        """
+        :param model: The model to publish from. Any model pulled into must have the same architecture.
+        :param ctx: The multiprocessing context processes reading from the store will be created with. They must be
+        created after this store.
+        """
+        # All tensors of a given dtype are packed into one flat tensor, per slot
+        self._layout = []  # (dtype, offset, numel) per tensor of the model
+        sizes = collections.OrderedDict()
+        for tensor in self._get_tensors(model):
+            offset = sizes.get(tensor.dtype, 0)
+            self._layout.append((tensor.dtype, offset, tensor.numel()))
+            sizes[tensor.dtype] = offset + tensor.numel()
+
+        self._slots = [{dtype: torch.zeros((size,), dtype=dtype).share_memory_() for dtype, size in sizes.items()}
+                       for _ in range(2)]
+
+        # The latest complete version is in slot version % 2. write_started is the version being written.
+        self._version = ctx.RawValue("q", 0)
+        self._write_started = ctx.RawValue("q", 0)
+        self.publish(model)
+
+    @staticmethod
+    def _get_tensors(model):
+        return [*model.parameters(), *model.buffers()]
+
+    @property
+    def version(self):
+        return self._version.value
+
+    def publish(self, model):
+        """
+        Copy the model's current weights in as a new version. Only one process/thread may publish at a time.
+        """
+        version = self._version.value + 1
+        slot = self._slots[version % 2]
+        self._write_started.value = version
+
+        with torch.no_grad():
+            for tensor, (dtype, offset, numel) in zip(self._get_tensors(model), self._layout):
+                slot[dtype][offset:offset + numel].copy_(tensor.detach().reshape(-1))
+
+        self._version.value = version
+        return version
+
+    def pull(self, model, known_version=None):
+        """
+        Copy the latest weights into model, unless it already has them.
+        :param known_version: The version the model currently has, if any.
+        :return: The version the model now has
+        """
+        while True:
+            version = self._version.value
+            if version == known_version:
+                return version
+
+            slot = self._slots[version % 2]
+            with torch.no_grad():
+                for tensor, (dtype, offset, numel) in zip(self._get_tensors(model), self._layout):
+                    tensor.copy_(slot[dtype][offset:offset + numel].view_as(tensor))
+
+            # If a publish of the slot we were reading began, what we read may be torn, so try again
+            if self._write_started.value <= version + 1:
+                return version
@@ -0,0 +1,398 @@
+"""
+File-backed replay storage, laid out as one contiguous tensor per key holding every actor's section in turn, so an
+entry is addressed by a single flat index, and a replay batch is read in one forward pass over each file.
+Optionally, keys (e.g. frames) can instead be stored compressed (see CompressedReplayBuffer).
+"""
+
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from continual_rl.utils.utils import Utils
+
+
+def create_replay_buffers(permanent_path, specs, num_actors, entries_per_actor, compressed_keys=(),
+                          compression_level=1, decompression_workers=2):
+    """
+    Create (or load, if they exist) the replay buffers. Each is returned as a (num_actors, entries_per_actor, ...)
+    view of its file, so buffers[key][actor_index][entry] is one entry, but the storage is contiguous.
+    Buffers stored in the previous layout (a file per actor, possibly with other dtypes) aren't loaded: those keys are
+    created fresh, and reported as such, and the old files are left as they are.
+
+    The keys in compressed_keys are instead CompressedReplayBuffers, so should be written and read with
+    write_replay_entry, read_replay_entry, and gather_replay_entries.
+    :return: (buffers, the file paths backing them, the keys whose files were newly created)
+    """
+    buffers = {}
+    file_names = []
+    created_keys = []
+
+    for key, spec in specs.items():
+        if key in compressed_keys:
+            buffers[key] = CompressedReplayBuffer(permanent_path, key, spec["size"], spec["dtype"], num_actors,
+                                                  entries_per_actor, compression_level, decompression_workers)
+            file_names.extend(buffers[key].file_names)
+            if buffers[key].created:
+                created_keys.append(key)
+            continue
+
+        permanent_file_name = f"replay_{key}.fbt"
+        file_existed = os.path.exists(os.path.join(permanent_path, permanent_file_name))
+        flat_tensor, file_name, _ = Utils.create_file_backed_tensor(
+            permanent_path,
+            (num_actors * entries_per_actor, *spec["size"]),
+            spec["dtype"],
+            permanent_file_name=permanent_file_name,
+        )
+        buffers[key] = flat_tensor.view(num_actors, entries_per_actor, *spec["size"])
+        file_names.append(file_name)
+
+        if not file_existed:
+            created_keys.append(key)
+
+    return buffers, file_names, created_keys
+
+
+def gather_replay_entries(buffers, actor_indices, entry_indices, out=None):
+    """
+    Gather entries into a (T + 1, B, ...) batch (the layout the learner uses), reading them in the order they're
+    stored, so reads sweep forward through each file.
+
+    Each entry is copied straight into its column of the batch. (A single index_select can't produce this layout
+    without a second, transposing copy, which costs more than the per-entry dispatch saves; see
+    benchmarks/replay_gather_benchmark.py.) Most of the cost of a large batch is allocating it, so giving out saves
+    the most.
+    :param actor_indices: (B,) the actor whose section each entry is in
+    :param entry_indices: (B,) the entry within that section
+    :param out: Optionally, a dict of tensors to gather into, each (T + 1, B, ...)
+    """
+    entries_per_actor = next(iter(buffers.values())).shape[1]
+    flat_indices = np.asarray(actor_indices, dtype=np.int64) * entries_per_actor + \
+        np.asarray(entry_indices, dtype=np.int64)
+    flat_indices = np.sort(flat_indices).tolist()
+
+    batch = {}
+    for key, buffer in buffers.items():
+        destination = out[key] if out is not None else \
+            torch.empty((buffer.shape[2], len(flat_indices), *buffer.shape[3:]), dtype=buffer.dtype)
+
+        if isinstance(buffer, CompressedReplayBuffer):
+            batch[key] = buffer.read_into(flat_indices, destination)
+        else:
+            flat_buffer = buffer.view(-1, *buffer.shape[2:])
+            batch[key] = torch.stack([flat_buffer[index] for index in flat_indices], dim=1, out=destination)
+
+    return batch
+
+
+def write_replay_entry(buffers, actor_index, entry_index, new_buffers):
+    """
+    Write each of new_buffers (key: one entry) to that entry of the replay buffers.
+    """
+    for key, value in new_buffers.items():
+        if isinstance(buffers[key], CompressedReplayBuffer):
+            buffers[key].write(actor_index, entry_index, value)
+        else:
+            buffers[key][actor_index][entry_index][...] = value
+
+
+def read_replay_entry(buffers, actor_index, entry_index):
+    """
+    :return: One entry of each of the replay buffers, as {key: entry}
+    """
+    return {key: buffer.read(actor_index, entry_index) if isinstance(buffer, CompressedReplayBuffer)
+            else buffer[actor_index][entry_index]
+            for key, buffer in buffers.items()}
+
+
+def get_replay_stats(buffers):
+    """
+    :return: The stats of each of the compressed replay buffers, e.g. to log
+    """
+    stats = {}
+    for buffer in buffers.values():
+        if isinstance(buffer, CompressedReplayBuffer):
+            stats.update(buffer.get_stats())
+    return stats
+
+
+class _SegmentAllocator(object):
+    """
+    Decides where in a section's segment file each compressed entry is written. Space is handed out in size classes
+    (multiples of a page, eight per doubling), so a region freed by an overwritten entry can be reused as-is by any new
+    entry of the same class, without splitting or merging regions, at the cost of rounding each up (by at most 1/8th).
+    """
+    PAGE_SIZE = 4096
+    CLASSES_PER_DOUBLING_LOG2 = 3
+
+    def __init__(self, regions):
+        """
+        :param regions: The (offset, length) in the file of each of the section's entries
+        """
+        self._free_offsets = {}  # Size class: offsets of free regions of that size
+        self.end = 0
+
+        for offset, length in sorted(regions):
+            self._free_gap(self.end, offset - self.end)
+            self.end = offset + self.size_class(length)
+
+    @classmethod
+    def size_class(cls, num_bytes):
+        num_pages = max(-(-num_bytes // cls.PAGE_SIZE), 1)
+        step = 1 << max(num_pages.bit_length() - 1 - cls.CLASSES_PER_DOUBLING_LOG2, 0)
+        return -(-num_pages // step) * step * cls.PAGE_SIZE
+
+    def allocate(self, num_bytes):
+        """
+        :return: The offset to write num_bytes to
+        """
+        free_offsets = self._free_offsets.get(self.size_class(num_bytes))
+        if free_offsets:
+            return free_offsets.pop()
+
+        offset = self.end
+        self.end += self.size_class(num_bytes)
+        return offset
+
+    def free(self, offset, length):
+        size = self.size_class(length)
+        if offset + size == self.end:
+            self.end = offset
+        else:
+            self._free_offsets.setdefault(size, []).append(offset)
+
+    def _free_gap(self, offset, gap_bytes):
+        # Gaps found when rebuilding aren't necessarily a whole size class, so are split into the largest that fit
+        while gap_bytes >= self.PAGE_SIZE:
+            gap_pages = gap_bytes // self.PAGE_SIZE
+            step = 1 << max(gap_pages.bit_length() - 1 - self.CLASSES_PER_DOUBLING_LOG2, 0)
+            size = gap_pages // step * step * self.PAGE_SIZE
+            self._free_offsets.setdefault(size, []).append(offset)
+            offset += size
+            gap_bytes -= size
+
+
+class _ProcessState(object):
+    """
+    What a CompressedReplayBuffer can't share with the processes it's forked into: open files, its worker pool, and
+    the allocators of the sections the process writes.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.file_descriptors = {}
+        self.allocators = {}  # actor_index: (allocator, the section's write count as of its last write)
+        self.pool = None
+        self.stats_lock = threading.Lock()
+        self.read_seconds = 0
+        self.num_reads = 0
+
+
+class CompressedReplayBuffer(object):
+    """
+    A replay buffer whose entries are each stored zlib-compressed, trading CPU for disk space (and, when sampling is
+    disk-bound, bandwidth). Frames compress well, since each frame of a stack is repeated in the next few stacks.
+
+    Each actor's section is a segment file of variable-length compressed entries, written only by the process acting
+    for that actor, and an index shared by all processes locates each entry (as its page offset and length, packed in
+    one int64, so it's never read half-written). Entries are read without locking: a read is retried if the entry was
+    rewritten while it was being read. Reads are decompressed in a small thread pool (zlib releases the GIL).
+    """
+    LENGTH_BITS = 32
+    MAX_READ_ATTEMPTS = 5
+
+    # Columns of the per-section stats
+    NUM_WRITES = 0
+    NUM_FILLED = 1
+    COMPRESSED_BYTES = 2
+
+    def __init__(self, permanent_path, key, entry_shape, dtype, num_actors, entries_per_actor, compression_level,
+                 num_workers):
+        if not 0 <= compression_level <= 9:
+            raise ValueError(f"The replay compression level must be from 0 to 9, not {compression_level}")
+        if num_workers < 0:
+            raise ValueError(f"The number of decompression workers must not be negative, not {num_workers}")
+
+        self.shape = (num_actors, entries_per_actor, *entry_shape)
+        self.dtype = dtype
+        self._key = key
+        self._numpy_dtype = torch.empty((), dtype=dtype).numpy().dtype
+        self._entry_bytes = int(np.prod(entry_shape)) * self._numpy_dtype.itemsize
+        self._compression_level = compression_level
+        self._num_workers = num_workers
+        assert self._entry_bytes < 2 ** self.LENGTH_BITS, "Replay entries are too large to compress"
+
+        index_file_name = f"replay_{key}_index.fbt"
+        self.created = not os.path.exists(os.path.join(permanent_path, index_file_name))
+        self._locations, index_file_path, _ = Utils.create_file_backed_tensor(
+            permanent_path, (num_actors * entries_per_actor,), torch.int64, permanent_file_name=index_file_name)
+        self._segment_paths = [os.path.join(permanent_path, f"replay_{key}_{actor_index}.seg")
+                               for actor_index in range(num_actors)]
+
+        if self.created:
+            self._locations.zero_()
+            for segment_path in self._segment_paths:
+                open(segment_path, "wb").close()
+
+        self.file_names = [index_file_path, *self._segment_paths]
+
+        self._section_stats = torch.zeros((num_actors, 3), dtype=torch.int64).share_memory_()
+        for actor_index in range(num_actors):
+            _, lengths = self._get_section_locations(actor_index)
+            self._section_stats[actor_index, self.NUM_FILLED] = len(lengths)
+            self._section_stats[actor_index, self.COMPRESSED_BYTES] = sum(lengths)
+
+        self._process_state = None
+
+    def write(self, actor_index, entry_index, entry):
+        process_state = self._get_process_state()
+        allocator = self._get_allocator(process_state, actor_index)
+        data = zlib.compress(np.ascontiguousarray(entry.numpy()), self._compression_level)
+
+        offset = allocator.allocate(len(data))
+        os.pwrite(self._get_file_descriptor(process_state, actor_index), data, offset)
+
+        # Point the index at the new data before freeing the old, so a read of the old either finishes first or sees
+        # the index change, and retries
+        flat_index = actor_index * self.shape[1] + int(entry_index)
+        old_offset, old_length = self._unpack(int(self._locations[flat_index]))
+        self._locations[flat_index] = self._pack(offset, len(data))
+        if old_length > 0:
+            allocator.free(old_offset, old_length)
+
+        section_stats = self._section_stats[actor_index]
+        section_stats[self.NUM_WRITES] += 1
+        section_stats[self.NUM_FILLED] += int(old_length == 0)
+        section_stats[self.COMPRESSED_BYTES] += len(data) - old_length
+        process_state.allocators[actor_index] = (allocator, int(section_stats[self.NUM_WRITES]))
+
+    def read(self, actor_index, entry_index):
+        entry = torch.empty(self.shape[2:], dtype=self.dtype)
+        self._read_entry(self._get_process_state(), actor_index * self.shape[1] + int(entry_index), entry)
+        return entry
+
+    def read_into(self, flat_indices, destination):
+        """
+        Read the entries at these flat indices (actor_index * entries_per_actor + entry_index) into the columns of a
+        (T + 1, B, ...) destination.
+        """
+        process_state = self._get_process_state()
+        start_time = time.perf_counter()
+        self._map(process_state, lambda column: self._read_entry(process_state, flat_indices[column],
+                                                                 destination[:, column]),
+                  range(len(flat_indices)))
+
+        with process_state.stats_lock:
+            process_state.read_seconds += time.perf_counter() - start_time
+            process_state.num_reads += 1
+
+        return destination
+
+    def read_all(self):
+        """
+        :return: Every entry, as a (num_actors, entries_per_actor, ...) tensor. Unfilled entries are zeros.
+        """
+        process_state = self._get_process_state()
+        entries = torch.empty(self.shape, dtype=self.dtype)
+        flat_entries = entries.view(-1, *self.shape[2:])
+        self._map(process_state, lambda flat_index: self._read_entry(process_state, flat_index,
+                                                                     flat_entries[flat_index]),
+                  range(len(flat_entries)))
+        return entries
+
+    def get_stats(self):
+        """
+        :return: The size of the segment files, how much the stored entries are compressed (if there are any), and
+        the mean time spent reading (and decompressing) each batch since the last call (if there were any)
+        """
+        process_state = self._get_process_state()
+        with process_state.stats_lock:
+            read_seconds, num_reads = process_state.read_seconds, process_state.num_reads
+            process_state.read_seconds, process_state.num_reads = 0, 0
+
+        totals = self._section_stats.sum(dim=0)
+        compressed_bytes = int(totals[self.COMPRESSED_BYTES])
+        segment_bytes = sum(os.path.getsize(segment_path) for segment_path in self._segment_paths)
+
+        stats = {f"replay_{self._key}_segment_mb": segment_bytes / 1e6}
+        if compressed_bytes > 0:
+            stats[f"replay_{self._key}_compression_ratio"] = \
+                int(totals[self.NUM_FILLED]) * self._entry_bytes / compressed_bytes
+        if num_reads > 0:
+            stats[f"replay_{self._key}_read_ms"] = 1000 * read_seconds / num_reads
+
+        return stats
+
+    def _read_entry(self, process_state, flat_index, out):
+        actor_index = flat_index // self.shape[1]
+
+        for _ in range(self.MAX_READ_ATTEMPTS):
+            location = int(self._locations[flat_index])
+            offset, length = self._unpack(location)
+            if length == 0:
+                out.zero_()
+                return
+
+            data = os.pread(self._get_file_descriptor(process_state, actor_index), length, offset)
+            try:
+                entry = zlib.decompress(data)
+            except zlib.error:
+                entry = None
+
+            # If the index changed, the entry was rewritten, and its old data possibly overwritten, while being read
+            if entry is not None and len(entry) == self._entry_bytes and int(self._locations[flat_index]) == location:
+                out.numpy()[...] = np.frombuffer(entry, dtype=self._numpy_dtype).reshape(self.shape[2:])
+                return
+
+        raise RuntimeError(f"Replay entry {flat_index} of {self._key} could not be read: it's either being rewritten "
+                           f"constantly, or its segment file is corrupt")
+
+    def _map(self, process_state, fn, items):
+        if self._num_workers == 0:
+            for item in items:
+                fn(item)
+            return
+
+        if process_state.pool is None:
+            process_state.pool = ThreadPoolExecutor(max_workers=self._num_workers,
+                                                    thread_name_prefix="replay-decompress")
+        list(process_state.pool.map(fn, items))  # Waits for them all, and raises any exception
+
+    def _get_process_state(self):
+        if self._process_state is None or self._process_state.pid != os.getpid():
+            self._process_state = _ProcessState()
+        return self._process_state
+
+    def _get_file_descriptor(self, process_state, actor_index):
+        if actor_index not in process_state.file_descriptors:
+            process_state.file_descriptors[actor_index] = os.open(self._segment_paths[actor_index], os.O_RDWR)
+        return process_state.file_descriptors[actor_index]
+
+    def _get_allocator(self, process_state, actor_index):
+        # If another process has written the section since this one last did, what's free has changed, so rebuild it
+        allocator, num_writes = process_state.allocators.get(actor_index, (None, None))
+        if allocator is None or num_writes != int(self._section_stats[actor_index, self.NUM_WRITES]):
+            allocator = _SegmentAllocator(zip(*self._get_section_locations(actor_index)))
+        return allocator
+
+    def _get_section_locations(self, actor_index):
+        """
+        :return: (offsets, lengths) of the filled entries of the actor's section
+        """
+        entries_per_actor = self.shape[1]
+        locations = self._locations.numpy()[actor_index * entries_per_actor:(actor_index + 1) * entries_per_actor]
+        locations = locations[locations != 0]
+        offsets, lengths = self._unpack(locations)
+        return offsets.tolist(), lengths.tolist()
+
+    @classmethod
+    def _pack(cls, offset, length):
+        return (offset // _SegmentAllocator.PAGE_SIZE) << cls.LENGTH_BITS | length
+
+    @classmethod
+    def _unpack(cls, location):
+        return (location >> cls.LENGTH_BITS) * _SegmentAllocator.PAGE_SIZE, location & ((1 << cls.LENGTH_BITS) - 1)
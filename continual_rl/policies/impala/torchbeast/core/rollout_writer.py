@@ -0,0 +1,73 @@
+"""
+Writes an actor's rollouts into the shared rollout buffers without allocating on every step.
+
+The actor's environments each write their step output in place into their column of one preallocated (T=1, B, ...)
+tensor per key, which is also what the model acts on. Each step is then committed into every environment's shared
+buffer slot: with a single index_copy_ per key, except for the frames, which are large enough that a copy per
+environment is faster.
+
+Only the keys the buffers have are written (see Monobeast.create_buffer_specs), each cast to its buffer's dtype.
+"""
+
+import torch
+
+from continual_rl.policies.impala.torchbeast.core import frame_dedup
+from continual_rl.policies.impala.torchbeast.core.environment import Environment
+
+
+class RolloutWriter(object):
+
+    def __init__(self, buffers, num_envs, observation_shape, deduplicate_frames=False):
+        """
+        :param buffers: The shared rollout buffers, each (num_buffers, T + 1, ...)
+        :param num_envs: The number of environments the actor steps in lockstep, each writing its own buffer slot
+        :param observation_shape: The shape of one (stacked) frame, as the environment produces it
+        :param deduplicate_frames: Whether the frame buffers are stored deduplicated (see frame_dedup)
+        """
+        self._buffers = buffers
+        self._deduplicate_frames = deduplicate_frames
+        self._indices = torch.zeros((num_envs,), dtype=torch.int64)
+        self._index_list = []
+
+        # The current step's output of every environment, in the dtypes the model acts on
+        self.env_output = {key: torch.zeros((1, num_envs), dtype=Environment.OUTPUT_DTYPES[key])
+                           for key in Environment.OUTPUT_KEYS}
+        self.env_output["frame"] = torch.zeros((1, num_envs, *observation_shape), dtype=buffers["frame"].dtype)
+
+        # What each environment writes its output into: (T=1, B=1, ...) views of its column of env_output
+        self.env_output_views = [{key: value[:, env_id:env_id + 1] for key, value in self.env_output.items()}
+                                 for env_id in range(num_envs)]
+
+    def begin_unroll(self, indices):
+        """
+        :param indices: The buffer slot each environment writes its next unroll into
+        """
+        self._index_list = list(indices)
+        for env_id, index in enumerate(indices):
+            self._indices[env_id] = index
+
+    def write_env_output(self, t):
+        for key, value in self.env_output.items():
+            if key == "frame":
+                self._write_frames(t, value[0])
+            elif key in self._buffers:
+                self._write(key, t, value)
+
+    def write_agent_output(self, t, agent_output):
+        for key, value in agent_output.items():
+            if key in self._buffers:
+                self._write(key, t, value)
+
+    def write_policy_version(self, t, policy_version):
+        self._buffers["policy_version"][:, t].index_fill_(0, self._indices, policy_version)
+
+    def _write_frames(self, t, frames):
+        if self._deduplicate_frames:
+            frame_dedup.write_frames(self._buffers["frame"], self._index_list, t, frames)
+        else:
+            for frame, index in zip(frames, self._index_list):
+                self._buffers["frame"][index][t].copy_(frame)
+
+    def _write(self, key, t, value):
+        buffer = self._buffers[key]
+        buffer[:, t].index_copy_(0, self._indices, value[0].to(buffer.dtype))
@@ -49,6 +49,10 @@ VTraceFromLogitsReturns = collections.namedtuple(
 
 VTraceReturns = collections.namedtuple("VTraceReturns", "vs pg_advantages")
 
+FusedLossReturns = collections.namedtuple(
+    "FusedLossReturns", "vtrace_returns pg_loss baseline_loss entropy_loss"
+)
+
 
 def action_log_probs(policy_logits, actions):
     return -F.nll_loss(
@@ -116,13 +120,7 @@ def from_importance_weights(
         )
         deltas = clipped_rhos * (rewards + discounts * values_t_plus_1 - values)
 
-        acc = torch.zeros_like(bootstrap_value)
-        result = []
-        for t in range(discounts.shape[0] - 1, -1, -1):
-            acc = deltas[t] + discounts[t] * cs[t] * acc
-            result.append(acc)
-        result.reverse()
-        vs_minus_v_xs = torch.stack(result)
+        vs_minus_v_xs = _vs_minus_v_xs_scan(deltas, discounts, cs)
 
         # Add V(x_s) to get v_s.
         vs = torch.add(vs_minus_v_xs, values)
@@ -140,3 +138,70 @@ def from_importance_weights(
 
         # Make sure no gradients backpropagated through the returned values.
         return VTraceReturns(vs=vs, pg_advantages=pg_advantages)
+
+
+@torch.jit.script
+def _vs_minus_v_xs_scan(deltas, discounts, cs):
+    """
+    The backward recursion acc_t = delta_t + discount_t * c_t * acc_{t+1}, run by TorchScript rather than the Python
+    interpreter, writing into a preallocated output rather than stacking a list.
+    """
+    decays = discounts * cs
+    result = torch.empty_like(deltas)
+    acc = torch.zeros_like(deltas[0])
+    for t in range(deltas.shape[0] - 1, -1, -1):
+        acc = torch.addcmul(deltas[t], decays[t], acc)
+        result[t] = acc
+    return result
+
+
+def fused_from_logits_and_loss(
+    behavior_policy_logits,
+    target_policy_logits,
+    actions,
+    discounts,
+    rewards,
+    values,
+    bootstrap_value,
+    baseline_cost,
+    entropy_cost,
+    clip_rho_threshold=1.0,
+    clip_pg_rho_threshold=1.0,
+):
+    """
+    Equivalent to from_logits followed by the IMPALA policy gradient, baseline, and entropy losses (as computed in
+    Monobeast.compute_loss), but each log-softmax is computed only once and shared between V-trace and the losses.
+    """
+    target_log_policy = F.log_softmax(target_policy_logits, dim=-1)
+    behavior_log_policy = F.log_softmax(behavior_policy_logits, dim=-1)
+
+    target_action_log_probs = target_log_policy.gather(-1, actions.unsqueeze(-1)).squeeze(-1)
+    behavior_action_log_probs = behavior_log_policy.gather(-1, actions.unsqueeze(-1)).squeeze(-1)
+    log_rhos = target_action_log_probs - behavior_action_log_probs
+
+    vtrace_returns = from_importance_weights(
+        log_rhos=log_rhos,
+        discounts=discounts,
+        rewards=rewards,
+        values=values,
+        bootstrap_value=bootstrap_value,
+        clip_rho_threshold=clip_rho_threshold,
+        clip_pg_rho_threshold=clip_pg_rho_threshold,
+    )
+
+    pg_loss = -torch.sum(target_action_log_probs * vtrace_returns.pg_advantages)
+    baseline_loss = baseline_cost * 0.5 * torch.sum((vtrace_returns.vs - values) ** 2)
+    entropy_loss = entropy_cost * torch.sum(torch.exp(target_log_policy) * target_log_policy)
+
+    vtrace_from_logits_returns = VTraceFromLogitsReturns(
+        log_rhos=log_rhos,
+        behavior_action_log_probs=behavior_action_log_probs,
+        target_action_log_probs=target_action_log_probs,
+        **vtrace_returns._asdict(),
+    )
+    return FusedLossReturns(
+        vtrace_returns=vtrace_from_logits_returns,
+        pg_loss=pg_loss,
+        baseline_loss=baseline_loss,
+        entropy_loss=entropy_loss,
+    )
@@ -15,6 +15,7 @@
 # and modified
 
 import os
+import atexit
 import logging
 import pprint
 import time
@@ -22,6 +23,7 @@ import timeit
 import traceback
 import typing
 import copy
+import datetime
 import psutil
 import numpy as np
 import queue
@@ -29,7 +31,6 @@ import cloudpickle
 from torch.multiprocessing import Pool
 import threading
 import json
-import shutil
 import signal
 
 import torch
@@ -39,12 +40,27 @@ from torch import nn
 from torch.nn import functional as F
 
 from continual_rl.policies.impala.torchbeast.core import environment
+from continual_rl.policies.impala.torchbeast.core import frame_dedup
+from continual_rl.policies.impala.torchbeast.core.actor_autoscaler import ActorAutoscaler, ActorState
+from continual_rl.policies.impala.torchbeast.core.batch_prefetcher import BatchPrefetcher
+from continual_rl.policies.impala.torchbeast.core.batched_evaluator import BatchedEvaluator
+from continual_rl.policies.impala.torchbeast.core.index_queue import SharedIndexQueue
+from continual_rl.policies.impala.torchbeast.core.inference_server import InferenceServer
+from continual_rl.policies.impala.torchbeast.core.learner_process_group import LearnerProcessGroup
+from continual_rl.policies.impala.torchbeast.core.learner_replica import LearnerReplica
+from continual_rl.policies.impala.torchbeast.core import model_acceleration
+from continual_rl.policies.impala.torchbeast.core.param_store import ParamStore
 from continual_rl.policies.impala.torchbeast.core import prof
+from continual_rl.policies.impala.torchbeast.core.rollout_writer import RolloutWriter
 from continual_rl.policies.impala.torchbeast.core import vtrace
+from continual_rl.utils.checkpoint_writer import CheckpointFile, get_checkpoint_writer, snapshot, write_json, \
+    write_torch
+from continual_rl.utils.resource_planner import ResourcePlanner
 from continual_rl.utils.utils import Utils
 
 
-Buffers = typing.Dict[str, typing.List[torch.Tensor]]
+# One contiguous tensor per key, laid out as (num_buffers, T + 1, ...)
+Buffers = typing.Dict[str, torch.Tensor]
 
 
 class LearnerThreadState():
@@ -71,8 +87,17 @@ class LearnerThreadState():
 
 
 class Monobeast():
+    # Whether compute_loss only uses the model it's passed, as opposed to e.g. modifying the learner model directly,
+    # so it can be run on a learner thread's own replica (see learner_concurrency)
+    SUPPORTS_LEARNER_REPLICAS = True
+
+    # The rollout buffer fields this policy reads back (in its losses, replay, or logging), beyond those the model
+    # acts on (frame, reward, done and last_action). Fields not listed aren't stored. See create_buffer_specs.
+    BUFFER_FIELDS = ("episode_return", "policy_logits", "action")
+
     def __init__(self, model_flags, observation_space, action_spaces, policy_class):
         self._model_flags = model_flags
+        self._observation_shape = observation_space.shape
 
         # The latest full episode's set of observations generated by actor with actor_index == 0
         self._videos_to_log = py_mp.Manager().Queue(maxsize=1)
@@ -86,6 +111,7 @@ class Monobeast():
         # Keep track of our threads/processes so we can clean them up.
         self._learner_thread_states = []
         self._actor_processes = []
+        self._initial_agent_state_buffers = None  # Created by the first train(), and kept for the actors' lifetimes
 
         # train() will get called multiple times (once per task, per cycle). The current assumption is that only
         # one train() should be running a time, and that all others have been cleaned up. These parameters help us
@@ -97,9 +123,57 @@ class Monobeast():
         # applicable
         self.last_timestep_returned = 0
 
+        # Queues of buffer indices, shared between actors and learners. Created once (they don't require their own
+        # process), then reset at the start of each train()
+        ctx = mp.get_context("fork")
+        self.free_queue = SharedIndexQueue(model_flags.num_buffers, ctx)
+        self.full_queue = SharedIndexQueue(model_flags.num_buffers, ctx)
+
+        # When each actor was first ready to act on the current task, for reporting how long task switches take
+        self._actor_ready_times = torch.zeros((model_flags.num_actors,), dtype=torch.float64).share_memory_()
+        self._last_cleanup_seconds = None
+
+        # Persistent actors (see persistent_actors) are each sent their next task through their own pipe, and signal
+        # when they've parked, waiting for it
+        self._actor_task_senders = [None] * model_flags.num_actors
+        self._actors_parked = [ctx.Event() for _ in range(model_flags.num_actors)]
+        if model_flags.persistent_actors:
+            atexit.register(self._shutdown_actor_pool)  # Parked actors would otherwise wait forever
+
+        # Which actors are running, as set by the autoscaler (see autoscale_actors)
+        self._actor_states = torch.full((model_flags.num_actors,), ActorState.ACTIVE, dtype=torch.int8).share_memory_()
+        self._autoscaler = None
+        if model_flags.autoscale_actors:
+            num_batch_consumers = 1 if model_flags.prefetch_queue_depth > 0 else model_flags.num_learner_threads
+            self._autoscaler = ActorAutoscaler(
+                model_flags.autoscale_min_actors, model_flags.num_actors, num_batch_consumers,
+                model_flags.autoscale_interval_seconds, model_flags.autoscale_learner_wait_threshold,
+                model_flags.autoscale_queue_threshold, max_policy_lag=model_flags.autoscale_max_policy_lag,
+                timeline_path=os.path.join(model_flags.savedir, "actor_autoscaling.csv"))
+
+        # Each learner thread gathers its batches into its own preallocated tensors, see get_batch. The prefetcher
+        # instead cycles through a pool of them, since several of its batches are in flight at once.
+        self._batch_destinations = threading.local()
+        self._free_prefetch_destinations = queue.SimpleQueue()
+
+        # Serializes the learners' optimizer steps, and lets save() and test() get consistent weights while training
+        self._learn_lock = threading.Lock()
+
+        # The weights actors act with, if they're not reading actor_model directly. Only written under the learn lock.
+        self._param_store = ParamStore(self.learner_model, ctx) if model_flags.use_param_store else None
+        self._steps_since_param_sync = 0
+        self._last_param_sync_time = time.monotonic()
+
         # Created during train, saved so we can die cleanly
-        self.free_queue = None
-        self.full_queue = None
+        self._inference_server = None
+        self._learner_processes = []
+        self._learner_group = None  # Only set if there's more than one learner process
+
+        # Keeps its evaluation environments between calls to test(), if eval_engine is "batched"
+        self._batched_evaluator = None
+        if model_flags.eval_engine == "batched":
+            self._batched_evaluator = BatchedEvaluator(model_flags.eval_episode_num_parallel, self._observation_shape,
+                                                       self.logger)
 
         # Pillow sometimes pollutes the logs, see: https://github.com/python-pillow/Pillow/issues/5096
         logging.getLogger("PIL.PngImagePlugin").setLevel(logging.CRITICAL + 1)
@@ -115,25 +189,38 @@ class Monobeast():
     def get_batch_for_training(self, batch):
         """
         Create a new batch based on the old, with any modifications desired. (E.g. augmenting with entries from
-        a replay buffer.) This is run in each learner thread.
+        a replay buffer.) This is run in each learner thread, or in the prefetch thread if prefetching is enabled.
         """
         return batch
 
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
+    def discard_batch_for_training(self, batch):
+        """
+        Called with a batch created by get_batch_for_training that will never be passed to learn (e.g. a prefetched
+        batch dropped when training is paused), so any state kept for it can be cleaned up.
+        """
+        pass
+
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs):
         """
         Create a new loss. This is added to the existing losses before backprop. Any returned stats will be added
         to the logged stats. If a stat's key ends in "_loss", it'll automatically be plotted as well.
         This is run in each learner thread.
+        learner_outputs are the model's outputs for the whole (T + 1)-step batch, from the forward pass the other
+        losses were computed with, so a custom loss needn't run its own. (batch and vtrace_returns line up with
+        learner_outputs[:-1].)
         :return: (loss, dict of stats)
         """
         return 0, {}
 
     def permanent_delete(self):
-        pass
+        self._shutdown_actor_pool()
+        if self._batched_evaluator is not None:
+            self._batched_evaluator.close()
 
     # Core Monobeast functionality
     def setup(self, model_flags, observation_space, action_spaces, policy_class):
-        os.environ["OMP_NUM_THREADS"] = "1"
+        # The default for any subprocess not given its own thread count by the resource planner
+        os.environ["OMP_NUM_THREADS"] = str(model_flags.actor_intra_op_threads)
         logging.basicConfig(
             format=(
                 "[%(levelname)s:%(process)d %(module)s:%(lineno)d %(asctime)s] " "%(message)s"
@@ -146,12 +233,52 @@ class Monobeast():
 
         checkpointpath = os.path.join(model_flags.savedir, "model.tar")
 
+        # An actor takes one buffer per environment it steps, all at once. If there are fewer than envs_per_actor free,
+        # and fewer than batch_size full, nobody can make progress, so ensure that can't happen.
+        num_actor_envs = model_flags.num_actors * model_flags.envs_per_actor
+        min_num_buffers = model_flags.batch_size + model_flags.envs_per_actor - 1
+
         if model_flags.num_buffers is None:  # Set sensible default for num_buffers.
-            model_flags.num_buffers = max(2 * model_flags.num_actors, model_flags.batch_size)
-        if model_flags.num_actors >= model_flags.num_buffers:
-            raise ValueError("num_buffers should be larger than num_actors")
-        if model_flags.num_buffers < model_flags.batch_size:
-            raise ValueError("num_buffers should be larger than batch_size")
+            model_flags.num_buffers = max(2 * num_actor_envs, min_num_buffers)
+        if num_actor_envs >= model_flags.num_buffers:
+            raise ValueError("num_buffers should be larger than num_actors * envs_per_actor")
+        if model_flags.num_buffers < min_num_buffers:
+            raise ValueError("num_buffers should be larger than batch_size (plus envs_per_actor - 1)")
+        if model_flags.envs_per_actor > 1 and model_flags.use_lstm:
+            raise ValueError("envs_per_actor > 1 does not presently support LSTMs")
+        if model_flags.yield_mode not in ("pause", "async"):
+            raise ValueError(f"Unknown yield_mode {model_flags.yield_mode}")
+        if model_flags.learner_concurrency not in ("serialized", "concurrent", "hogwild"):
+            raise ValueError(f"Unknown learner_concurrency {model_flags.learner_concurrency}")
+        if model_flags.learner_concurrency != "serialized" and not self.SUPPORTS_LEARNER_REPLICAS:
+            raise ValueError(f"{type(self).__name__} requires learner_concurrency \"serialized\"")
+        if model_flags.num_learner_processes > 1 and \
+                (model_flags.num_learner_threads != 1 or model_flags.learner_concurrency != "serialized"):
+            raise ValueError("num_learner_processes > 1 requires one \"serialized\" learner thread per process")
+
+        if model_flags.persistent_actors and model_flags.use_inference_server:
+            raise ValueError("persistent_actors does not presently support use_inference_server")
+        if model_flags.autoscale_actors and not 1 <= model_flags.autoscale_min_actors <= model_flags.num_actors:
+            raise ValueError("autoscale_min_actors should be between 1 and num_actors")
+
+        if model_flags.eval_engine not in ("process_pool", "batched"):
+            raise ValueError(f"Unknown eval_engine {model_flags.eval_engine}")
+
+        if model_flags.actor_inference_engine not in ("eager", "torchscript", "torchscript_int8"):
+            raise ValueError(f"Unknown actor_inference_engine {model_flags.actor_inference_engine}")
+        if model_flags.actor_inference_engine != "eager" and \
+                (not model_flags.use_param_store or model_flags.use_inference_server):
+            raise ValueError("actor_inference_engine requires use_param_store (exports are refreshed when actors sync "
+                             "their weights), and doesn't apply to use_inference_server")
+
+        # Threads and CPUs for each role. This process is the first (rank 0) learner.
+        self._resource_planner = ResourcePlanner(model_flags.num_actors,
+                                                 num_learner_processes=model_flags.num_learner_processes,
+                                                 learner_threads=model_flags.learner_intra_op_threads,
+                                                 actor_threads=model_flags.actor_intra_op_threads,
+                                                 pin_cpus=model_flags.pin_cpu_affinity)
+        logger.info(self._resource_planner.describe())
+        self._resource_planner.apply("learner", 0)
 
         # Convert the device string into an actual device
         model_flags.device = torch.device(model_flags.device)
@@ -159,14 +286,46 @@ class Monobeast():
         model = policy_class(observation_space, action_spaces, model_flags)
         buffers = self.create_buffers(model_flags, observation_space.shape, model.num_actions)
 
+        if model_flags.actor_inference_engine != "eager" and not hasattr(model, "export_for_inference"):
+            logger.warning(f"{type(model).__name__} does not support actor_inference_engine, acting eagerly")
+            model_flags.actor_inference_engine = "eager"
+
         model.share_memory()
 
         learner_model = policy_class(
             observation_space, action_spaces, model_flags).to(device=model_flags.device)
 
+        if model_flags.compile_model:
+            if not hasattr(learner_model, "compile_trunk_and_heads"):
+                logger.warning(f"{type(learner_model).__name__} does not support compile_model, running it eagerly")
+                model_flags.compile_model = False
+            elif not model_acceleration.compile_supported(model_flags.device):
+                logger.warning("torch.compile is not supported on this platform, running the model eagerly")
+                model_flags.compile_model = False
+            else:
+                model.compile_trunk_and_heads(logger)
+                learner_model.compile_trunk_and_heads(logger)
+
+        if model_flags.learner_bf16_autocast and \
+                not model_acceleration.bf16_autocast_supported(model_flags.device):
+            logger.warning(f"bfloat16 is not natively supported on {model_flags.device}, learning in float32")
+            model_flags.learner_bf16_autocast = False
+
+        overridden_loss_hooks = self._get_overridden_loss_hooks()
+        if model_flags.use_fused_vtrace_loss and len(overridden_loss_hooks) > 0:
+            logger.warning(f"{type(self).__name__} overrides {', '.join(overridden_loss_hooks)}, which "
+                           f"use_fused_vtrace_loss would bypass, so computing the losses unfused")
+            model_flags.use_fused_vtrace_loss = False
+
+        optimizer = self._create_optimizer(model_flags, learner_model.parameters())
+
+        return buffers, model, learner_model, optimizer, plogger, logger, checkpointpath
+
+    @staticmethod
+    def _create_optimizer(model_flags, parameters):
         if model_flags.optimizer == "rmsprop":
             optimizer = torch.optim.RMSprop(
-                learner_model.parameters(),
+                parameters,
                 lr=model_flags.learning_rate,
                 momentum=model_flags.momentum,
                 eps=model_flags.epsilon,
@@ -174,13 +333,21 @@ class Monobeast():
             )
         elif model_flags.optimizer == "adam":
             optimizer = torch.optim.Adam(
-                learner_model.parameters(),
+                parameters,
                 lr=model_flags.learning_rate,
             )
         else:
             raise ValueError(f"Unsupported optimizer type {model_flags.optimizer}.")
 
-        return buffers, model, learner_model, optimizer, plogger, logger, checkpointpath
+        return optimizer
+
+    def _get_overridden_loss_hooks(self):
+        """
+        Which of the loss hooks this class overrides. The fused V-trace loss computes those losses itself, so is only
+        used if there are none.
+        """
+        loss_hooks = ("compute_policy_gradient_loss", "compute_baseline_loss", "compute_entropy_loss")
+        return [name for name in loss_hooks if getattr(type(self), name) is not getattr(Monobeast, name)]
 
     def compute_baseline_loss(self, advantages):
         return 0.5 * torch.sum(advantages ** 2)
@@ -200,73 +367,134 @@ class Monobeast():
         cross_entropy = cross_entropy.view_as(advantages)
         return torch.sum(cross_entropy * advantages.detach())
 
+    @staticmethod
+    def _export_for_acting(model, actor_inference_engine):
+        """
+        What to act with: the model itself ("eager"), or a frozen TorchScript export of it, with its Linear layers
+        quantized to int8 for "torchscript_int8". An export is a snapshot of the model's current weights.
+        """
+        if actor_inference_engine == "eager":
+            return model
+
+        return model.export_for_inference(quantize=actor_inference_engine == "torchscript_int8")
+
     def act(
             self,
             model_flags,
             task_flags,
             actor_index: int,
-            free_queue: py_mp.Queue,
-            full_queue: py_mp.Queue,
+            free_queue: SharedIndexQueue,
+            full_queue: SharedIndexQueue,
             model: torch.nn.Module,
             buffers: Buffers,
             initial_agent_state_buffers,
     ):
-        env = None
+        envs = []
         try:
             self.logger.info("Actor %i started.", actor_index)
+            self._resource_planner.apply("actor", actor_index)
             timings = prof.Timings()  # Keep track of how fast things are.
 
-            gym_env, seed = Utils.make_env(task_flags.env_spec, create_seed=True)
-            self.logger.info(f"Environment and libraries setup with seed {seed}")
+            # Each actor steps envs_per_actor environments in lockstep, so one forward pass computes all their actions
+            for _ in range(model_flags.envs_per_actor):
+                gym_env, seed = Utils.make_env(task_flags.env_spec, create_seed=True)
+                self.logger.info(f"Environment and libraries setup with seed {seed}")
+                envs.append(environment.Environment(gym_env))
 
             # Parameters involved in rendering behavior video
-            observations_to_render = []  # Only populated by actor 0
-
-            env = environment.Environment(gym_env)
-            env_output = env.initial()
-            agent_state = model.initial_state(batch_size=1)
-            agent_output, unused_state = model(env_output, task_flags.action_space_id, agent_state)
+            observations_to_render = []  # Only populated by actor 0 (from its first environment)
+
+            # Act with a private copy of the weights, which only changes between unrolls, so we never see the learner
+            # partway through updating them. (The inference server instead uses actor_model.)
+            policy_version = 0
+            if self._param_store is not None and self._inference_server is None:
+                model = copy.deepcopy(model)
+                policy_version = self._param_store.pull(model)
+
+            # What the actor acts with: the model itself, or an inference-only export of it, re-exported whenever
+            # the weights change (see actor_inference_engine)
+            acting_model = self._export_for_acting(model, model_flags.actor_inference_engine)
+
+            # The envs write each step in place into the writer's env_output, which the model then acts on
+            rollout_writer = RolloutWriter(buffers, len(envs), self._observation_shape,
+                                           deduplicate_frames=self._model_flags.deduplicate_frames)
+            env_output = rollout_writer.env_output
+            for env, env_output_view in zip(envs, rollout_writer.env_output_views):
+                env.initial(out=env_output_view)
+            agent_state = model.initial_state(batch_size=len(envs))
+
+            if self._inference_server is not None:
+                self._inference_server.reset_client(actor_index)
+                agent_output = self._inference_server.infer(actor_index, env_output)
+            else:
+                with torch.no_grad():
+                    agent_output, unused_state = acting_model(env_output, task_flags.action_space_id, agent_state)
+
+            self._actor_ready_times[actor_index] = time.monotonic()
 
             # Make sure to kill the env cleanly if a terminate signal is passed. (Will not go through the finally)
             def end_task(*args):
-                env.close()
+                for env in envs:
+                    env.close()
 
             signal.signal(signal.SIGTERM, end_task)
 
             while True:
-                index = free_queue.get()
-                if index is None:
+                # Retired by the autoscaler, so stop before taking any more buffers
+                if self._actor_states[actor_index] == ActorState.RETIRING:
+                    self.logger.info("Actor %i retiring.", actor_index)
+                    break
+
+                # One buffer per environment. None means the queue has been closed, so we're done.
+                indices = free_queue.get_many(len(envs))
+                if indices is None:
                     break
 
                 # Write old rollout end.
-                for key in env_output:
-                    buffers[key][index][0, ...] = env_output[key]
-                for key in agent_output:
-                    buffers[key][index][0, ...] = agent_output[key]
-                for i, tensor in enumerate(agent_state):
-                    initial_agent_state_buffers[index][i][...] = tensor
+                rollout_writer.begin_unroll(indices)
+                rollout_writer.write_env_output(0)
+                rollout_writer.write_agent_output(0, agent_output)
+                if "policy_version" in buffers:
+                    rollout_writer.write_policy_version(0, policy_version)
+                for index in indices:
+                    for i, tensor in enumerate(agent_state):
+                        initial_agent_state_buffers[index][i][...] = tensor
+
+                if self._param_store is not None and self._inference_server is None:
+                    previous_policy_version = policy_version
+                    policy_version = self._param_store.pull(model, known_version=policy_version)
+                    if policy_version != previous_policy_version:
+                        acting_model = self._export_for_acting(model, model_flags.actor_inference_engine)
 
                 # Do new rollout.
                 for t in range(model_flags.unroll_length):
                     timings.reset()
 
-                    with torch.no_grad():
-                        agent_output, agent_state = model(env_output, task_flags.action_space_id, agent_state)
+                    if self._inference_server is not None:
+                        if self._param_store is not None:
+                            policy_version = self._param_store.version  # Approximately what the server is using
+                        agent_output = self._inference_server.infer(actor_index, env_output)
+                    else:
+                        with torch.no_grad():
+                            agent_output, agent_state = acting_model(env_output, task_flags.action_space_id,
+                                                                     agent_state)
 
                     timings.time("model")
 
-                    env_output = env.step(agent_output["action"])
+                    for env_id, env in enumerate(envs):
+                        env.step(agent_output["action"][:, env_id:env_id + 1],
+                                 out=rollout_writer.env_output_views[env_id])
 
                     timings.time("step")
 
-                    for key in env_output:
-                        buffers[key][index][t + 1, ...] = env_output[key]
-                    for key in agent_output:
-                        buffers[key][index][t + 1, ...] = agent_output[key]
+                    rollout_writer.write_env_output(t + 1)
+                    rollout_writer.write_agent_output(t + 1, agent_output)
+                    if "policy_version" in buffers:
+                        rollout_writer.write_policy_version(t + 1, policy_version)
 
                     # Save off video if appropriate
                     if actor_index == 0:
-                        if env_output['done'].squeeze():
+                        if env_output['done'][0, 0]:
                             # If we have a video in there, replace it with this new one
                             try:
                                 self._videos_to_log.get(timeout=1)
@@ -282,13 +510,18 @@ class Monobeast():
                             self._videos_to_log.put(copy.deepcopy(observations_to_render))
                             observations_to_render.clear()
 
-                        observations_to_render.append(env_output['frame'].squeeze(0).squeeze(0)[-1])
+                        # env_output is overwritten every step, so keep a copy
+                        observations_to_render.append(env_output['frame'][0, 0][-1].clone())
 
                     timings.time("write")
 
-                new_buffers = {key: buffers[key][index] for key in buffers.keys()}
-                self.on_act_unroll_complete(task_flags, actor_index, agent_output, env_output, new_buffers)
-                full_queue.put(index)
+                for env_id, index in enumerate(indices):
+                    new_buffers = {key: buffers[key][index] for key in buffers.keys()}
+                    self.on_act_unroll_complete(task_flags, actor_index,
+                                                {key: value[:, env_id:env_id + 1] for key, value in agent_output.items()},
+                                                {key: value[:, env_id:env_id + 1] for key, value in env_output.items()},
+                                                new_buffers)
+                    full_queue.put(index)
 
             if actor_index == 0:
                 self.logger.info("Actor %i: %s", actor_index, timings.summary())
@@ -302,49 +535,187 @@ class Monobeast():
             raise e
         finally:
             self.logger.info(f"Finalizing actor {actor_index}")
-            if env is not None:
+            for env in envs:
                 env.close()
 
+            # Only once its envs are closed may it be activated again
+            if self._actor_states[actor_index] == ActorState.RETIRING:
+                self._actor_states[actor_index] = ActorState.RETIRED
+
+    def _run_persistent_actor(self, task_flags, actor_index, task_receiver, initial_agent_state_buffers):
+        """
+        The target of each actor process if persistent_actors is set. Acts on one task after another: once the queues
+        are closed at the end of a task, it parks until it's sent the next task_flags, or None to exit.
+        """
+        parent_pid = os.getppid()
+
+        try:
+            while task_flags is not None:
+                self.act(self._model_flags, task_flags, actor_index, self.free_queue, self.full_queue,
+                         self.actor_model, self.buffers, initial_agent_state_buffers)
+                self._actors_parked[actor_index].set()
+
+                while not task_receiver.poll(timeout=1):
+                    if os.getppid() != parent_pid:  # The main process has died, so nothing is coming
+                        return
+
+                task_flags = cloudpickle.loads(task_receiver.recv())
+
+        except KeyboardInterrupt:
+            pass  # Return silently.
+
+    def expand_deduplicated_frames(self, batch):
+        """
+        If frames are being stored deduplicated, rebuild the frame stacks of a batch stacked from buffer entries
+        (e.g. sampled from replay) in the (T + 1, B, ...) layout.
+        """
+        if self._model_flags.deduplicate_frames:
+            batch["frame"] = frame_dedup.rebuild_frame_stacks(batch["frame"], batch["done"])
+        return batch
+
     def get_batch(
             self,
             flags,
-            free_queue: py_mp.Queue,
-            full_queue: py_mp.Queue,
+            free_queue: SharedIndexQueue,
+            full_queue: SharedIndexQueue,
             buffers: Buffers,
             initial_agent_state_buffers,
             timings,
             lock,
+            timeout=None,
+            destination=None,
     ):
+        """
+        :param timeout: How long to wait for a full batch. queue.Empty is raised if it expires.
+        :param destination: The batch tensors to gather into. If None, the calling thread's own are used.
+        :return: (batch, initial_agent_state), or (None, None) if the queues have been closed
+        """
         with lock:
             timings.time("lock")
-            indices = [full_queue.get() for _ in range(flags.batch_size)]
+            dequeue_start_time = time.monotonic()
+            indices = full_queue.get_many(flags.batch_size, timeout=timeout)
             timings.time("dequeue")
-        batch = {
-            key: torch.stack([buffers[key][m] for m in indices], dim=1) for key in buffers
-        }
+
+            if self._autoscaler is not None:
+                self._autoscaler.record_learner_wait(time.monotonic() - dequeue_start_time)
+
+        # The queue has been closed, so there's nothing more to learn from
+        if indices is None:
+            return None, None
+
+        # Gather straight into the (T + 1, B, ...) layout the learner uses, with no intermediate allocations
+        batch = destination if destination is not None else self._get_batch_destination(flags, buffers)
+        index_tensor = torch.tensor(indices, dtype=torch.int64)
+        for key in buffers:
+            if key == "frame" and flags.deduplicate_frames:
+                continue
+            torch.index_select(buffers[key].transpose(0, 1), 1, index_tensor, out=batch[key])
+
+        # The frame stacks are rebuilt as they're gathered, which requires the done flags (gathered above)
+        if flags.deduplicate_frames:
+            frame_dedup.gather_frame_stacks(buffers["frame"], index_tensor, batch["done"], out=batch["frame"])
+
         initial_agent_state = (
             torch.cat(ts, dim=1)
             for ts in zip(*[initial_agent_state_buffers[m] for m in indices])
         )
         timings.time("batch")
-        for m in indices:
-            free_queue.put(m)
+        free_queue.put_many(indices)
         timings.time("enqueue")
 
-        batch = {k: t.to(device=flags.device, non_blocking=True) for k, t in batch.items()}
+        batch = self.move_batch_to_device(batch)
         initial_agent_state = tuple(
             t.to(device=flags.device, non_blocking=True) for t in initial_agent_state
         )
         timings.time("device")
         return batch, initial_agent_state
 
-    def compute_loss(self, model_flags, task_flags, learner_model, batch, initial_agent_state, with_custom_loss=True):
+    def _get_batch_destination(self, flags, buffers):
+        """
+        The batch tensors get_batch gathers into. Allocated once per learner thread, and reused for each of that
+        thread's batches, since each batch is done being used before the thread gets its next one.
+        """
+        destination = getattr(self._batch_destinations, "batch", None)
+
+        if destination is None:
+            destination = self._create_batch_destination(flags, buffers)
+            self._batch_destinations.batch = destination
+
+        return destination
+
+    def _create_batch_destination(self, flags, buffers):
+        # Pinned so the copy to the GPU can actually be asynchronous
+        pin_memory = torch.device(flags.device).type == "cuda" and torch.cuda.is_available()
+        destination = {key: torch.empty((buffer.shape[1], flags.batch_size, *buffer.shape[2:]), dtype=buffer.dtype,
+                                        pin_memory=pin_memory)
+                       for key, buffer in buffers.items()}
+
+        if flags.deduplicate_frames:
+            destination["frame"] = torch.empty((flags.unroll_length + 1, flags.batch_size, *self._observation_shape),
+                                               dtype=buffers["frame"].dtype, pin_memory=pin_memory)
+
+        return destination
+
+    def _create_batch_prefetcher(self, initial_agent_state_buffers):
+        """
+        The prefetcher produces (destination, batch, batch_for_training, initial_agent_state) tuples. The consumer
+        must return the destination to the pool once it's done with the batch.
+        """
+        timings = prof.Timings()  # Not reported, but get_batch requires it
+        batch_lock = threading.Lock()  # There's only one prefetch thread, so there's nothing to contend with
+
+        def produce_batch(timeout):
+            try:
+                destination = self._free_prefetch_destinations.get(block=False)
+            except queue.Empty:
+                destination = self._create_batch_destination(self._model_flags, self.buffers)
+
+            try:
+                batch, agent_state = self.get_batch(self._model_flags, self.free_queue, self.full_queue, self.buffers,
+                                                    initial_agent_state_buffers, timings, batch_lock, timeout=timeout,
+                                                    destination=destination)
+            except queue.Empty:
+                self._free_prefetch_destinations.put(destination)
+                raise
+
+            if batch is None:
+                self._free_prefetch_destinations.put(destination)
+                return None
+
+            return destination, batch, self.get_batch_for_training(batch), agent_state
+
+        def discard_batch(prefetched):
+            destination, _, batch_for_training, _ = prefetched
+            self.discard_batch_for_training(batch_for_training)
+            self._free_prefetch_destinations.put(destination)
+
+        return BatchPrefetcher(produce_batch, self._model_flags.prefetch_queue_depth, discard_batch=discard_batch)
+
+    def learner_forward(self, model, batch, action_space_id, initial_agent_state):
+        """
+        A forward pass of the model being learned, in bfloat16 if learner_bf16_autocast is set. The outputs are always
+        float32, which is what the losses are computed in.
+        """
+        with model_acceleration.learner_autocast(self._model_flags):
+            outputs, core_state = model(batch, action_space_id, initial_agent_state)
+
+        outputs = {key: value.float() if value.is_floating_point() else value for key, value in outputs.items()}
+        return outputs, core_state
+
+    def compute_loss(self, model_flags, task_flags, learner_model, batch, initial_agent_state, with_custom_loss=True,
+                     update_reward_moments=True):
+        """
+        :param update_reward_moments: Whether the batch's rewards count towards the running reward moments (with
+        normalize_reward), which they shouldn't if it isn't a training batch
+        """
         # Note the action_space_id isn't really used - it's used to generate an action, but we use the action that
         # was already computed and executed
-        learner_outputs, unused_state = learner_model(batch, task_flags.action_space_id, initial_agent_state)
+        learner_outputs, unused_state = self.learner_forward(learner_model, batch, task_flags.action_space_id,
+                                                             initial_agent_state)
 
         # Take final value function slice for bootstrapping.
         bootstrap_value = learner_outputs["baseline"][-1]
+        unsliced_learner_outputs = learner_outputs
 
         # Move from obs[t] -> action[t] to action[t] -> obs[t].
         batch = {key: tensor[1:] for key, tensor in batch.items()}
@@ -354,7 +725,15 @@ class Monobeast():
 
         # from https://github.com/MiniHackPlanet/MiniHack/blob/e124ae4c98936d0c0b3135bf5f202039d9074508/minihack/agent/polybeast/polybeast_learner.py#L243
         if model_flags.normalize_reward:
-            learner_model.update_running_moments(rewards)
+            # A learner replica's moments are the learner model's, which learn updates under the lock instead
+            if update_reward_moments and not getattr(learner_model, "is_learner_replica", False):
+                # Learner processes each update their moments with the sums of all of their batches' rewards (which
+                # may differ in width, e.g. with replay), so they stay identical, as their weights do
+                reward_sums = None
+                if self._learner_group is not None:
+                    reward_sums = learner_model.get_reward_sums(rewards)
+                    self._learner_group.all_reduce_sum(reward_sums)
+                learner_model.update_running_moments(rewards, reward_sums)
             rewards /= learner_model.get_running_std()
 
         if model_flags.reward_clipping == "abs_one":
@@ -364,27 +743,40 @@ class Monobeast():
 
         discounts = (~batch["done"]).float() * model_flags.discounting
 
-        vtrace_returns = vtrace.from_logits(
-            behavior_policy_logits=batch["policy_logits"],
-            target_policy_logits=learner_outputs["policy_logits"],
-            actions=batch["action"],
-            discounts=discounts,
-            rewards=clipped_rewards,
-            values=learner_outputs["baseline"],
-            bootstrap_value=bootstrap_value,
-        )
+        if model_flags.use_fused_vtrace_loss:
+            vtrace_returns, pg_loss, baseline_loss, entropy_loss = vtrace.fused_from_logits_and_loss(
+                behavior_policy_logits=batch["policy_logits"],
+                target_policy_logits=learner_outputs["policy_logits"],
+                actions=batch["action"],
+                discounts=discounts,
+                rewards=clipped_rewards,
+                values=learner_outputs["baseline"],
+                bootstrap_value=bootstrap_value,
+                baseline_cost=model_flags.baseline_cost,
+                entropy_cost=model_flags.entropy_cost,
+            )
+        else:
+            vtrace_returns = vtrace.from_logits(
+                behavior_policy_logits=batch["policy_logits"],
+                target_policy_logits=learner_outputs["policy_logits"],
+                actions=batch["action"],
+                discounts=discounts,
+                rewards=clipped_rewards,
+                values=learner_outputs["baseline"],
+                bootstrap_value=bootstrap_value,
+            )
 
-        pg_loss = self.compute_policy_gradient_loss(
-            learner_outputs["policy_logits"],
-            batch["action"],
-            vtrace_returns.pg_advantages,
-        )
-        baseline_loss = model_flags.baseline_cost * self.compute_baseline_loss(
-            vtrace_returns.vs - learner_outputs["baseline"]
-        )
-        entropy_loss = model_flags.entropy_cost * self.compute_entropy_loss(
-            learner_outputs["policy_logits"]
-        )
+            pg_loss = self.compute_policy_gradient_loss(
+                learner_outputs["policy_logits"],
+                batch["action"],
+                vtrace_returns.pg_advantages,
+            )
+            baseline_loss = model_flags.baseline_cost * self.compute_baseline_loss(
+                vtrace_returns.vs - learner_outputs["baseline"]
+            )
+            entropy_loss = model_flags.entropy_cost * self.compute_entropy_loss(
+                learner_outputs["policy_logits"]
+            )
 
         total_loss = pg_loss + baseline_loss + entropy_loss
         stats = {
@@ -395,7 +787,8 @@ class Monobeast():
         }
 
         if with_custom_loss: # auxilary terms for continual learning
-            custom_loss, custom_stats = self.custom_loss(task_flags, learner_model, initial_agent_state, batch, vtrace_returns)
+            custom_loss, custom_stats = self.custom_loss(task_flags, learner_model, initial_agent_state, batch, vtrace_returns,
+                                                         learner_outputs=unsliced_learner_outputs)
             total_loss += custom_loss
             stats.update(custom_stats)
 
@@ -412,67 +805,277 @@ class Monobeast():
             optimizer,
             scheduler,
             lock,
+            batch_for_logging=None,
+            learner_replica=None,
     ):
-        """Performs a learning (optimization) step."""
-        with lock:
+        """
+        Performs a learning (optimization) step. Only what touches the learner model's weights is done under the lock.
+        :param batch_for_logging: If provided, batch has already been prepared by get_batch_for_training, and this
+        is the batch it was prepared from.
+        :param learner_replica: If provided, the loss and gradients are computed on this (the calling thread's) replica
+        of the learner model, outside the lock (see learner_concurrency).
+        """
+        if batch_for_logging is None:
             # Only log the real batch of new data, not the manipulated version for training, so save it off
             batch_for_logging = copy.deepcopy(batch)
 
             # Prepare the batch for training (e.g. augmenting with more data)
             batch = self.get_batch_for_training(batch)
 
-            total_loss, stats, _, _ = self.compute_loss(model_flags, task_flags, learner_model, batch, initial_agent_state)
-
-            # The episode_return may be nan if we're using an EpisodicLifeEnv (for Atari), where episode_return is nan
-            # until the end of the game, where a real return is produced.
-            batch_done_flags = batch_for_logging["done"] * ~torch.isnan(batch_for_logging["episode_return"])
-            episode_returns = batch_for_logging["episode_return"][batch_done_flags]
-            stats.update({
-                "episode_returns": tuple(episode_returns.cpu().numpy()),
-                "mean_episode_return": torch.mean(episode_returns).item(),
-                "total_loss": total_loss.item(),
-            })
+        if learner_replica is None:
+            with lock:
+                total_loss, stats, _, _ = self.compute_loss(model_flags, task_flags, learner_model, batch,
+                                                            initial_agent_state)
+                optimizer.zero_grad()
+                total_loss.backward()
+                if self._learner_group is not None:
+                    self._learner_group.all_reduce_gradients(learner_model)
+                stats["total_norm"] = self._apply_gradients(model_flags, learner_model, optimizer)
+                self._finish_update(model_flags, actor_model, learner_model, scheduler)
 
-            optimizer.zero_grad()
+        else:
+            if model_flags.normalize_reward or not learner_replica.share_weights:
+                with lock:
+                    if model_flags.normalize_reward:
+                        # The same rewards compute_loss normalizes (the replica's moments are the learner model's)
+                        learner_model.update_running_moments(batch["reward"][1:])
+                    learner_replica.pull()
+
+            total_loss, stats, _, _ = self.compute_loss(model_flags, task_flags, learner_replica.model, batch,
+                                                        initial_agent_state)
+            learner_replica.model.zero_grad()
             total_loss.backward()
 
-            norm = nn.utils.clip_grad_norm_(learner_model.parameters(), model_flags.grad_norm_clipping)
-            stats["total_norm"] = norm.item()
+            if learner_replica.share_weights:
+                # Hogwild: step the shared weights directly. Only the forward and backward passes run without the
+                # lock, so a checkpoint (taken under it) never sees a partly applied step.
+                with lock:
+                    learner_replica.sync_learning_rate(optimizer)
+                    stats["total_norm"] = self._apply_gradients(model_flags, learner_replica.model,
+                                                                learner_replica.optimizer)
+                    self._finish_update(model_flags, actor_model, learner_model, scheduler)
+            else:
+                with lock:
+                    learner_replica.push_gradients()
+                    stats["total_norm"] = self._apply_gradients(model_flags, learner_model, optimizer)
+                    self._finish_update(model_flags, actor_model, learner_model, scheduler)
+
+        # The episode_return may be nan if we're using an EpisodicLifeEnv (for Atari), where episode_return is nan
+        # until the end of the game, where a real return is produced.
+        batch_done_flags = batch_for_logging["done"] * ~torch.isnan(batch_for_logging["episode_return"])
+        episode_returns = batch_for_logging["episode_return"][batch_done_flags]
+        # How many versions behind the weights each rollout was collected with are
+        if self._param_store is not None:
+            rollout_versions = batch_for_logging["policy_version"].max(dim=0).values
+            stats["policy_lag_hist"] = tuple((self._param_store.version - rollout_versions).cpu().numpy())
+            if self._autoscaler is not None:
+                self._autoscaler.record_policy_lags(stats["policy_lag_hist"])
+
+        stats.update({
+            "episode_returns": tuple(episode_returns.cpu().numpy()),
+            "mean_episode_return": torch.mean(episode_returns).item(),
+            "total_loss": total_loss.item(),
+        })
+
+        return stats
+
+    def _agree_to_continue(self, has_batch):
+        """
+        Learner processes step in lockstep, so they all continue only while every one of them has a batch to learn
+        from. Called at the start of each learner step.
+        """
+        if self._learner_group is None:
+            return has_batch
+
+        return self._learner_group.all_continue(has_batch)
+
+    def synchronize_from_rank_0(self, tensors):
+        """
+        If there are several learner processes, overwrite the tensors (in place) with rank 0's. For any state a
+        subclass changes in a way that may differ across processes (e.g. by sampling), which must be consistent.
+        Must be called at the same point of the same step by every process.
+        """
+        if self._learner_group is not None:
+            self._learner_group.broadcast_from_rank_0(tensors)
+
+    def _run_learner_process(self, task_flags, initial_agent_state_buffers, rank, port):
+        """
+        The target of each learner process other than rank 0 (which learns in the main process's learner thread).
+        Learns in lockstep with the others, from its own batches, until the queues are closed.
+        """
+        self._learn_lock = threading.Lock()  # In case the fork copied it held
+        self._learner_group = LearnerProcessGroup(rank, self._model_flags.num_learner_processes, port)
+        self._resource_planner.apply("learner", rank)
+        self.logger.info(f"Learner process {rank} started.")
+
+        try:
+            timings = prof.Timings()
+            batch_lock = threading.Lock()
+
+            while True:
+                batch, agent_state = self.get_batch(self._model_flags, self.free_queue, self.full_queue, self.buffers,
+                                                    initial_agent_state_buffers, timings, batch_lock)
+                if not self._agree_to_continue(batch is not None):
+                    break
+
+                self.learn(self._model_flags, task_flags, self.actor_model, self.learner_model, batch, agent_state,
+                           self.optimizer, self._scheduler, self._learn_lock)
 
-            optimizer.step()
-            if scheduler is not None:
-                scheduler.step()
+        except KeyboardInterrupt:
+            pass  # Return silently.
+        finally:
+            self.logger.info(f"Finalizing learner process {rank}")
+            self._learner_group.close()
+
+    def _cleanup_learner_processes(self):
+        """
+        Called once rank 0's learner threads have ended.
+        """
+        if self._learner_group is None:
+            return
+
+        self.logger.info("Cleaning up learner processes")
+
+        # If rank 0's learner thread was stopped (for a yield) rather than stopping with the others, they're waiting
+        # on it to agree whether to continue
+        if not self._learner_group.stopped:
+            try:
+                self._learner_group.all_continue(False, timeout=datetime.timedelta(seconds=30))
+            except RuntimeError as e:
+                self.logger.warning(f"Learner processes did not stop cleanly: {e}")
+
+        for learner_process in self._learner_processes:
+            learner_process.join(30)
+            if learner_process.exitcode is None:
+                learner_process.terminate()
+
+        self._learner_group.close()
+        self._learner_group = None
+        self._learner_processes = []
+
+    @staticmethod
+    def _apply_gradients(model_flags, model, optimizer):
+        """
+        Clip the gradients accumulated on model, and step the optimizer. Returns the gradient norm (before clipping).
+        """
+        norm = nn.utils.clip_grad_norm_(model.parameters(), model_flags.grad_norm_clipping)
+        optimizer.step()
+        return norm.item()
+
+    def _finish_update(self, model_flags, actor_model, learner_model, scheduler):
+        """
+        Bookkeeping after each optimizer step: advance the learning rate schedule and get the new weights to the
+        actors. Must be called under the learn lock.
+        """
+        if scheduler is not None:
+            scheduler.step()
+
+        # Every learner process takes the same step, so only rank 0 needs to pass it on
+        if self._learner_group is not None and not self._learner_group.is_rank_0:
+            return
+
+        if self._param_store is not None:
+            self._maybe_publish_params(model_flags, learner_model, actor_model)
+        else:
             actor_model.load_state_dict(learner_model.state_dict())
-            return stats
+
+    def _maybe_publish_params(self, model_flags, learner_model, actor_model):
+        """
+        Publish the learner's weights to the actors, if we're due according to the sync cadence: when either
+        param_sync_every_n_steps steps or param_sync_every_ms have passed (a threshold of 0 is ignored). Must be called
+        under the learn lock.
+        """
+        self._steps_since_param_sync += 1
+        ms_since_param_sync = (time.monotonic() - self._last_param_sync_time) * 1000
+
+        if (0 < model_flags.param_sync_every_n_steps <= self._steps_since_param_sync) or \
+                (0 < model_flags.param_sync_every_ms <= ms_since_param_sync):
+            self._param_store.publish(learner_model)
+
+            # actor_model is still what gets evaluated (and what the inference server uses), so keep it in step with
+            # what the actors have
+            self._param_store.pull(actor_model)
+
+            self._steps_since_param_sync = 0
+            self._last_param_sync_time = time.monotonic()
+
+    @staticmethod
+    def _get_action_dtype(num_actions):
+        for dtype in (torch.uint8, torch.int16, torch.int32):
+            if num_actions - 1 <= torch.iinfo(dtype).max:
+                return dtype
+        return torch.int64
 
     def create_buffer_specs(self, unroll_length, obs_shape, num_actions):
+        """
+        The fields a rollout stores: those the model acts on, and those BUFFER_FIELDS declares. A field stored in a
+        narrower dtype than the learner computes with has a gather_dtype, which it's cast back to on its way to the
+        learner (see move_batch_to_device).
+        """
         T = unroll_length
+        action_dtype = self._get_action_dtype(num_actions)
+        output_dtype = torch.float16 if self._model_flags.store_outputs_in_float16 else torch.float32
         specs = dict(
             frame=dict(size=(T + 1, *obs_shape), dtype=torch.uint8),
             reward=dict(size=(T + 1,), dtype=torch.float32),
             done=dict(size=(T + 1,), dtype=torch.bool),
             episode_return=dict(size=(T + 1,), dtype=torch.float32),
             episode_step=dict(size=(T + 1,), dtype=torch.int32),
-            policy_logits=dict(size=(T + 1, num_actions), dtype=torch.float32),
-            baseline=dict(size=(T + 1,), dtype=torch.float32),
-            uncertainty=dict(size=(T + 1,), dtype=torch.float32),
-            last_action=dict(size=(T + 1,), dtype=torch.int64),
-            action=dict(size=(T + 1,), dtype=torch.int64),
+            policy_logits=dict(size=(T + 1, num_actions), dtype=output_dtype, gather_dtype=torch.float32),
+            baseline=dict(size=(T + 1,), dtype=output_dtype, gather_dtype=torch.float32),
+            uncertainty=dict(size=(T + 1,), dtype=output_dtype, gather_dtype=torch.float32),
+            last_action=dict(size=(T + 1,), dtype=action_dtype, gather_dtype=torch.int64),
+            action=dict(size=(T + 1,), dtype=action_dtype, gather_dtype=torch.int64),
         )
+
+        stored_fields = ("frame", "reward", "done", "last_action", *self.BUFFER_FIELDS)
+        specs = {key: spec for key, spec in specs.items() if key in stored_fields}
+
+        if self._model_flags.deduplicate_frames:
+            specs["frame"]["size"] = frame_dedup.deduplicated_frame_size(unroll_length, obs_shape)
+
+        # Which version of the weights from the param store each step's agent output was generated with
+        if self._model_flags.use_param_store:
+            specs["policy_version"] = dict(size=(T + 1,), dtype=torch.int64)
+
         return specs
 
     def create_buffers(self, flags, obs_shape, num_actions) -> Buffers:
         specs = self.create_buffer_specs(flags.unroll_length, obs_shape, num_actions)
-        buffers: Buffers = {key: [] for key in specs}
-        for _ in range(flags.num_buffers):
-            for key in buffers:
-                buffers[key].append(torch.empty(**specs[key]).share_memory_())
+        buffers: Buffers = {key: torch.empty((flags.num_buffers, *spec["size"]), dtype=spec["dtype"]).share_memory_()
+                            for key, spec in specs.items()}
+        self._gather_dtypes = {key: spec["gather_dtype"] for key, spec in specs.items() if "gather_dtype" in spec}
         return buffers
 
+    def move_batch_to_device(self, batch):
+        """
+        Move a batch stacked from buffer entries to the learner's device, then cast any fields stored narrowed back to
+        the dtypes the learner computes with (so it's the narrow tensors that get copied).
+        """
+        return {key: tensor.to(device=self._model_flags.device, non_blocking=True).to(
+                    self._gather_dtypes.get(key, tensor.dtype))
+                for key, tensor in batch.items()}
+
+    def _create_learner_replica(self, learn_lock):
+        """
+        The calling learner thread's replica of the learner model, or None if learner_concurrency is "serialized".
+        """
+        if self._model_flags.learner_concurrency == "serialized":
+            return None
+
+        with learn_lock:
+            share_weights = self._model_flags.learner_concurrency == "hogwild"
+            learner_replica = LearnerReplica(self.learner_model, share_weights=share_weights)
+            if share_weights:
+                learner_replica.create_optimizer(
+                    lambda parameters: self._create_optimizer(self._model_flags, parameters), self.optimizer)
+
+        return learner_replica
+
     def create_learn_threads(self, batch_and_learn, stats_lock, thread_free_queue, thread_full_queue):
         learner_thread_states = [LearnerThreadState() for _ in range(self._model_flags.num_learner_threads)]
         batch_lock = threading.Lock()
-        learn_lock = threading.Lock()
+        learn_lock = self._learn_lock
         threads = []
         for i in range(self._model_flags.num_learner_threads):
             thread = threading.Thread(
@@ -482,6 +1085,27 @@ class Monobeast():
             threads.append(thread)
         return threads, learner_thread_states
 
+    def _create_inference_server(self, task_flags, ctx):
+        """
+        The server's request and response slots are shaped according to a single step of the rollout buffers. The
+        inputs are what the environment produces, and a dry run of the model tells us what the outputs are.
+        """
+        assert not self._model_flags.use_lstm, "The inference server does not presently support LSTMs."
+        input_examples = {key: torch.zeros((1, self._model_flags.envs_per_actor),
+                                           dtype=environment.Environment.OUTPUT_DTYPES[key])
+                          for key in environment.Environment.OUTPUT_KEYS}
+        input_examples["frame"] = torch.zeros((1, self._model_flags.envs_per_actor, *self._observation_shape),
+                                              dtype=self.buffers["frame"].dtype)
+
+        with torch.no_grad():
+            output_examples, _ = self.actor_model(input_examples, task_flags.action_space_id)
+
+        inference_server = InferenceServer(self.actor_model, task_flags.action_space_id, input_examples,
+                                           output_examples, num_clients=self._model_flags.num_actors, ctx=ctx,
+                                           num_workers=self._model_flags.num_inference_workers,
+                                           batch_deadline_ms=self._model_flags.inference_batch_deadline_ms)
+        return inference_server
+
     def cleanup(self):
         # We've finished the task, so reset the appropriate counter
         self.logger.info("Finishing task, setting timestep_returned to 0")
@@ -490,14 +1114,16 @@ class Monobeast():
         # Ensure the training loop will end
         self._train_loop_id_running = None
 
+        cleanup_start_time = time.monotonic()
         self._cleanup_parallel_workers()
+        self._last_cleanup_seconds = time.monotonic() - cleanup_start_time
 
     def _cleanup_parallel_workers(self):
         self.logger.info("Cleaning up actors")
 
-        # Send the signal to the actors to die, and resume them so they can (if they're not already dead)
+        # Resume the actors (if they're not already dead), then send the signal to them (and any learners waiting on
+        # a batch) to die. Resume first, because waking a suspended waiter blocks until it runs.
         for actor_index, actor in enumerate(self._actor_processes):
-            self.free_queue.put(None)
             try:
                 actor_process = psutil.Process(actor.pid)
                 actor_process.resume()
@@ -505,9 +1131,20 @@ class Monobeast():
                 # If it's already dead, just let it go
                 pass
 
-        # Try wait for the actors to end cleanly. If they do not, try to force a termination
+        self.free_queue.close()
+        self.full_queue.close()
+
+        # Try wait for the actors to end cleanly (or park, if they're persistent). If they do not, try to force a
+        # termination
         for actor_index, actor in enumerate(self._actor_processes):
             try:
+                if self._model_flags.persistent_actors:
+                    if self._wait_for_actor_to_park(actor_index, timeout=30):
+                        self.logger.info(f"[Actor {actor_index}] Parked until the next task")
+                        continue
+
+                    actor.terminate()  # It'll be replaced at the start of the next task
+
                 actor.join(30)  # Give up on waiting eventually
 
                 if actor.exitcode is None:
@@ -525,12 +1162,163 @@ class Monobeast():
         for thread_state in self._learner_thread_states:
             thread_state.state = LearnerThreadState.STOP_REQUESTED
 
+        if self._inference_server is not None:
+            self.logger.info("Cleaning up inference server")
+            self._inference_server.stop()
+            self._inference_server = None
+
         self.logger.info("Cleaning up parallel workers complete")
 
+    def _wait_for_actor_to_park(self, actor_index, timeout):
+        """
+        :return: Whether the (persistent) actor has parked, waiting for its next task
+        """
+        actor = self._actor_processes[actor_index]
+        deadline = time.monotonic() + timeout
+
+        try:
+            while not self._actors_parked[actor_index].wait(timeout=0.1):
+                if not actor.is_alive() or time.monotonic() > deadline:
+                    return False
+            return actor.is_alive()
+        except ValueError:  # The process has been closed
+            return False
+
+    def _start_actor(self, ctx, task_flags, actor_index, initial_agent_state_buffers):
+        if self._model_flags.persistent_actors:
+            task_receiver, self._actor_task_senders[actor_index] = ctx.Pipe(duplex=False)
+            self._actors_parked[actor_index].clear()
+            actor = ctx.Process(target=self._run_persistent_actor,
+                                args=(task_flags, actor_index, task_receiver, initial_agent_state_buffers))
+        else:
+            actor = ctx.Process(
+                target=self.act,
+                args=(
+                    self._model_flags,
+                    task_flags,
+                    actor_index,
+                    self.free_queue,
+                    self.full_queue,
+                    self.actor_model,
+                    self.buffers,
+                    initial_agent_state_buffers,
+                ),
+            )
+
+        actor.start()
+        return actor
+
+    def _activate_actor(self, ctx, task_flags, actor_index, initial_agent_state_buffers, park_timeout=0):
+        """
+        Set the actor at actor_index acting on the task: with persistent_actors, by sending it the task if it's parked,
+        otherwise by starting a new process (replacing any previous one, which should have ended).
+        :return: Whether a parked actor was reused
+        """
+        self._actor_states[actor_index] = ActorState.ACTIVE
+
+        if actor_index < len(self._actor_processes):
+            if self._wait_for_actor_to_park(actor_index, timeout=park_timeout):
+                self._actors_parked[actor_index].clear()
+                self._actor_task_senders[actor_index].send(cloudpickle.dumps(task_flags))
+                return True
+
+            previous_actor = self._actor_processes[actor_index]
+            try:
+                previous_actor.join(park_timeout)
+                if previous_actor.exitcode is None:
+                    previous_actor.terminate()
+                    previous_actor.join()
+                previous_actor.close()
+            except ValueError:  # if actor already closed
+                pass
+
+            # It died, retired, or never parked (and was terminated)
+            self._actor_processes[actor_index] = self._start_actor(ctx, task_flags, actor_index,
+                                                                   initial_agent_state_buffers)
+        else:
+            # Actors are activated in order, so it's the next one
+            assert actor_index == len(self._actor_processes), "Actors should be started in order"
+            self._actor_processes.append(self._start_actor(ctx, task_flags, actor_index, initial_agent_state_buffers))
+
+        return False
+
+    def _start_actors(self, ctx, task_flags, initial_agent_state_buffers):
+        """
+        Start an actor process for each actor, or, with persistent_actors, send those parked from the previous task
+        this one instead. With autoscale_actors, only as many as were running at the end of the last task are started;
+        the rest are marked retired, ready for the autoscaler to add.
+        :return: The number of actors reused
+        """
+        if not self._model_flags.persistent_actors:
+            self._actor_processes = []
+
+        num_active = self._autoscaler.num_actors if self._autoscaler is not None else self._model_flags.num_actors
+        num_reused = 0
+        for actor_index in range(self._model_flags.num_actors):
+            if actor_index < num_active:
+                num_reused += self._activate_actor(ctx, task_flags, actor_index, initial_agent_state_buffers)
+            else:
+                self._actor_states[actor_index] = ActorState.RETIRED
+
+        return num_reused
+
+    def _autoscale(self, ctx, task_flags, initial_agent_state_buffers, step):
+        """
+        Let the autoscaler sample the full queue, and carry out its decision if it's made one: add an actor by
+        activating the first retired one, or retire the last active one. Actors that are retiring (finishing their
+        current unroll) count as gone.
+        """
+        if self._autoscaler is None:
+            return
+
+        full_queue_occupancy = self.full_queue.qsize() / self._model_flags.num_buffers
+        target_num_actors = self._autoscaler.maybe_rescale(step, full_queue_occupancy)
+        active_indices = (self._actor_states == ActorState.ACTIVE).nonzero().flatten().tolist()
+
+        if target_num_actors > len(active_indices):
+            retired_indices = (self._actor_states == ActorState.RETIRED).nonzero().flatten().tolist()
+            if len(retired_indices) > 0:
+                actor_index = retired_indices[0]
+                self.logger.info(f"Autoscaler: adding actor {actor_index} ({len(active_indices) + 1} active)")
+                self._activate_actor(ctx, task_flags, actor_index, initial_agent_state_buffers, park_timeout=5)
+
+        elif target_num_actors < len(active_indices):
+            actor_index = active_indices[-1]
+            self.logger.info(f"Autoscaler: retiring actor {actor_index} ({len(active_indices) - 1} active)")
+            self._actor_states[actor_index] = ActorState.RETIRING
+
+    def _shutdown_actor_pool(self):
+        """
+        End the actors kept alive between tasks by persistent_actors: parked ones are told to exit, and any others
+        terminated.
+        """
+        for actor_index, actor in enumerate(self._actor_processes):
+            try:
+                if self._wait_for_actor_to_park(actor_index, timeout=0):
+                    self._actor_task_senders[actor_index].send(cloudpickle.dumps(None))
+                    actor.join(30)
+
+                if actor.exitcode is None:
+                    actor.terminate()
+                    actor.join()
+                actor.close()
+            except ValueError:  # if actor already closed
+                pass
+
+        self._actor_processes = []
+
     def resume_actor_processes(self, ctx, task_flags, actor_processes, free_queue, full_queue, initial_agent_state_buffers):
         # Copy, so iterator and what's being updated are separate
         actor_processes_copy = actor_processes.copy()
         for actor_index, actor in enumerate(actor_processes_copy):
+            # Retired actors stay retired (any still retiring will finish doing so once resumed)
+            if self._actor_states[actor_index] != ActorState.ACTIVE:
+                try:
+                    psutil.Process(actor.pid).resume()
+                except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+                    pass
+                continue
+
             allowed_statuses = ["running", "sleeping", "disk-sleep"]
             actor_pid = None  # actor.pid fails with ValueError if the process is already closed
 
@@ -556,51 +1344,55 @@ class Monobeast():
 
                 self.logger.warn(
                     f"Actor actor index {actor_index} was unable to be restarted. Recreating...")
-                new_actor = ctx.Process(
-                    target=self.act,
-                    args=(
-                        self._model_flags,
-                        task_flags,
-                        actor_index,
-                        free_queue,
-                        full_queue,
-                        self.actor_model,
-                        self.buffers,
-                        initial_agent_state_buffers,
-                    ),
-                )
-                new_actor.start()
-                actor_processes[actor_index] = new_actor
+                actor_processes[actor_index] = self._start_actor(ctx, task_flags, actor_index,
+                                                                 initial_agent_state_buffers)
 
     def save(self, output_path):
         if self._model_flags.disable_checkpoint:
             return
 
-        model_file_path = os.path.join(output_path, "model.tar")
-
-        # Back up previous model (sometimes they can get corrupted)
-        if os.path.exists(model_file_path):
-            shutil.copyfile(model_file_path, os.path.join(output_path, "model_bak.tar"))
+        # Every learner process has the same weights, so rank 0 (the main process) saves for all of them
+        if self._learner_group is not None and not self._learner_group.is_rank_0:
+            return
 
-        # Save the model
         self.logger.info(f"Saving model to {output_path}")
 
+        # Training may be running (see yield_mode), so copy a consistent set of state, then write it unlocked
+        with self._learn_lock:
+            checkpoint_files = self.get_checkpoint_files(output_path)
+
+        checkpoint_writer = get_checkpoint_writer()
+        checkpoint_writer.submit(checkpoint_files, logger=self.logger)
+        if not self._model_flags.checkpoint_asynchronously:
+            checkpoint_writer.flush()
+
+    def get_checkpoint_files(self, output_path):
+        """
+        The CheckpointFiles save() writes, each with a snapshot of the state to write. Called with the learn lock held,
+        so the state is consistent with training. Subclasses with state of their own add their files to these.
+        """
+        # The learner's weights, not actor_model's, which may be up to param_sync_every_n_steps behind the optimizer
+        # and scheduler state saved alongside them
         checkpoint_data = {
-                "model_state_dict": self.actor_model.state_dict(),
-                "optimizer_state_dict": self.optimizer.state_dict(),
-            }
+            "model_state_dict": snapshot(self.learner_model.state_dict()),
+            "optimizer_state_dict": snapshot(self.optimizer.state_dict()),
+        }
         if self._scheduler is not None:
-            checkpoint_data["scheduler_state_dict"] = self._scheduler.state_dict()
+            checkpoint_data["scheduler_state_dict"] = snapshot(self._scheduler.state_dict())
 
-        torch.save(checkpoint_data, model_file_path)
+        # The previous model is kept as a backup (a run may be killed before or while it's written)
+        model_file = CheckpointFile(os.path.join(output_path, "model.tar"), write_torch, checkpoint_data,
+                                    backup_path=os.path.join(output_path, "model_bak.tar"))
 
-        # Save metadata
-        metadata_path = os.path.join(output_path, "impala_metadata.json")
         metadata = {"last_timestep_returned": self.last_timestep_returned}
-        with open(metadata_path, "w+") as metadata_file:
-            json.dump(metadata, metadata_file)
+        metadata_file = CheckpointFile(os.path.join(output_path, "impala_metadata.json"), write_json, metadata)
+
+        return [model_file, metadata_file]
 
     def load(self, output_path):
+        # Make sure any checkpoint still being written is there to load
+        get_checkpoint_writer().flush()
+
         model_file_path = os.path.join(output_path, "model.tar")
         if os.path.exists(model_file_path):
             self.logger.info(f"Loading model from {output_path}")
@@ -635,11 +1427,15 @@ class Monobeast():
             self.last_timestep_returned = metadata["last_timestep_returned"]
 
     def train(self, task_flags):  # pylint: disable=too-many-branches, too-many-statements
+        task_start_time = time.monotonic()
         T = self._model_flags.unroll_length
         B = self._model_flags.batch_size
 
+        # Each learner step consumes a batch in every learner process
+        steps_per_learn = T * B * self._model_flags.num_learner_processes
+
         def lr_lambda(epoch):
-            return 1 - min(epoch * T * B, task_flags.total_steps) / task_flags.total_steps
+            return 1 - min(epoch * steps_per_learn, task_flags.total_steps) / task_flags.total_steps
 
         if self._model_flags.use_scheduler:
             self._scheduler = torch.optim.lr_scheduler.LambdaLR(self.optimizer, lr_lambda)
@@ -651,38 +1447,47 @@ class Monobeast():
             self._scheduler.load_state_dict(self._scheduler_state_dict)
             self._scheduler_state_dict = None
 
-        # Add initial RNN state.
-        initial_agent_state_buffers = []
-        for _ in range(self._model_flags.num_buffers):
-            state = self.actor_model.initial_state(batch_size=1)
-            for t in state:
-                t.share_memory_()
-            initial_agent_state_buffers.append(state)
+        # Add initial RNN state. Created once, since persistent actors keep the ones they were started with.
+        if self._initial_agent_state_buffers is None:
+            self._initial_agent_state_buffers = []
+            for _ in range(self._model_flags.num_buffers):
+                state = self.actor_model.initial_state(batch_size=1)
+                for t in state:
+                    t.share_memory_()
+                self._initial_agent_state_buffers.append(state)
+        initial_agent_state_buffers = self._initial_agent_state_buffers
+
+        # The learner's weights may have been changed since they were last published (e.g. by load)
+        if self._param_store is not None:
+            self._param_store.publish(self.learner_model)
 
         # Setup actor processes and kick them off
-        self._actor_processes = []
         ctx = mp.get_context("fork")
+        self._actor_ready_times.zero_()
 
-        # See: https://stackoverflow.com/questions/47085458/why-is-multiprocessing-queue-get-so-slow for why Manager
-        self.free_queue = py_mp.Manager().Queue()
-        self.full_queue = py_mp.Manager().Queue()
+        self.free_queue.reset()
+        self.full_queue.reset()
 
-        for i in range(self._model_flags.num_actors):
-            actor = ctx.Process(
-                target=self.act,
-                args=(
-                    self._model_flags,
-                    task_flags,
-                    i,
-                    self.free_queue,
-                    self.full_queue,
-                    self.actor_model,
-                    self.buffers,
-                    initial_agent_state_buffers,
-                ),
-            )
-            actor.start()
-            self._actor_processes.append(actor)
+        # Created before the actors so they can all reach it
+        if self._model_flags.use_inference_server:
+            self._inference_server = self._create_inference_server(task_flags, ctx)
+            self._inference_server.start()
+
+        num_actors_reused = self._start_actors(ctx, task_flags, initial_agent_state_buffers)
+        initially_active_actors = self._actor_states == ActorState.ACTIVE
+        task_switch_reported = False
+
+        # The other learner processes are forked with (so start with) this process's weights and optimizer state
+        if self._model_flags.num_learner_processes > 1:
+            port = LearnerProcessGroup.find_free_port()
+            self._learner_processes = []
+            for rank in range(1, self._model_flags.num_learner_processes):
+                learner_process = ctx.Process(target=self._run_learner_process,
+                                              args=(task_flags, initial_agent_state_buffers, rank, port))
+                learner_process.start()
+                self._learner_processes.append(learner_process)
+
+            self._learner_group = LearnerProcessGroup(0, self._model_flags.num_learner_processes, port)
 
         stat_keys = [
             "total_loss",
@@ -697,11 +1502,16 @@ class Monobeast():
         step, collected_stats = self.last_timestep_returned, {}
         self._stats_lock = threading.Lock()
 
+        # Used by the "async" yield_mode: the learners signal once we've reached the step we should next yield at
+        yield_ready = threading.Event()
+        next_yield_step = step + self._model_flags.steps_between_yields
+
         def batch_and_learn(i, lock, thread_state, batch_lock, learn_lock, thread_free_queue, thread_full_queue):
             """Thread target for the learning process."""
             try:
                 nonlocal step, collected_stats
                 timings = prof.Timings()
+                learner_replica = self._create_learner_replica(learn_lock)
 
                 while True:
                     # If we've requested a stop, indicate it and end the thread
@@ -713,21 +1523,49 @@ class Monobeast():
                         thread_state.state = LearnerThreadState.RUNNING
 
                     timings.reset()
-                    batch, agent_state = self.get_batch(
-                        self._model_flags,
-                        thread_free_queue,
-                        thread_full_queue,
-                        self.buffers,
-                        initial_agent_state_buffers,
-                        timings,
-                        batch_lock,
-                    )
+                    if prefetcher is not None:
+                        try:
+                            # Time out periodically so we can check whether we've been asked to stop
+                            prefetched = prefetcher.get(timeout=0.1)
+                        except queue.Empty:
+                            continue
+
+                        # None means the queues have been closed
+                        destination, batch_for_logging, batch, agent_state = \
+                            prefetched if prefetched is not None else (None, None, None, None)
+                        timings.time("prefetch_wait")
+                    else:
+                        batch, agent_state = self.get_batch(
+                            self._model_flags,
+                            thread_free_queue,
+                            thread_full_queue,
+                            self.buffers,
+                            initial_agent_state_buffers,
+                            timings,
+                            batch_lock,
+                        )
+                        destination, batch_for_logging = None, None
+
+                    # The queues have been closed (possibly only as seen by another learner process)
+                    if not self._agree_to_continue(batch is not None):
+                        if destination is not None:
+                            self.discard_batch_for_training(batch)
+                            self._free_prefetch_destinations.put(destination)
+                        break
+
                     stats = self.learn(
-                        self._model_flags, task_flags, self.actor_model, self.learner_model, batch, agent_state, self.optimizer, self._scheduler, learn_lock
+                        self._model_flags, task_flags, self.actor_model, self.learner_model, batch, agent_state,
+                        self.optimizer, self._scheduler, learn_lock, batch_for_logging=batch_for_logging,
+                        learner_replica=learner_replica
                     )
                     timings.time("learn")
+
+                    if destination is not None:
+                        self._free_prefetch_destinations.put(destination)
                     with lock:
-                        step += T * B
+                        step += steps_per_learn
+                        if step >= next_yield_step:
+                            yield_ready.set()
                         to_log = dict(step=step)
                         to_log.update({k: stats[k] for k in stat_keys if k in stats})
                         self.plogger.info(to_log)
@@ -750,8 +1588,12 @@ class Monobeast():
 
             thread_state.state = LearnerThreadState.STOPPED
 
-        for m in range(self._model_flags.num_buffers):
-            self.free_queue.put(m)
+        self.free_queue.put_many(list(range(self._model_flags.num_buffers)))
+
+        prefetcher = None
+        if self._model_flags.prefetch_queue_depth > 0:
+            prefetcher = self._create_batch_prefetcher(initial_agent_state_buffers)
+            prefetcher.start()
 
         threads, self._learner_thread_states = self.create_learn_threads(batch_and_learn, self._stats_lock, self.free_queue, self.full_queue)
 
@@ -762,12 +1604,32 @@ class Monobeast():
         self._train_loop_id_running = train_loop_id
         self.logger.info(f"Starting train loop id {train_loop_id}")
 
+        if self._autoscaler is not None:
+            self._autoscaler.start(step)
+
         timer = timeit.default_timer
         try:
             while self._train_loop_id_running == train_loop_id:
                 start_step = step
                 start_time = timer()
-                time.sleep(self._model_flags.seconds_between_yields)
+
+                if self._model_flags.yield_mode == "async":
+                    # Time out periodically, in case we've been cleaned up while waiting
+                    while not yield_ready.wait(timeout=1) and self._train_loop_id_running == train_loop_id:
+                        self._autoscale(ctx, task_flags, initial_agent_state_buffers, step)
+
+                    if self._train_loop_id_running != train_loop_id:
+                        break
+
+                    with self._stats_lock:
+                        yield_ready.clear()
+                        next_yield_step = step + self._model_flags.steps_between_yields
+                else:
+                    # Wake periodically to let the autoscaler check in
+                    yield_time = timer() + self._model_flags.seconds_between_yields
+                    while timer() < yield_time:
+                        time.sleep(min(1, max(yield_time - timer(), 0)))
+                        self._autoscale(ctx, task_flags, initial_agent_state_buffers, step)
 
                 # Copy right away, because there's a race where stats can get re-set and then certain things set below
                 # will be missing (eg "step")
@@ -796,6 +1658,49 @@ class Monobeast():
                     mean_return,
                     pprint.pformat(stats_to_return),
                 )
+
+                # Once every actor has acted on this task, report how long the switch to it took
+                initial_ready_times = self._actor_ready_times[initially_active_actors]
+                if not task_switch_reported and torch.all(initial_ready_times > 0):
+                    previous_cleanup = f"{self._last_cleanup_seconds:.2f}s" if self._last_cleanup_seconds is not None \
+                        else "n/a"
+                    self.logger.info(
+                        "Task switch: previous task's workers stopped in %s, all actors acting %.2fs after train "
+                        "started (%d reused, %d started)",
+                        previous_cleanup,
+                        initial_ready_times.max().item() - task_start_time,
+                        num_actors_reused,
+                        len(initial_ready_times) - num_actors_reused,
+                    )
+                    task_switch_reported = True
+
+                # The histograms are too verbose to log in full, so they only get summarized in the log
+                if self._inference_server is not None:
+                    inference_stats = self._inference_server.get_stats()
+                    self.logger.info(
+                        "Inference server: mean batch size %.2f, latency p50 %.3fms, p95 %.3fms",
+                        inference_stats["inference_batch_size_mean"],
+                        inference_stats["inference_latency_ms_p50"],
+                        inference_stats["inference_latency_ms_p95"],
+                    )
+                    stats_to_return.update(inference_stats)
+
+                if prefetcher is not None:
+                    prefetch_stats = prefetcher.get_stats()
+                    self.logger.info(
+                        "Batch prefetcher: learners starved for a batch %.1f%% of the time, mean wait %.3fms",
+                        100 * prefetch_stats["prefetch_starved_fraction"],
+                        prefetch_stats["prefetch_wait_ms_mean"],
+                    )
+                    stats_to_return.update(prefetch_stats)
+
+                if len(stats_to_return.get("policy_lag_hist", [])) > 0:
+                    self.logger.info("Policy lag: mean %.2f, max %d versions", np.mean(stats_to_return["policy_lag_hist"]),
+                                     np.max(stats_to_return["policy_lag_hist"]))
+
+                if self._autoscaler is not None:
+                    stats_to_return["num_active_actors"] = int((self._actor_states == ActorState.ACTIVE).sum())
+
                 stats_to_return["step"] = step
                 stats_to_return["step_delta"] = step - self.last_timestep_returned
 
@@ -810,8 +1715,15 @@ class Monobeast():
                     self.logger.warning(f"Video logging socket seems to have failed with error {e}. Aborting video log.")
                     pass
 
+                # Keep training while yielded. Anything that needs consistent weights (save, test) takes the learn
+                # lock to get them.
+                if self._model_flags.yield_mode == "async":
+                    if self.last_timestep_returned != step:
+                        self.last_timestep_returned = step
+                        yield stats_to_return
+
                 # This block sets us up to yield our results in batches, pausing everything while yielded.
-                if self.last_timestep_returned != step:
+                elif self.last_timestep_returned != step:
                     self.last_timestep_returned = step
 
                     # Stop learn threads, they are recreated after yielding. 
@@ -829,26 +1741,27 @@ class Monobeast():
                         if wait:
                             thread_state.wait_for([LearnerThreadState.STOPPED], timeout=30)
 
-                    # The actors will keep going unless we pause them, so...do that.
-                    if self._model_flags.pause_actors_during_yield:
-                        for actor in self._actor_processes:
-                            psutil.Process(actor.pid).suspend()
+                    # Anything already prefetched was collected with the pre-yield model, so throw it away
+                    if prefetcher is not None:
+                        prefetcher.stop()
 
-                    # Make sure the queue is empty (otherwise things can get dropped in the shuffle)
-                    # (Not 100% sure relevant but:) https://stackoverflow.com/questions/19257375/python-multiprocessing-queue-put-not-working-for-semi-large-data
-                    while not self.free_queue.empty():
-                        try:
-                            self.free_queue.get(block=False)
-                        except queue.Empty:
-                            # Race between empty check and get, I guess
-                            break
+                    # Hold the queues while we suspend the actors, so none is paused partway through using them
+                    with self.free_queue.lock, self.full_queue.lock:
+                        # The actors will keep going unless we pause them, so...do that.
+                        if self._model_flags.pause_actors_during_yield:
+                            for actor in self._actor_processes:
+                                try:
+                                    psutil.Process(actor.pid).suspend()
+                                except (psutil.NoSuchProcess, ValueError):
+                                    pass  # E.g. it's retired
 
-                    while not self.full_queue.empty():
-                        try:
-                            self.full_queue.get(block=False)
-                        except queue.Empty:
-                            # Race between empty check and get, I guess
-                            break
+                        # Take everything out of the queues, so that when we resume, no rollouts collected with the
+                        # pre-yield model get trained on. Buffers actors are currently filling aren't in either
+                        # queue; they'll be returned to the full queue as normal when the actor finishes them.
+                        drained_indices = self.free_queue.drain() + self.full_queue.drain()
+
+                    if self._autoscaler is not None:
+                        self._autoscaler.pause()
 
                     yield stats_to_return
 
@@ -861,27 +1774,39 @@ class Monobeast():
                         self.resume_actor_processes(ctx, task_flags, self._actor_processes, self.free_queue, self.full_queue,
                                                     initial_agent_state_buffers)
 
+                    if prefetcher is not None:
+                        prefetcher.start()
+
                     # Resume the learners by creating new ones
                     self.logger.info("Restarting learners")
                     threads, self._learner_thread_states = self.create_learn_threads(batch_and_learn, self._stats_lock, self.free_queue, self.full_queue)
                     self.logger.info("Restart complete")
 
-                    for m in range(self._model_flags.num_buffers):
-                        self.free_queue.put(m)
+                    self.free_queue.put_many(drained_indices)
                     self.logger.info("Free queue re-populated")
 
+                    if self._autoscaler is not None:
+                        self._autoscaler.resume(step)
+
         except KeyboardInterrupt:
             pass
 
         finally:
+            if self._autoscaler is not None:
+                self._autoscaler.pause()
             self._cleanup_parallel_workers()
+            if prefetcher is not None:
+                prefetcher.stop()
             for thread in threads:
                 thread.join()
+            self._cleanup_learner_processes()
             self.logger.info("Learning finished after %d steps.", step)
 
     @staticmethod
     def _collect_test_episode(pickled_args):
-        task_flags, logger, model = cloudpickle.loads(pickled_args)
+        task_flags, logger, model, actor_inference_engine, resource_planner = cloudpickle.loads(pickled_args)
+        resource_planner.apply("eval")
+        model = Monobeast._export_for_acting(model, actor_inference_engine)
 
         gym_env, seed = Utils.make_env(task_flags.env_spec, create_seed=True)
         logger.info(f"Environment and libraries setup with seed {seed}")
@@ -894,7 +1819,8 @@ class Monobeast():
         while not done:
             if task_flags.mode == "test_render":
                 env.gym_env.render()
-            agent_outputs = model(observation, task_flags.action_space_id)
+            with torch.no_grad():
+                agent_outputs = model(observation, task_flags.action_space_id)
             policy_outputs, _ = agent_outputs
             observation = env.step(policy_outputs["action"])
             step += 1
@@ -912,9 +1838,35 @@ class Monobeast():
         env.close()
         return step, returns
 
-    def test(self, task_flags, num_episodes: int = 10):
+    def _test_batched(self, task_flags, num_episodes):
+        # Training may be running (see yield_mode), so snapshot the weights to act with
+        with self._learn_lock:
+            model = copy.deepcopy(self.actor_model)
+
         if not self._model_flags.no_eval_mode:
-            self.actor_model.eval()
+            model.eval()
+        acting_model = self._export_for_acting(model, self._model_flags.actor_inference_engine)
+
+        return self._batched_evaluator.evaluate(task_flags, model, num_episodes, acting_model=acting_model)
+
+    def test(self, task_flags, num_episodes: int = 10):
+        if self._batched_evaluator is not None:
+            step, returns = self._test_batched(task_flags, num_episodes)
+            self.logger.info(
+                "Average returns over %i episodes: %.1f", len(returns), sum(returns) / len(returns)
+            )
+            yield {"episode_returns": returns, "step": step, "num_episodes": len(returns)}
+            return
+
+        # Training may be running (see yield_mode), so snapshot the weights once, consistently, for every episode
+        with self._learn_lock:
+            was_training = self.actor_model.training
+            if not self._model_flags.no_eval_mode:
+                self.actor_model.eval()
+
+            pickled_args = cloudpickle.dumps((task_flags, self.logger, self.actor_model,
+                                              self._model_flags.actor_inference_engine, self._resource_planner))
+            self.actor_model.train(was_training)
 
         returns = []
         step = 0
@@ -927,7 +1879,6 @@ class Monobeast():
             with Pool(processes=batch_num_episodes) as pool:
                 async_objs = []
                 for episode_id in range(batch_num_episodes):
-                    pickled_args = cloudpickle.dumps((task_flags, self.logger, self.actor_model))
                     async_obj = pool.apply_async(self._collect_test_episode, (pickled_args,))
                     async_objs.append(async_obj)
 
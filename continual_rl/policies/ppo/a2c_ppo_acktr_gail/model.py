@@ -10,6 +10,7 @@ import torch.nn.functional as F
 
 from .distributions import Bernoulli, Categorical, DiagGaussian, FixedCategorical
 from .utils import init
+from continual_rl.utils.inference_export import freeze_for_inference
 
 
 class Flatten(nn.Module):
@@ -64,13 +65,22 @@ class Policy(nn.Module):
         raise NotImplementedError
 
     def act(self, inputs, rnn_hxs, masks, deterministic=False, action_space=None):
+        value, logits, rnn_hxs = self.compute_value_and_logits(inputs, rnn_hxs, masks)
+        return self.act_from_logits(value, logits, rnn_hxs, deterministic=deterministic, action_space=action_space)
+
+    def compute_value_and_logits(self, inputs, rnn_hxs, masks):
+        """
+        The part of act() without sampling, which is what gets exported for inference (see export_for_inference).
+        """
         value, actor_features, rnn_hxs = self.base(inputs, rnn_hxs, masks)
+        return value, self.dist(actor_features), rnn_hxs
 
+    def act_from_logits(self, value, logits, rnn_hxs, deterministic=False, action_space=None):
         if action_space is None:
-            dist = FixedCategorical(logits=self.dist(actor_features))
+            dist = FixedCategorical(logits=logits)
         else:
             _, num_outputs = self.get_distribution_for_action_space(action_space)
-            dist = FixedCategorical(logits=self.dist(actor_features)[:, :num_outputs])
+            dist = FixedCategorical(logits=logits[:, :num_outputs])
 
         if deterministic:
             action = dist.mode()
@@ -82,6 +92,15 @@ class Policy(nn.Module):
 
         return value, action, action_log_probs, rnn_hxs
 
+    def export_for_inference(self, example_inputs, quantize=False):
+        """
+        A frozen TorchScript export of compute_value_and_logits, for acting on CPU (see freeze_for_inference). It's a
+        snapshot of the current weights, so must be re-exported to pick up new ones.
+        :param example_inputs: (inputs, rnn_hxs, masks), as passed to act()
+        """
+        assert not self.is_recurrent, "Recurrent policies are not supported for inference export"
+        return freeze_for_inference(self, "compute_value_and_logits", example_inputs, quantize=quantize)
+
     def get_value(self, inputs, rnn_hxs, masks):
         value, _, _ = self.base(inputs, rnn_hxs, masks)
         return value
@@ -7,6 +7,8 @@ from continual_rl.policies.ppo.a2c_ppo_acktr_gail.ppo import PPO
 from continual_rl.policies.ppo.a2c_ppo_acktr_gail.model import Policy
 from continual_rl.policies.ppo.a2c_ppo_acktr_gail.storage import RolloutStorage
 from continual_rl.experiments.environment_runners.environment_runner_batch import EnvironmentRunnerBatch
+from continual_rl.utils.checkpoint_writer import CheckpointFile, get_checkpoint_writer, snapshot, write_torch
+from continual_rl.utils.resource_planner import ResourcePlanner
 from continual_rl.utils.utils import Utils
 import continual_rl.policies.ppo.a2c_ppo_acktr_gail.utils as utils
 
@@ -64,6 +66,35 @@ class PPOPolicy(PolicyBase):
         self._step_id = 0  # What collection step we're at, in the current num_steps size collection
         self._train_step_id = 0  # How many times we've trained
 
+        if self._config.inference_engine not in ("eager", "torchscript", "torchscript_int8"):
+            raise ValueError(f"Unknown inference_engine {self._config.inference_engine}")
+        if self._config.inference_engine != "eager" and self._device.type != "cpu":
+            raise ValueError("inference_engine exports are only supported on CPU")
+
+        # Threads and CPUs for this process and the environment workers (all but the first env run in their own)
+        self._resource_planner = ResourcePlanner(self._config.num_processes - 1,
+                                                 learner_threads=self._config.learner_intra_op_threads,
+                                                 actor_threads=self._config.env_worker_intra_op_threads,
+                                                 pin_cpus=self._config.pin_cpu_affinity,
+                                                 actor_role="env_worker")
+        Utils.create_logger(f"{self._config.output_dir}/ppo.log").info(self._resource_planner.describe())
+        self._resource_planner.apply("learner")
+
+        # An inference-only export of the actor-critic, if it's being used to act (see inference_engine)
+        self._inference_model = None
+        self._refresh_inference_model()
+
+    def _refresh_inference_model(self):
+        """
+        Re-export the actor-critic for acting with, since an export is a snapshot of its weights. Called whenever they
+        change.
+        """
+        if self._config.inference_engine != "eager":
+            example_inputs = (self._rollout_storage.obs[0], self._rollout_storage.recurrent_hidden_states[0],
+                              self._rollout_storage.masks[0])
+            self._inference_model = self._actor_critic.export_for_inference(
+                example_inputs, quantize=self._config.inference_engine == "torchscript_int8")
+
     def get_environment_runner(self, task_spec):
         # See note in policy_base.get_environment_runner
         num_parallel_envs = 1 if task_spec.eval_mode else self._config.num_processes
@@ -73,7 +104,8 @@ class PPOPolicy(PolicyBase):
         runner = EnvironmentRunnerBatch(policy=self, num_parallel_envs=num_parallel_envs,
                                         timesteps_per_collection=self._config.num_steps,
                                         render_collection_freq=self._config.render_collection_freq,
-                                        output_dir=self._config.output_dir)
+                                        output_dir=self._config.output_dir,
+                                        resource_planner=self._resource_planner)
         return runner
 
     def _update_rollout_storage(self, observation, last_timestep_data):
@@ -120,8 +152,14 @@ class PPOPolicy(PolicyBase):
         masks = self._rollout_storage.masks[self._step_id]
 
         with torch.no_grad():
-            value, action, action_log_prob, recurrent_hidden_states = \
-                self._actor_critic.act(observation, recurrent_hidden_state, masks, action_space=action_space)
+            if self._inference_model is not None:
+                value, logits, recurrent_hidden_states = self._inference_model(observation, recurrent_hidden_state,
+                                                                               masks)
+                value, action, action_log_prob, recurrent_hidden_states = self._actor_critic.act_from_logits(
+                    value, logits, recurrent_hidden_states, action_space=action_space)
+            else:
+                value, action, action_log_prob, recurrent_hidden_states = \
+                    self._actor_critic.act(observation, recurrent_hidden_state, masks, action_space=action_space)
 
         timestep_data = PPOTimestepData(observation=observation, recurrent_hidden_states=recurrent_hidden_states,
                                         actions=action, action_log_probs=action_log_prob, values=value,
@@ -148,6 +186,7 @@ class PPOPolicy(PolicyBase):
                                                                          action_space=None)
         self._rollout_storage.after_update()
         self._train_step_id += 1
+        self._refresh_inference_model()
 
         logs = [{"type": "scalar", "tag": "value_loss", "value": value_loss},
                 {"type": "scalar", "tag": "action_loss", "value": action_loss},
@@ -156,15 +195,17 @@ class PPOPolicy(PolicyBase):
 
     def save(self, output_path_dir, cycle_id, task_id, task_total_steps):
         checkpoint_data = {
-                "model_state_dict": self._actor_critic.state_dict(),
-                "optimizer_state_dict": self._ppo_trainer.optimizer.state_dict(),
+                "model_state_dict": snapshot(self._actor_critic.state_dict()),
+                "optimizer_state_dict": snapshot(self._ppo_trainer.optimizer.state_dict()),
             }
         model_path = os.path.join(output_path_dir, "actor_critic.pt")
-        torch.save(checkpoint_data, model_path)
+        get_checkpoint_writer().submit([CheckpointFile(model_path, write_torch, checkpoint_data)])
 
     def load(self, output_path_dir):
+        get_checkpoint_writer().flush()  # In case it's still being written
         model_path = os.path.join(output_path_dir, "actor_critic.pt")
         if os.path.exists(model_path):
             checkpoint_data = torch.load(model_path)
             self._actor_critic.load_state_dict(checkpoint_data["model_state_dict"])
             self._ppo_trainer.optimizer.load_state_dict(checkpoint_data["optimizer_state_dict"])
+            self._refresh_inference_model()
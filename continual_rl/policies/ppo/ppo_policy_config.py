@@ -37,6 +37,17 @@ class PPOPolicyConfig(ConfigBase):
         self.render_collection_freq = 200000  # timesteps
         self.comment = ""  # For experiment-writers to leave a comment for themselves, not used in PPO
         self.clip_reward = True
+        # What compute_action runs the actor-critic with. "eager": the model itself. "torchscript": a frozen TorchScript
+        # export of it (CPU only, non-recurrent), re-exported after each train. "torchscript_int8": the same, with the
+        # Linear layers dynamically quantized to int8.
+        self.inference_engine = "eager"
+        # Intra-op (torch) threads for the main (learning and acting) process, and for each environment worker process.
+        # 0 learner threads gives the main process whatever CPUs the workers' threads leave (at least one).
+        self.learner_intra_op_threads = 0
+        self.env_worker_intra_op_threads = 1
+        # Pin the main process and each environment worker to their own CPUs (NUMA node by node). The layout is logged
+        # at startup either way.
+        self.pin_cpu_affinity = False
 
     def _load_from_dict_internal(self, config_dict):
         loaded_policy_config = self._auto_load_class_parameters(config_dict)
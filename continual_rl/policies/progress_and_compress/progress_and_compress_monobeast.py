@@ -4,6 +4,7 @@ import os
 import json
 from torch.nn import functional as F
 from continual_rl.policies.ewc.ewc_monobeast import EWCMonobeast
+from continual_rl.utils.checkpoint_writer import CheckpointFile, write_json
 
 
 class ProgressAndCompressMonobeast(EWCMonobeast):
@@ -11,20 +12,23 @@ class ProgressAndCompressMonobeast(EWCMonobeast):
     Progress and Compress leverages Online EWC (implemented in EWCMonobeast). We just modify it such that
     the knowledge base is what is updated using the EWC loss.
     """
+    # compute_loss resets the learner model's active column at task boundaries
+    SUPPORTS_LEARNER_REPLICAS = False
+
     def __init__(self, model_flags, observation_space, action_spaces, policy_class):
         super().__init__(model_flags, observation_space, action_spaces, policy_class)
         self._train_steps_since_boundary = 0
         self._previous_pnc_task_id = None  # Distinct from ewc's _prev_task_id
         self._step_count_lock = threading.Lock()
 
-    def save(self, output_path):
-        super().save(output_path)
+    def get_checkpoint_files(self, output_path):
+        checkpoint_files = super().get_checkpoint_files(output_path)
 
         pnc_metadata_path = os.path.join(output_path, "pnc_metadata.json")
         metadata = {"prev_pnc_task_id": self._previous_pnc_task_id,
                     "train_steps_since_boundary": self._train_steps_since_boundary}
-        with open(pnc_metadata_path, "w+") as pnc_file:
-            json.dump(metadata, pnc_file)
+        checkpoint_files.append(CheckpointFile(pnc_metadata_path, write_json, metadata))
+        return checkpoint_files
 
     def load(self, output_path):
         super().load(output_path)
@@ -46,8 +50,9 @@ class ProgressAndCompressMonobeast(EWCMonobeast):
         return kl_loss
 
     def knowledge_base_loss(self, task_flags, model, initial_agent_state):
-        # EWC not using batch, vtrace_returns, so not bothering to pass them through
-        ewc_loss, ewc_stats = super().custom_loss(task_flags, model.knowledge_base, initial_agent_state, None, None)
+        # EWC not using batch, vtrace_returns, learner_outputs, so not bothering to pass them through
+        ewc_loss, ewc_stats = super().custom_loss(task_flags, model.knowledge_base, initial_agent_state, None, None,
+                                                  None)
 
         # Additionally, minimize KL divergence between KB and active column (only updating KB)
         replay_buffer_subset = self._sample_from_task_replay_buffer(task_flags.task_id, self._model_flags.batch_size)
@@ -78,7 +83,7 @@ class ProgressAndCompressMonobeast(EWCMonobeast):
         # Because we're not going through the normal EWC path
         # self._prev_task_id doesn't get initialized early enough, so force it here
         if self._prev_task_id is None:
-            super().custom_loss(task_flags, learner_model.knowledge_base, initial_agent_state, None, None)
+            super().custom_loss(task_flags, learner_model.knowledge_base, initial_agent_state, None, None, None)
 
         # Only kick off KB training after we switch to a new task, not including the first one. This is
         # being used as boundary detection.
@@ -93,6 +98,9 @@ class ProgressAndCompressMonobeast(EWCMonobeast):
                 # The active column will be updated after this.
                 learner_model.reset_active_column()
 
+                # The reset is random, so make it the same in every learner process
+                self.synchronize_from_rank_0([*learner_model.parameters()])
+
             self._previous_pnc_task_id = current_task_id
 
         if self._train_steps_since_boundary <= self._model_flags.num_train_steps_of_progress:
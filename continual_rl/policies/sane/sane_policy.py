@@ -9,7 +9,9 @@ from continual_rl.policies.policy_base import PolicyBase
 from continual_rl.policies.impala.impala_environment_runner import ImpalaEnvironmentRunner
 from continual_rl.policies.impala.impala_policy import ImpalaPolicy
 from continual_rl.policies.clear.clear_monobeast import ClearMonobeast
+from continual_rl.utils.checkpoint_writer import CheckpointFile, get_checkpoint_writer, write_json
 from continual_rl.utils.utils import Utils
+from continual_rl.policies.impala.torchbeast.core import replay_storage
 from continual_rl.policies.impala.torchbeast.core.environment import Environment
 from continual_rl.policies.sane.node_viz_singleton import NodeVizSingleton
 
@@ -87,7 +89,7 @@ class SanePolicy(PolicyBase):
             for buffer_id in range(num_buffers):
                 new_buffers = source_node.impala_trainer._replay_buffers
                 if new_buffers['reservoir_val'][actor_index][buffer_id] > 0:
-                    actor_buffers = {key: new_buffers[key][actor_index][buffer_id] for key in new_buffers.keys()}
+                    actor_buffers = replay_storage.read_replay_entry(new_buffers, actor_index, buffer_id)
                     target_node.impala_trainer.on_act_unroll_complete(task_flags=None, actor_index=actor_index, agent_output=None,
                                                                       env_output=None, new_buffers=actor_buffers)
 
@@ -147,7 +149,7 @@ class SanePolicy(PolicyBase):
             self._train(node, task_flags)
 
     def _train(self, node, task_flags):
-        batch = node.impala_trainer.get_batch_for_training(None, store_for_loss=False)
+        batch = node.impala_trainer.get_batch_for_training(None)
         if batch is not None:
             initial_agent_state = None
             node.impala_trainer.learn(model_flags=self._config,
@@ -293,6 +295,7 @@ class SanePolicy(PolicyBase):
         pass
 
     def load(self, output_path_dir):
+        get_checkpoint_writer().flush()  # In case it's still being written
         node_metadata = os.path.join(output_path_dir, "metadata.json")
 
         if os.path.exists(node_metadata):
@@ -314,19 +317,21 @@ class SanePolicy(PolicyBase):
             node.save(node_path, cycle_id, task_id, task_total_steps)
             node_data[node.unique_id] = {"path": node_path, "usage_count": node.usage_count}
 
+        # After the nodes' own checkpoints, by the same writer, so it only ever lists nodes that have been written
         node_metadata_path = os.path.join(output_path_dir, "metadata.json")
-        with open(node_metadata_path, "w+") as metadata_file:
-            json.dump(node_data, metadata_file)
+        get_checkpoint_writer().submit([CheckpointFile(node_metadata_path, write_json, node_data)])
 
     def train(self, storage_buffer):
         pass
 
 
 class SaneMonobeast(ClearMonobeast):
-    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns):
-        clear_loss, stats = super().custom_loss(task_flags, model, initial_agent_state, batch, vtrace_returns)
+    def custom_loss(self, task_flags, model, initial_agent_state, batch, vtrace_returns, learner_outputs):
+        clear_loss, stats = super().custom_loss(task_flags, model, initial_agent_state, batch, vtrace_returns,
+                                                learner_outputs)
 
-        model_outputs, unused_state = model(batch, task_flags.action_space_id, initial_agent_state)
+        # The outputs for the states vtrace_returns.vs are the value targets for (the last is only bootstrapped from)
+        model_outputs = {key: value[:-1] for key, value in learner_outputs.items()}
         uncertainties = torch.abs(model_outputs['baseline'] - vtrace_returns.vs)
         uncertainty_loss = ((model_outputs['uncertainty'] - uncertainties.detach())**2).mean()
         total_loss = self._model_flags.clear_loss_coeff * clear_loss
@@ -389,22 +394,26 @@ class SaneNode(ImpalaPolicy):
     def get_merge_metric(self):
         buffers = None
         if self._config.merge_by_batch:
-            buffers = self.impala_trainer.get_batch_for_training(batch=None, store_for_loss=False,
-                                                                 reuse_actor_indices=True,
+            buffers = self.impala_trainer.get_batch_for_training(batch=None, reuse_actor_indices=True,
                                                                  replay_entry_scale=self._config.merge_batch_scale)
 
-        if buffers is None:
+        # The replay buffers are (num_actors, entries, ...), so are first averaged over actors. The batch doesn't have
+        # that dimension.
+        from_replay_buffers = buffers is None
+        if from_replay_buffers:
             buffers = self.impala_trainer._replay_buffers  # Will possibly include unfilled entries
 
         if self._config.merge_by_frame:
             metric = buffers['frame']
-            if not isinstance(metric, torch.Tensor):  # The batch returns it pre-stacked, don't re-stack in that case
-                metric = torch.stack(metric).float().mean(dim=0)
+            if isinstance(metric, replay_storage.CompressedReplayBuffer):
+                metric = metric.read_all()
+            if from_replay_buffers:
+                metric = metric.float().mean(dim=0)
             metric = metric.float().mean(dim=0).mean(dim=0).mean(dim=0).view(-1)
         else:
             policies = buffers['policy_logits']
-            if not isinstance(policies, torch.Tensor):
-                policies = torch.stack(policies).mean(dim=0)
+            if from_replay_buffers:
+                policies = policies.float().mean(dim=0)
             metric = policies.mean(dim=0).mean(dim=0)
 
         return metric.cpu()
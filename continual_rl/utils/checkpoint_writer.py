@@ -0,0 +1,194 @@
+import atexit
+import copy
+import json
+import os
+import shutil
+import threading
+import time
+import torch
+
+
+def write_torch(data, file):
+    torch.save(data, file)
+
+
+def write_json(data, file):
+    file.write(json.dumps(data).encode("utf-8"))
+
+
+def snapshot(data):
+    """
+    Copy data (e.g. a state dict) so it can be written while the original keeps changing. Tensors are copied to the
+    CPU, where they'd be written from anyway, so a checkpoint of GPU state costs no extra GPU memory.
+    """
+    if isinstance(data, torch.Tensor):
+        return data.detach().to("cpu", copy=True)
+    elif isinstance(data, dict):
+        return type(data)((key, snapshot(value)) for key, value in data.items())
+    elif isinstance(data, (list, tuple)) and not hasattr(data, "_fields"):  # namedtuples are deep copied
+        return type(data)(snapshot(value) for value in data)
+    return copy.deepcopy(data)
+
+
+class CheckpointFile(object):
+    def __init__(self, path, write_fn, data, backup_path=None):
+        """
+        :param write_fn: Writes data to an open (binary) file, e.g. write_torch or write_json
+        :param data: What to write. It's written later, so it shouldn't change after it's given (see snapshot).
+        :param backup_path: If given, the file being replaced is kept here
+        """
+        self.path = path
+        self.write_fn = write_fn
+        self.data = data
+        self.backup_path = backup_path
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints in a background thread, so whoever is saving (e.g. training) isn't blocked while they're
+    written. Each file is written to a temporary file, synced to disk, and renamed over the previous one, so the file
+    is always either the old checkpoint or the new one, never partially written.
+
+    Checkpoints are written in the order they're submitted. If a checkpoint of the same files is still waiting to be
+    written when a new one is submitted, the waiting one is dropped (superseded), so a slow disk can't build up a
+    backlog of stale checkpoints.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = []  # (files, logger, submit_time)
+        self._writing = False
+        self._thread = None
+
+        self._num_written = 0
+        self._num_superseded = 0
+        self._bytes_written = 0
+        self._last_latency_seconds = None
+
+    def submit(self, files, logger=None):
+        """
+        Write the CheckpointFiles, together, once those submitted before them have been.
+        :param logger: If given, how long the checkpoint took to write, and its size, are logged to it
+        """
+        job = (files, logger, time.monotonic())
+        paths = {file.path for file in files}
+        with self._condition:
+            superseded = [pending for pending in self._pending if {file.path for file in pending[0]} == paths]
+            for pending in superseded:
+                self._pending.remove(pending)
+            self._num_superseded += len(superseded)
+
+            self._pending.append(job)
+            self._condition.notify_all()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="CheckpointWriter", daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        """
+        Wait until everything submitted so far has been written, e.g. before reading checkpoints back.
+        """
+        with self._condition:
+            while len(self._pending) > 0 or self._writing:
+                self._condition.wait()
+
+    def get_stats(self):
+        with self._condition:
+            return {"checkpoints_written": self._num_written,
+                    "checkpoints_superseded": self._num_superseded,
+                    "checkpoint_bytes_written": self._bytes_written,
+                    "checkpoint_latency_seconds": self._last_latency_seconds}
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._pending) == 0:
+                    self._condition.wait()
+                job = self._pending.pop(0)
+                self._writing = True
+
+            try:
+                self._write_job(job)
+            except Exception:
+                pass  # Already reported, and the next checkpoint may yet succeed
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def _write_job(self, job):
+        files, logger, submit_time = job
+        try:
+            num_bytes = sum(self._write_atomically(file) for file in files)
+        except Exception as e:
+            message = f"Failed to write checkpoint {[file.path for file in files]}: {e}"
+            if logger is not None:
+                logger.error(message)
+            else:
+                print(message)
+            raise e
+
+        latency = time.monotonic() - submit_time
+        with self._condition:
+            self._num_written += 1
+            self._bytes_written += num_bytes
+            self._last_latency_seconds = latency
+
+        if logger is not None:
+            logger.info(f"Checkpoint of {len(files)} files written in {latency:.2f}s after it was requested "
+                        f"({num_bytes / 1e6:.1f} MB), {self._num_superseded} superseded checkpoints skipped so far")
+
+    @staticmethod
+    def _write_atomically(file):
+        """
+        :return: The number of bytes written
+        """
+        temp_path = f"{file.path}.tmp"
+        with open(temp_path, "wb") as temp_file:
+            file.write_fn(file.data, temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+            num_bytes = temp_file.tell()
+
+        # Keep the old file as the backup. A hard link saves copying it, if the filesystem supports one.
+        if file.backup_path is not None and os.path.exists(file.path):
+            temp_backup_path = f"{file.backup_path}.tmp"
+            if os.path.exists(temp_backup_path):
+                os.remove(temp_backup_path)
+            try:
+                os.link(file.path, temp_backup_path)
+            except OSError:
+                shutil.copyfile(file.path, temp_backup_path)
+            os.replace(temp_backup_path, file.backup_path)
+
+        os.replace(temp_path, file.path)
+
+        # Make the rename itself durable
+        directory_fd = os.open(os.path.dirname(os.path.abspath(file.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+        return num_bytes
+
+
+_checkpoint_writer = None
+_checkpoint_writer_pid = None
+
+
+def get_checkpoint_writer():
+    """
+    The writer shared by everything saving in this process, so checkpoints (e.g. a policy's and the run metadata
+    recording how far it got) are written in the order they were saved.
+    """
+    global _checkpoint_writer, _checkpoint_writer_pid
+
+    # A forked process doesn't get the writing thread, so gets its own writer
+    if _checkpoint_writer is None or _checkpoint_writer_pid != os.getpid():
+        _checkpoint_writer = CheckpointWriter()
+        _checkpoint_writer_pid = os.getpid()
+        atexit.register(_checkpoint_writer.flush)  # Don't lose the last checkpoints
+
+    return _checkpoint_writer
@@ -320,12 +320,18 @@ class LazyFrames(object):
         frames = self._force()
         return frames.shape[frames.ndim - 1]
 
-    def to_tensor(self):
+    def to_tensor(self, out=None):
         """
         Ideally LazyFrames would just be interchangeable with Tensors, but in practice that isn't true.
         This forces the retrieval of the Tensor version of the LazyFrames. Know that using this negates the memory
         savings of LazyFrames.
+        If out is given, the frames are stacked straight into it instead, without forcing.
         """
+        if out is not None:
+            if self._out is not None:
+                return out.copy_(self._out)
+            return torch.stack(self._frames, dim=0, out=out)
+
         frames = self._force()
         return frames
 
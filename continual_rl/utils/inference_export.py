@@ -0,0 +1,25 @@
+import copy
+import torch
+from torch import nn
+
+
+def freeze_for_inference(module, method_name, example_inputs, quantize=False):
+    """
+    Export one method of a module as inference-only TorchScript, for running on CPU. The method is traced with
+    example_inputs, so it must be a pure tensor computation (no data-dependent control flow), and any batch size may
+    be used after. The result is frozen, so the weights are inlined as constants (and so it is a snapshot of the
+    current ones), and optimized for inference, which e.g. fuses each conv with the ReLU after it.
+    :param quantize: Whether to first dynamically quantize the Linear layers to int8 (their activations are quantized
+    on the fly, per batch)
+    :return: The exported method, called like the original
+    """
+    module = copy.deepcopy(module).cpu().eval()
+    if quantize:
+        module = torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+
+    with torch.no_grad():
+        traced = torch.jit.trace_module(module, {method_name: example_inputs})
+        frozen = torch.jit.freeze(traced, preserved_attrs=[method_name])
+        frozen = torch.jit.optimize_for_inference(frozen, other_methods=[method_name])
+
+    return getattr(frozen, method_name)
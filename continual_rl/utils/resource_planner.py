@@ -0,0 +1,131 @@
+import glob
+import os
+import torch
+
+
+class ResourcePlanner(object):
+    """
+    Decides how many intra-op (torch) threads each process gets, by role, and (optionally) which CPUs it may run on.
+
+    Learners come first: each learner process gets its own block of CPUs, as many as it has threads, allocated NUMA
+    node by node so a block stays within one node where it fits. The remaining CPUs (or all of them, if the learners
+    took everything) form the actor pool. Each actor is pinned to its own slice of the pool, wrapping around if there
+    are more actor threads than CPUs. Evaluation processes may run anywhere in the actor pool.
+    """
+
+    def __init__(self, num_actors, num_learner_processes=1, learner_threads=0, actor_threads=1, pin_cpus=False,
+                 actor_role="actor", cpus=None, numa_nodes=None):
+        """
+        :param num_actors: The number of actor processes
+        :param learner_threads: Intra-op threads per learner process. 0 gives the learners every CPU the actors'
+        threads don't need, split between them (at least one each).
+        :param actor_threads: Intra-op threads per actor, also used for evaluation processes
+        :param actor_role: What the actors are called, e.g. "env_worker" for processes that only step environments
+        :param pin_cpus: Whether apply() sets each process's CPU affinity, as well as its thread count
+        :param cpus: The CPUs available. Defaults to this process's affinity.
+        :param numa_nodes: A list of the CPUs in each NUMA node. Defaults to what the OS reports, if anything.
+        """
+        self._num_actors = num_actors
+        self._num_learner_processes = num_learner_processes
+        self._pin_cpus = pin_cpus and hasattr(os, "sched_setaffinity")
+        self._actor_role = actor_role
+        self.actor_threads = actor_threads
+
+        if cpus is None:
+            cpus = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else range(os.cpu_count() or 1)
+        cpus = set(cpus)
+
+        if numa_nodes is None:
+            numa_nodes = self._read_numa_nodes()
+        self.numa_nodes = [sorted(cpus.intersection(node)) for node in numa_nodes]
+        self.numa_nodes = [node for node in self.numa_nodes if len(node) > 0] or [sorted(cpus)]
+
+        # Anything not listed in a node (e.g. if the node info is partial) goes last
+        ordered_cpus = [cpu for node in self.numa_nodes for cpu in node]
+        ordered_cpus.extend(sorted(cpus.difference(ordered_cpus)))
+
+        if learner_threads <= 0:
+            spare_cpus = len(ordered_cpus) - num_actors * actor_threads
+            learner_threads = max(1, spare_cpus // num_learner_processes)
+        self.learner_threads = learner_threads
+
+        self.learner_cpus = self._allocate_learner_cpus(ordered_cpus)
+        allocated = {cpu for learner_cpus in self.learner_cpus for cpu in learner_cpus}
+        self.actor_pool = [cpu for cpu in ordered_cpus if cpu not in allocated] or ordered_cpus
+
+    @staticmethod
+    def _read_numa_nodes():
+        numa_nodes = []
+        for cpulist_path in sorted(glob.glob("/sys/devices/system/node/node*/cpulist")):
+            with open(cpulist_path, "r") as cpulist_file:
+                numa_nodes.append(ResourcePlanner._parse_cpulist(cpulist_file.read()))
+        return numa_nodes
+
+    @staticmethod
+    def _parse_cpulist(cpulist):
+        """
+        E.g. "0-3,8-11" -> [0, 1, 2, 3, 8, 9, 10, 11]
+        """
+        cpus = []
+        for cpu_range in cpulist.strip().split(","):
+            if cpu_range:
+                start, _, end = cpu_range.partition("-")
+                cpus.extend(range(int(start), int(end or start) + 1))
+        return cpus
+
+    def _allocate_learner_cpus(self, ordered_cpus):
+        # Learners may not take every CPU, unless there's nothing else to give them
+        num_available = max(len(ordered_cpus) - 1, 1)
+        threads_per_learner = min(self.learner_threads, max(num_available // self._num_learner_processes, 1))
+
+        learner_cpus = []
+        free_cpus_by_node = [list(node) for node in self.numa_nodes]
+        for _ in range(self._num_learner_processes):
+            # Prefer the first node the whole block fits in, otherwise take from successive nodes
+            fitting_nodes = [node for node in free_cpus_by_node if len(node) >= threads_per_learner]
+            source_nodes = fitting_nodes[:1] or free_cpus_by_node
+
+            block = []
+            for node in source_nodes:
+                while node and len(block) < threads_per_learner:
+                    block.append(node.pop(0))
+
+            # More learner processes than CPUs: share the first ones
+            learner_cpus.append(block or ordered_cpus[:threads_per_learner])
+
+        return learner_cpus
+
+    def get_cpus(self, role, index=0):
+        if role == "learner":
+            return self.learner_cpus[index % len(self.learner_cpus)]
+        elif role == self._actor_role:
+            start = index * self.actor_threads
+            return sorted({self.actor_pool[(start + offset) % len(self.actor_pool)]
+                           for offset in range(self.actor_threads)})
+        elif role == "eval":
+            return self.actor_pool
+        else:
+            raise ValueError(f"Unknown role {role}")
+
+    def get_num_threads(self, role):
+        return self.learner_threads if role == "learner" else self.actor_threads
+
+    def apply(self, role, index=0):
+        """
+        Called by the process (at its start) that's taking on the role, to set its thread count and affinity.
+        :param index: Which learner process (rank) or actor this is. Unused by evaluation processes.
+        """
+        torch.set_num_threads(self.get_num_threads(role))
+        if self._pin_cpus:
+            os.sched_setaffinity(0, self.get_cpus(role, index))
+
+    def describe(self):
+        pinning = "pinned" if self._pin_cpus else "not pinned"
+        lines = [f"Resource plan ({pinning}), NUMA nodes: {self.numa_nodes}"]
+        for rank, learner_cpus in enumerate(self.learner_cpus):
+            lines.append(f"  learner {rank}: {self.learner_threads} threads, CPUs {learner_cpus}")
+        for actor_index in range(self._num_actors):
+            actor_cpus = self.get_cpus(self._actor_role, actor_index)
+            lines.append(f"  {self._actor_role} {actor_index}: {self.actor_threads} threads, CPUs {actor_cpus}")
+        lines.append(f"  eval: {self.actor_threads} threads each, CPUs {self.actor_pool}")
+        return "\n".join(lines)
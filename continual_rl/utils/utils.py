@@ -141,6 +141,9 @@ class Utils(object):
         if dtype == torch.uint8:
             storage_type = torch.ByteStorage
             tensor_type = torch.ByteTensor
+        elif dtype == torch.int16:
+            storage_type = torch.ShortStorage
+            tensor_type = torch.ShortTensor
         elif dtype == torch.int32:
             storage_type = torch.IntStorage
             tensor_type = torch.IntTensor
@@ -150,6 +153,9 @@ class Utils(object):
         elif dtype == torch.bool:
             storage_type = torch.BoolStorage
             tensor_type = torch.BoolTensor
+        elif dtype == torch.float16:
+            storage_type = torch.HalfStorage
+            tensor_type = torch.HalfTensor
         elif dtype == torch.float32:
             storage_type = torch.FloatStorage
             tensor_type = torch.FloatTensor
@@ -0,0 +1,100 @@
+import os
+import pytest
+import threading
+import torch
+from continual_rl.policies.clear.clear_monobeast import ClearMonobeast
+from continual_rl.policies.clear.clear_policy_config import ClearPolicyConfig
+from continual_rl.policies.clear.reservoir_index import ReservoirIndex
+from continual_rl.policies.impala.torchbeast.core import replay_storage
+
+
+SPECS = dict(frame=dict(size=(3, 2), dtype=torch.uint8), reward=dict(size=(3,), dtype=torch.float32),
+             reservoir_val=dict(size=(1,), dtype=torch.float32))
+
+
+def create_clear_monobeast(tmpdir, replay_prefetch_queue_depth):
+    # Only the replay sampling is under test, so skip the (process-starting) setup
+    model_flags = ClearPolicyConfig()
+    model_flags.device = torch.device("cpu")
+    model_flags.num_actors = 4
+    model_flags.batch_size = 2
+    model_flags.replay_prefetch_queue_depth = replay_prefetch_queue_depth
+
+    monobeast = ClearMonobeast.__new__(ClearMonobeast)
+    monobeast._model_flags = model_flags
+    monobeast._gather_dtypes = {}
+    monobeast._replay_buffers, _, _ = replay_storage.create_replay_buffers(tmpdir, SPECS, num_actors=4,
+                                                                           entries_per_actor=3)
+    monobeast._replay_buffers["reservoir_val"].zero_()
+    monobeast._reservoir_indices = [ReservoirIndex(reservoir_vals)
+                                    for reservoir_vals in monobeast._replay_buffers["reservoir_val"]]
+    monobeast._replay_lock = threading.Lock()
+    monobeast._replay_lock_pid = os.getpid()
+    monobeast._random_states = threading.local()
+    monobeast._replay_destinations = threading.local()
+    monobeast._replay_sampler = None
+    monobeast._replay_sampler_lock = threading.Lock()
+    monobeast._replay_sampler_pid = os.getpid()
+    return monobeast
+
+
+class LinearModel(torch.nn.Module):
+    # Each column's outputs only depend on its own frames, as for the real models
+    def __init__(self):
+        super().__init__()
+        self._linear = torch.nn.Linear(2, 3)
+
+    def forward(self, batch, action_space_id, core_state=()):
+        outputs = self._linear(batch["frame"].float())
+        return {"policy_logits": outputs[..., :2], "baseline": outputs[..., 2]}, core_state
+
+
+class TestClearReplaySampling(object):
+
+    def test_augmented_batches_keep_their_replay_batch(self, tmpdir):
+        # Arrange: each entry's reward identifies it
+        monobeast = create_clear_monobeast(tmpdir, replay_prefetch_queue_depth=2)
+        for actor_index in range(4):
+            for entry_index in range(3):
+                entry = {"frame": torch.zeros((3, 2), dtype=torch.uint8),
+                         "reward": torch.full((3,), actor_index * 3 + entry_index + 1.0),
+                         "reservoir_val": torch.rand((1,)) + 0.001}
+                monobeast.on_act_unroll_complete(None, actor_index, None, None, entry)
+        batch = {"frame": torch.zeros((3, 2, 2), dtype=torch.uint8), "reward": torch.zeros((3, 2))}
+
+        # Act
+        try:
+            augmented_batches = [monobeast.get_batch_for_training(batch) for _ in range(3)]
+        finally:
+            monobeast._stop_replay_sampler()
+
+        # Assert: the replay entries each was trained with are the ones it keeps for the cloning losses
+        for augmented_batch in augmented_batches:
+            assert augmented_batch["reward"].shape == (3, 4)
+            assert torch.equal(augmented_batch["reward"][:, 2:], augmented_batch.replay_batch["reward"])
+            assert torch.all(augmented_batch.replay_batch["reward"] > 0)
+
+    def test_cloning_losses_from_learner_outputs(self, tmpdir):
+        # Arrange
+        monobeast = create_clear_monobeast(tmpdir, replay_prefetch_queue_depth=0)
+        model = LinearModel()
+        replay_batch = {"frame": torch.randint(0, 255, (3, 2, 2), dtype=torch.uint8),
+                        "policy_logits": torch.rand((3, 2, 2)), "baseline": torch.rand((3, 2))}
+        batch = {"frame": torch.cat((torch.zeros((3, 2, 2), dtype=torch.uint8), replay_batch["frame"]), dim=1)}
+        learner_outputs, _ = model(batch, action_space_id=0)
+        monobeast._loss_replay_batches = threading.local()
+        monobeast._loss_replay_batches.replay_batch = replay_batch
+
+        # Act
+        loss, stats = monobeast.custom_loss(None, model, (), batch, None, learner_outputs)
+
+        # Assert: the same as forwarding the replay batch separately
+        replay_outputs, _ = model(replay_batch, action_space_id=0)
+        expected_policy_cloning_loss = monobeast._model_flags.policy_cloning_cost * \
+            monobeast._compute_policy_cloning_loss(replay_batch["policy_logits"], replay_outputs["policy_logits"])
+        expected_value_cloning_loss = monobeast._model_flags.value_cloning_cost * \
+            monobeast._compute_value_cloning_loss(replay_batch["baseline"], replay_outputs["baseline"])
+        assert torch.allclose(loss, expected_policy_cloning_loss + expected_value_cloning_loss)
+        assert stats["policy_cloning_loss"] > 0
+        assert stats["policy_cloning_loss"] == pytest.approx(expected_policy_cloning_loss.item())
+        assert stats["value_cloning_loss"] == pytest.approx(expected_value_cloning_loss.item())
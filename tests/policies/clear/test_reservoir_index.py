@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+from continual_rl.policies.clear.reservoir_index import ReservoirIndex
+
+
+def add_entry(reservoir_index, reservoir_val):
+    entry = reservoir_index.get_entry_to_fill(reservoir_val)
+    if entry is not None:
+        reservoir_index.set_entry(entry, reservoir_val)
+    return entry
+
+
+class TestReservoirIndex(object):
+
+    def test_matches_reservoir_scan(self):
+        # Arrange
+        reservoir_vals = torch.zeros((8, 1))
+        reservoir_index = ReservoirIndex(reservoir_vals)
+        random_state = np.random.RandomState(0)
+
+        # Act, Assert
+        for _ in range(100):
+            new_val = random_state.uniform(0.001, 1.0)
+            expected_vals = reservoir_vals.clone().view(-1)
+
+            # What scanning the whole section would have picked
+            unfilled = np.flatnonzero(expected_vals.numpy() == 0)
+            if len(unfilled) > 0:
+                expected_entry = unfilled.min()
+            elif new_val > expected_vals.min():
+                expected_entry = expected_vals.argmin().item()
+            else:
+                expected_entry = None
+
+            assert add_entry(reservoir_index, new_val) == expected_entry
+            assert reservoir_index.min_reservoir_val() == reservoir_vals[reservoir_vals > 0].min().item()
+
+        assert reservoir_index.num_filled == 8
+
+    def test_rebuilt_from_reloaded_reservoir_vals(self):
+        # Arrange
+        reservoir_vals = torch.tensor([[0.5], [0.2], [0.9], [0.0], [0.0]])
+
+        # Act
+        reservoir_index = ReservoirIndex(reservoir_vals)
+        entry = add_entry(reservoir_index, 0.1)
+
+        # Assert
+        assert entry == 3
+        assert reservoir_index.num_filled == 4
+        assert reservoir_index.min_reservoir_val() == torch.tensor(0.1).item()
+
+    def test_samples_only_filled_entries(self):
+        # Arrange
+        reservoir_index = ReservoirIndex(torch.zeros((10, 1)))
+        random_state = np.random.RandomState(0)
+        empty_sample = reservoir_index.sample(random_state)
+        for val in (0.3, 0.6, 0.4):
+            add_entry(reservoir_index, val)
+
+        # Act
+        samples = {reservoir_index.sample(random_state) for _ in range(100)}
+
+        # Assert
+        assert empty_sample is None
+        assert samples == {0, 1, 2}
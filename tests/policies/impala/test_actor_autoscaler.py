@@ -0,0 +1,80 @@
+import csv
+import os
+from continual_rl.policies.impala.torchbeast.core.actor_autoscaler import ActorAutoscaler
+
+
+def create_autoscaler(timeline_path=None, max_policy_lag=0):
+    # An interval of 0 makes a decision every time it's asked
+    return ActorAutoscaler(min_actors=2, max_actors=4, num_batch_consumers=1, interval_seconds=0,
+                           learner_wait_threshold=0.1, queue_occupancy_threshold=0.5,
+                           max_policy_lag=max_policy_lag, timeline_path=timeline_path)
+
+
+class TestActorAutoscaler(object):
+
+    def test_retires_actors_down_to_min_when_queue_full(self):
+        # Arrange
+        autoscaler = create_autoscaler()
+        autoscaler.resume(step=0)
+
+        # Act
+        num_actors = [autoscaler.maybe_rescale(step=10 * i, full_queue_occupancy=0.9) for i in range(1, 4)]
+
+        # Assert
+        assert num_actors == [3, 2, 2]
+
+    def test_adds_actors_up_to_max_when_learner_waits(self):
+        # Arrange
+        autoscaler = create_autoscaler()
+        autoscaler.num_actors = 2
+        autoscaler.resume(step=0)
+
+        # Act
+        num_actors = []
+        for i in range(1, 4):
+            autoscaler.record_learner_wait(1e6)  # Far longer than the window
+            num_actors.append(autoscaler.maybe_rescale(step=10 * i, full_queue_occupancy=0))
+
+        # Assert
+        assert num_actors == [3, 4, 4]
+
+    def test_retires_actor_on_policy_lag(self):
+        # Arrange
+        autoscaler = create_autoscaler(max_policy_lag=2)
+        autoscaler.resume(step=0)
+        autoscaler.record_learner_wait(1e6)  # The lag takes precedence
+        autoscaler.record_policy_lags([1, 2, 6])
+
+        # Act
+        num_actors = autoscaler.maybe_rescale(step=10, full_queue_occupancy=0)
+
+        # Assert
+        assert num_actors == 3
+
+    def test_nothing_measured_while_paused(self):
+        # Arrange
+        autoscaler = create_autoscaler()
+
+        # Act
+        autoscaler.record_learner_wait(1e6)
+        num_actors = autoscaler.maybe_rescale(step=10, full_queue_occupancy=0.9)
+
+        # Assert
+        assert num_actors == 4
+
+    def test_timeline_written(self, tmpdir):
+        # Arrange
+        timeline_path = os.path.join(tmpdir, "actor_autoscaling.csv")
+        autoscaler = create_autoscaler(timeline_path=timeline_path)
+        autoscaler.resume(step=0)
+
+        # Act
+        autoscaler.maybe_rescale(step=10, full_queue_occupancy=0.9)
+        autoscaler.maybe_rescale(step=20, full_queue_occupancy=0.9)
+
+        # Assert
+        with open(timeline_path, "r") as timeline_file:
+            rows = list(csv.DictReader(timeline_file))
+
+        assert [(int(row["num_actors"]), int(row["new_num_actors"])) for row in rows] == [(4, 3), (3, 2)]
+        assert all(float(row["sps"]) > 0 for row in rows)
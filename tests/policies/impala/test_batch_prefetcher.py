@@ -0,0 +1,56 @@
+import queue
+import threading
+from continual_rl.policies.impala.torchbeast.core.batch_prefetcher import BatchPrefetcher
+
+
+class TestBatchPrefetcher(object):
+
+    def test_batches_consumed_in_order_until_exhausted(self):
+        # Arrange
+        source = iter(range(5))
+
+        def produce_batch(timeout):
+            return next(source, None)
+
+        prefetcher = BatchPrefetcher(produce_batch, depth=2)
+
+        # Act
+        prefetcher.start()
+        batches = []
+        while True:
+            batch = prefetcher.get(timeout=5)
+            if batch is None:
+                break
+            batches.append(batch)
+        prefetcher.stop()
+        stats = prefetcher.get_stats()
+
+        # Assert
+        assert batches == [0, 1, 2, 3, 4]
+        assert len(stats["prefetch_wait_ms_hist"]) == 5
+        assert 0 <= stats["prefetch_starved_fraction"] <= 1
+
+    def test_stop_discards_unconsumed_batches(self):
+        # Arrange
+        produced = []
+        discarded = []
+        release = threading.Event()
+
+        def produce_batch(timeout):
+            if len(produced) >= 3:
+                release.set()
+                raise queue.Empty
+            produced.append(len(produced))
+            return produced[-1]
+
+        prefetcher = BatchPrefetcher(produce_batch, depth=3, discard_batch=discarded.append, poll_interval=0.01)
+
+        # Act
+        prefetcher.start()
+        release.wait(timeout=5)
+        first = prefetcher.get(timeout=5)
+        prefetcher.stop()
+
+        # Assert
+        assert first == 0
+        assert discarded == [1, 2]
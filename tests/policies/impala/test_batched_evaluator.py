@@ -0,0 +1,78 @@
+import logging
+import torch
+from dotmap import DotMap
+from continual_rl.policies.impala.torchbeast.core.batched_evaluator import BatchedEvaluator
+
+
+class CountingFrame(object):
+    """
+    Stands in for LazyFrames: a stack of frames that can be written into a tensor.
+    """
+    def __init__(self, value):
+        self._value = value
+
+    def to_tensor(self, out=None):
+        out = out if out is not None else torch.zeros((1, 2), dtype=torch.uint8)
+        return out.fill_(self._value)
+
+
+class FixedLengthEnv(object):
+    """
+    Every episode lasts episode_length steps, with a reward of 1 each, so its return is episode_length.
+    """
+    def __init__(self, episode_length):
+        self._episode_length = episode_length
+        self._step = 0
+
+    def reset(self):
+        self._step = 0
+        return CountingFrame(self._step)
+
+    def step(self, action):
+        self._step += 1
+        return CountingFrame(self._step), 1.0, self._step >= self._episode_length, {}
+
+    def close(self):
+        pass
+
+
+class ZeroActionModel(object):
+    def __init__(self):
+        self.batch_sizes = []
+
+    def initial_state(self, batch_size):
+        return tuple()
+
+    def __call__(self, inputs, action_space_id, core_state=()):
+        batch_size = inputs["frame"].shape[1]
+        self.batch_sizes.append(batch_size)
+        return {"action": torch.zeros((1, batch_size), dtype=torch.int64)}, core_state
+
+
+class TestBatchedEvaluator(object):
+
+    def test_episodes_run_batched_on_kept_envs(self):
+        # Arrange
+        created_envs = []
+
+        def create_env():
+            created_envs.append(FixedLengthEnv(episode_length=3))
+            return created_envs[-1]
+
+        task_flags = DotMap(task_id=0, action_space_id=0, env_spec=create_env, mode="test")
+        evaluator = BatchedEvaluator(num_envs=2, observation_shape=(1, 2), logger=logging.getLogger(__name__))
+        model = ZeroActionModel()
+
+        # Act
+        first_step, first_returns = evaluator.evaluate(task_flags, model, num_episodes=3)
+        second_step, second_returns = evaluator.evaluate(task_flags, model, num_episodes=1)
+
+        # Assert
+        assert first_returns == [3.0, 3.0, 3.0]
+        assert first_step == 9
+        assert second_returns == [3.0]
+        assert second_step == 3
+        assert len(created_envs) == 2
+
+        # The env with no episode left stops being acted for, while the other runs the third episode
+        assert model.batch_sizes[:6] == [2, 2, 2, 1, 1, 1]
@@ -0,0 +1,54 @@
+import torch
+from continual_rl.policies.clear.clear_monobeast import ClearMonobeast
+from continual_rl.policies.clear.clear_policy_config import ClearPolicyConfig
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+from continual_rl.policies.impala.torchbeast.monobeast import Monobeast
+
+
+def create_monobeast(monobeast_class, model_flags):
+    # Only the buffer handling is under test, so skip the (process-starting) setup
+    monobeast = monobeast_class.__new__(monobeast_class)
+    monobeast._model_flags = model_flags
+    return monobeast
+
+
+class TestBufferSpecs(object):
+
+    def test_only_declared_fields_stored(self):
+        # Arrange
+        impala = create_monobeast(Monobeast, ImpalaPolicyConfig())
+        clear = create_monobeast(ClearMonobeast, ClearPolicyConfig())
+
+        # Act
+        impala_specs = impala.create_buffer_specs(unroll_length=5, obs_shape=(4, 1, 8, 8), num_actions=6)
+        clear_specs = clear.create_buffer_specs(unroll_length=5, obs_shape=(4, 1, 8, 8), num_actions=6)
+
+        # Assert
+        assert set(impala_specs.keys()) == {"frame", "reward", "done", "last_action", "episode_return",
+                                            "policy_logits", "action"}
+        assert set(clear_specs.keys()) == set(impala_specs.keys()) | {"baseline"}
+
+    def test_narrowed_fields_cast_back_when_moved_to_device(self):
+        # Arrange
+        model_flags = ImpalaPolicyConfig()
+        model_flags.device = torch.device("cpu")
+        model_flags.num_buffers = 4
+        model_flags.unroll_length = 3
+        model_flags.store_outputs_in_float16 = True
+        monobeast = create_monobeast(Monobeast, model_flags)
+        buffers = monobeast.create_buffers(model_flags, obs_shape=(4, 1, 8, 8), num_actions=300)
+        buffers["action"][0].fill_(299)
+        buffers["policy_logits"][0].fill_(0.25)
+
+        # Act
+        batch = monobeast.move_batch_to_device({key: buffer[:2].transpose(0, 1) for key, buffer in buffers.items()})
+
+        # Assert
+        assert buffers["action"].dtype == torch.int16
+        assert buffers["policy_logits"].dtype == torch.float16
+        assert batch["action"].dtype == torch.int64
+        assert batch["last_action"].dtype == torch.int64
+        assert batch["policy_logits"].dtype == torch.float32
+        assert batch["frame"].dtype == torch.uint8
+        assert torch.all(batch["action"][:, 0] == 299)
+        assert torch.all(batch["policy_logits"][:, 0] == 0.25)
@@ -0,0 +1,53 @@
+import collections
+import torch
+from continual_rl.policies.impala.torchbeast.core import frame_dedup
+
+
+def create_rollout(unroll_length, stack_size, reset_steps, first_frame_id):
+    """
+    Simulate FrameStack: each frame's value is its id, and a reset fills the stack with the new episode's first frame.
+    Returns the (T + 1, S, 1) stacked frames and the (T + 1,) done flags.
+    """
+    frames = collections.deque([first_frame_id - offset for offset in range(stack_size - 1, -1, -1)],
+                               maxlen=stack_size)
+    stacks = [torch.tensor(list(frames))]
+    dones = [False]
+
+    for t in range(1, unroll_length + 1):
+        frame_id = first_frame_id + t
+        if t in reset_steps:
+            frames.extend([frame_id] * stack_size)
+        else:
+            frames.append(frame_id)
+        stacks.append(torch.tensor(list(frames)))
+        dones.append(t in reset_steps)
+
+    return torch.stack(stacks).unsqueeze(-1), torch.tensor(dones)
+
+
+class TestFrameDedup(object):
+
+    def test_rebuilt_stacks_match_originals(self):
+        # Arrange
+        unroll_length, stack_size = 10, 4
+        rollouts = [create_rollout(unroll_length, stack_size, reset_steps={3, 5}, first_frame_id=100),
+                    create_rollout(unroll_length, stack_size, reset_steps={1}, first_frame_id=200),
+                    create_rollout(unroll_length, stack_size, reset_steps=set(), first_frame_id=300)]
+        frame_buffers = torch.zeros((len(rollouts), *frame_dedup.deduplicated_frame_size(unroll_length, (stack_size, 1))),
+                                    dtype=torch.int64)
+
+        # Act
+        for rollout_id, (stacks, _) in enumerate(rollouts):
+            for t in range(unroll_length + 1):
+                frame_dedup.write_frames(frame_buffers, [rollout_id], t, stacks[t].unsqueeze(0))
+
+        rollout_indices = torch.tensor([2, 0, 1])
+        done = torch.stack([rollouts[index][1] for index in rollout_indices], dim=1)
+        gathered = frame_dedup.gather_frame_stacks(frame_buffers, rollout_indices, done)
+        rebuilt = frame_dedup.rebuild_frame_stacks(frame_buffers[rollout_indices].transpose(0, 1), done)
+
+        # Assert
+        expected = torch.stack([rollouts[index][0] for index in rollout_indices], dim=1)
+        assert frame_buffers.shape[1] == unroll_length + stack_size
+        assert torch.equal(gathered, expected)
+        assert torch.equal(rebuilt, expected)
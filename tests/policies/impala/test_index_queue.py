@@ -0,0 +1,72 @@
+import queue
+import pytest
+from torch import multiprocessing as mp
+from continual_rl.policies.impala.torchbeast.core.index_queue import SharedIndexQueue
+
+
+class TestSharedIndexQueue(object):
+
+    def test_fifo_order_across_wraparound(self):
+        # Arrange
+        index_queue = SharedIndexQueue(capacity=4, ctx=mp.get_context("fork"))
+
+        # Act
+        index_queue.put_many([0, 1, 2])
+        first = index_queue.get_many(2)
+        index_queue.put_many([3, 4, 5])  # Wraps around the end of the ring
+        second = index_queue.get_many(4)
+
+        # Assert
+        assert first == [0, 1]
+        assert second == [2, 3, 4, 5]
+        assert index_queue.empty()
+
+    def test_get_many_is_atomic_and_times_out(self):
+        # Arrange
+        index_queue = SharedIndexQueue(capacity=4, ctx=mp.get_context("fork"))
+        index_queue.put(7)
+
+        # Act, Assert: not enough available, so nothing should be taken
+        with pytest.raises(queue.Empty):
+            index_queue.get_many(2, timeout=0.01)
+        assert index_queue.qsize() == 1
+
+    def test_indices_pass_between_processes(self):
+        # Arrange
+        ctx = mp.get_context("fork")
+        free_queue = SharedIndexQueue(capacity=8, ctx=ctx)
+        full_queue = SharedIndexQueue(capacity=8, ctx=ctx)
+        free_queue.put_many(list(range(8)))
+
+        def actor():
+            while True:
+                indices = free_queue.get_many(2)
+                if indices is None:
+                    break
+                full_queue.put_many(indices)
+
+        # Act
+        process = ctx.Process(target=actor)
+        process.start()
+        received = [full_queue.get() for _ in range(8)]
+        free_queue.close()
+        process.join(timeout=10)
+
+        # Assert
+        assert sorted(received) == list(range(8))
+        assert not process.is_alive()
+
+    def test_close_and_reset(self):
+        # Arrange
+        index_queue = SharedIndexQueue(capacity=4, ctx=mp.get_context("fork"))
+        index_queue.put_many([1, 2])
+
+        # Act
+        index_queue.close()
+        closed_result = index_queue.get_many(1)
+        index_queue.reset()
+        index_queue.put(3)
+
+        # Assert
+        assert closed_result is None
+        assert index_queue.drain() == [3]
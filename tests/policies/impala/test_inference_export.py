@@ -0,0 +1,57 @@
+import gymnasium as gym
+import numpy as np
+import torch
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+from continual_rl.policies.impala.nets import ImpalaNet
+
+
+def create_impala_net():
+    model_flags = ImpalaPolicyConfig()
+    model_flags.device = torch.device("cpu")
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(4, 1, 84, 84), dtype=np.uint8)
+    return ImpalaNet(observation_space, {0: gym.spaces.Discrete(6), 1: gym.spaces.Discrete(3)}, model_flags)
+
+
+def create_inputs(T, B):
+    return {"frame": torch.randint(0, 256, (T, B, 4, 1, 84, 84), dtype=torch.uint8),
+            "last_action": torch.randint(0, 6, (T, B)),
+            "reward": torch.randn((T, B)),
+            "done": torch.zeros((T, B), dtype=torch.bool)}
+
+
+class TestInferenceExport(object):
+
+    def test_exported_impala_net_matches_eager(self):
+        # Arrange
+        net = create_impala_net().eval()
+        inputs = create_inputs(T=1, B=3)  # A different batch size than the export was traced with
+
+        # Act
+        exported = net.export_for_inference()
+        quantized = net.export_for_inference(quantize=True)
+        with torch.no_grad():
+            outputs, _ = net(inputs, action_space_id=1)
+        exported_outputs, _ = exported(inputs, action_space_id=1)
+        quantized_outputs, _ = quantized(inputs, action_space_id=1)
+
+        # Assert
+        assert torch.allclose(exported_outputs["policy_logits"], outputs["policy_logits"], atol=1e-5)
+        assert torch.allclose(exported_outputs["baseline"], outputs["baseline"], atol=1e-5)
+        assert torch.equal(exported_outputs["action"], outputs["action"])
+        assert exported_outputs["action"].max() < 3
+        assert torch.allclose(quantized_outputs["policy_logits"], outputs["policy_logits"], atol=0.05)
+
+    def test_export_is_a_snapshot_of_the_weights(self):
+        # Arrange
+        net = create_impala_net().eval()
+        inputs = create_inputs(T=1, B=1)
+        exported = net.export_for_inference()
+
+        # Act
+        with torch.no_grad():
+            net.policy.bias.add_(1)
+        stale_outputs, _ = exported(inputs, action_space_id=0)
+        refreshed_outputs, _ = net.export_for_inference()(inputs, action_space_id=0)
+
+        # Assert
+        assert torch.allclose(refreshed_outputs["policy_logits"], stale_outputs["policy_logits"] + 1, atol=1e-5)
@@ -0,0 +1,50 @@
+import threading
+import torch
+from torch import multiprocessing as mp
+from continual_rl.policies.impala.torchbeast.core.inference_server import InferenceServer
+
+
+class DoublingModel(torch.nn.Module):
+    """
+    Outputs an "action" that's twice the frame's value, so we can check every client gets its own result back.
+    """
+    def forward(self, inputs, action_space_id, core_state=()):
+        frame = inputs["frame"]
+        action = 2 * frame.view(frame.shape[0], frame.shape[1])
+        return dict(action=action.long()), core_state
+
+
+class TestInferenceServer(object):
+
+    def test_batched_requests_return_per_client_results(self):
+        # Arrange
+        num_clients = 4
+        input_examples = {"frame": torch.zeros((1, 1, 1), dtype=torch.uint8)}
+        output_examples = {"action": torch.zeros((1, 1), dtype=torch.int64)}
+        server = InferenceServer(DoublingModel(), action_space_id=0, input_examples=input_examples,
+                                 output_examples=output_examples, num_clients=num_clients,
+                                 ctx=mp.get_context("fork"), batch_deadline_ms=50)
+        results = {}
+
+        def client(client_id):
+            server.reset_client(client_id)
+            results[client_id] = [server.infer(client_id, {"frame": torch.full((1, 1, 1), client_id + step)})
+                                  for step in range(3)]
+
+        # Act
+        server.start()
+        clients = [threading.Thread(target=client, args=(client_id,)) for client_id in range(num_clients)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        stats = server.get_stats()
+        server.stop()
+
+        # Assert
+        for client_id in range(num_clients):
+            assert [result["action"].item() for result in results[client_id]] == \
+                   [2 * (client_id + step) for step in range(3)]
+
+        assert sum(stats["inference_batch_size_hist"]) == 3 * num_clients
+        assert len(stats["inference_latency_ms_hist"]) == 3 * num_clients
@@ -0,0 +1,102 @@
+import gymnasium as gym
+import numpy as np
+import pytest
+import torch
+from torch import multiprocessing as mp
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+from continual_rl.policies.impala.nets import ImpalaNet
+from continual_rl.policies.impala.torchbeast.core.learner_process_group import LearnerProcessGroup
+
+
+def create_net():
+    model_flags = ImpalaPolicyConfig()
+    model_flags.device = torch.device("cpu")
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(4, 1, 84, 84), dtype=np.uint8)
+    return ImpalaNet(observation_space, {0: gym.spaces.Discrete(6)}, model_flags)
+
+
+def create_rewards(rank):
+    # Batches of the same length, but different widths, as with replay
+    return torch.arange(3 * (4 + rank), dtype=torch.float32).view(3, 4 + rank) * (rank + 1) - 2
+
+
+def run_rank(rank, world_size, port, results):
+    group = LearnerProcessGroup(rank, world_size, port)
+    try:
+        model = torch.nn.Linear(2, 1)
+        with torch.no_grad():
+            model.weight.fill_(rank)
+
+        # Only rank 1 has a gradient for the bias
+        model.weight.grad = torch.full_like(model.weight, float(rank + 1))
+        model.bias.grad = torch.ones_like(model.bias) if rank == 1 else None
+        group.all_reduce_gradients(model)
+        group.broadcast_from_rank_0([model.weight])
+
+        keep_going = group.all_continue(True)
+        stop = group.all_continue(rank == 0)
+        results.put((rank, model.weight.grad.tolist(), model.bias.grad.tolist(), model.weight.tolist(), keep_going,
+                     stop))
+    finally:
+        group.close()
+
+
+def run_rank_reward_moments(rank, world_size, port, results):
+    group = LearnerProcessGroup(rank, world_size, port)
+    try:
+        net = create_net()
+        for _ in range(2):
+            rewards = create_rewards(rank)
+            reward_sums = net.get_reward_sums(rewards)
+            group.all_reduce_sum(reward_sums)
+            net.update_running_moments(rewards, reward_sums)
+
+        results.put((rank, net.reward_count.item(), net.reward_sum.item(), net.reward_m2.item()))
+    finally:
+        group.close()
+
+
+def run_ranks(target, world_size):
+    ctx = mp.get_context("fork")
+    results = ctx.Queue()
+    port = LearnerProcessGroup.find_free_port()
+    processes = [ctx.Process(target=target, args=(rank, world_size, port, results)) for rank in range(world_size)]
+
+    for process in processes:
+        process.start()
+    rank_results = sorted([results.get(timeout=60) for _ in processes])
+    for process in processes:
+        process.join(timeout=30)
+
+    return rank_results
+
+
+class TestLearnerProcessGroup(object):
+
+    def test_gradients_averaged_and_stop_agreed(self):
+        # Act
+        rank_results = run_ranks(run_rank, world_size=2)
+
+        # Assert
+        for rank, weight_grad, bias_grad, weight, keep_going, stop in rank_results:
+            assert weight_grad == [[1.5, 1.5]]
+            assert bias_grad == [0.5]
+            assert weight == [[0.0, 0.0]]
+            assert keep_going
+            assert not stop
+
+    def test_reward_moments_identical_for_batches_of_different_widths(self):
+        # Arrange: the moments of both ranks' batches as one, concatenated along the batch dimension
+        reference_net = create_net()
+        for _ in range(2):
+            reference_net.update_running_moments(torch.cat([create_rewards(rank) for rank in range(2)], dim=1))
+
+        # Act
+        rank_results = run_ranks(run_rank_reward_moments, world_size=2)
+
+        # Assert
+        assert rank_results[0][1:] == rank_results[1][1:]
+        for rank, reward_count, reward_sum, reward_m2 in rank_results:
+            assert reward_count == pytest.approx(reference_net.reward_count.item())
+            assert reward_sum == pytest.approx(reference_net.reward_sum.item())
+            assert reward_m2 == pytest.approx(reference_net.reward_m2.item(), rel=1e-5)
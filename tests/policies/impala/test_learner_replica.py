@@ -0,0 +1,62 @@
+import torch
+from continual_rl.policies.impala.torchbeast.core.learner_replica import LearnerReplica
+
+
+class TestLearnerReplica(object):
+
+    def test_private_replica_pulls_weights_and_pushes_gradients(self):
+        # Arrange
+        learner_model = torch.nn.Linear(3, 2)
+        replica = LearnerReplica(learner_model)
+        with torch.no_grad():
+            learner_model.weight.add_(1)
+
+        # Act
+        stale_weight = replica.model.weight.detach().clone()
+        replica.pull()
+        replica.model(torch.ones((1, 3))).sum().backward()
+        replica.push_gradients()
+
+        # Assert
+        assert not torch.equal(stale_weight, learner_model.weight)
+        assert torch.equal(replica.model.weight, learner_model.weight)
+        assert replica.model.weight.data_ptr() != learner_model.weight.data_ptr()
+        assert torch.equal(learner_model.weight.grad, torch.ones((2, 3)))
+
+    def test_hogwild_replica_steps_shared_weights_and_optimizer_state(self):
+        # Arrange
+        learner_model = torch.nn.Linear(3, 2)
+        learner_optimizer = torch.optim.RMSprop(learner_model.parameters(), lr=0.1)
+        replica = LearnerReplica(learner_model, share_weights=True)
+        replica.create_optimizer(lambda parameters: torch.optim.RMSprop(parameters, lr=0.1), learner_optimizer)
+        original_weight = learner_model.weight.detach().clone()
+
+        # Act
+        output = replica.model(torch.ones((1, 3))).sum()
+        with torch.no_grad():
+            learner_model.bias.add_(1)  # Another thread's update, while this graph is in flight
+        output.backward()
+        replica.optimizer.step()
+
+        # Assert
+        assert not torch.equal(learner_model.weight, original_weight)
+        assert torch.equal(replica.model.weight, learner_model.weight)
+        assert "square_avg" in learner_optimizer.state[learner_model.weight]
+
+    def test_private_replica_shares_buffers(self):
+        # Arrange: a buffer standing in for the running reward moments
+        learner_model = torch.nn.Linear(3, 2)
+        learner_model.register_buffer("reward_sum", torch.zeros(()))
+        replica = LearnerReplica(learner_model)
+
+        # Act: the learner's moments are updated (as learn does, under the lock) between the replica's pulls
+        learner_model.reward_sum += 1
+        replica.pull()
+        learner_model.reward_sum += 1
+        replica.pull()
+
+        # Assert: pulling doesn't overwrite the accumulated moments, and the replica reads the learner's
+        assert learner_model.reward_sum == 2
+        assert replica.model.reward_sum.data_ptr() == learner_model.reward_sum.data_ptr()
+        assert replica.model.weight.data_ptr() != learner_model.weight.data_ptr()
+        assert replica.model.is_learner_replica
@@ -0,0 +1,122 @@
+import copy
+import gymnasium as gym
+import numpy as np
+import pickle
+import pytest
+import torch
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+from continual_rl.policies.impala.nets import ImpalaNet
+from continual_rl.policies.impala.torchbeast.core import model_acceleration
+
+
+def create_net():
+    model_flags = ImpalaPolicyConfig()
+    model_flags.device = torch.device("cpu")
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(4, 1, 84, 84), dtype=np.uint8)
+    return ImpalaNet(observation_space, {0: gym.spaces.Discrete(6)}, model_flags)
+
+
+def create_inputs(T, B):
+    return {"frame": torch.randint(0, 256, (T, B, 4, 1, 84, 84), dtype=torch.uint8),
+            "last_action": torch.randint(0, 6, (T, B)),
+            "reward": torch.randn((T, B)),
+            "done": torch.zeros((T, B), dtype=torch.bool)}
+
+
+class TestModelAcceleration(object):
+
+    def test_compiled_net_matches_eager(self):
+        if not model_acceleration.compile_supported(torch.device("cpu")):
+            pytest.skip("torch.compile is not supported on this platform")
+
+        # Arrange
+        net = create_net()
+        compiled_net = create_net()
+        compiled_net.load_state_dict(net.state_dict())
+        inputs = create_inputs(T=2, B=3)
+
+        # Act
+        compiled_net.compile_trunk_and_heads()
+        outputs, _ = net(inputs, action_space_id=0)
+        compiled_outputs, _ = compiled_net(inputs, action_space_id=0)
+
+        # Assert
+        assert compiled_net.state_dict().keys() == net.state_dict().keys()
+        assert torch.allclose(compiled_outputs["policy_logits"], outputs["policy_logits"], atol=1e-5)
+        assert torch.allclose(compiled_outputs["baseline"], outputs["baseline"], atol=1e-5)
+
+    def test_failed_compile_falls_back_to_eager_for_that_module_only(self):
+        # Arrange
+        linear = torch.nn.Linear(4, 2)
+        model_acceleration.compile_in_place(linear)
+
+        def fail_to_compile(*args, **kwargs):
+            raise torch._dynamo.exc.BackendCompilerFailed(fail_to_compile, RuntimeError("Simulated failure"), None)
+
+        linear.forward._compiled_forward = fail_to_compile
+        suppress_errors = torch._dynamo.config.suppress_errors
+
+        # Act
+        output = linear(torch.ones((1, 4)))
+
+        # Assert
+        assert torch.allclose(output, torch.nn.functional.linear(torch.ones((1, 4)), linear.weight, linear.bias))
+        assert linear.forward._compiled_forward is None
+        assert torch._dynamo.config.suppress_errors == suppress_errors
+
+    def test_errors_other_than_compile_failures_raised(self):
+        # Arrange
+        linear = torch.nn.Linear(4, 2)
+        model_acceleration.compile_in_place(linear)
+
+        def fail_in_forward(*args, **kwargs):
+            raise ValueError("Simulated model error")
+
+        linear.forward._compiled_forward = fail_in_forward
+
+        # Act
+        with pytest.raises(ValueError):
+            linear(torch.ones((1, 4)))
+
+        # Assert: still compiled
+        assert linear.forward._compiled_forward is fail_in_forward
+
+    def test_copies_compiled_from_their_own_weights(self):
+        # Arrange
+        linear = torch.nn.Linear(4, 2)
+        model_acceleration.compile_in_place(linear)
+
+        # Act
+        linear_copies = [copy.deepcopy(linear), pickle.loads(pickle.dumps(linear))]
+        for linear_copy in linear_copies:
+            with torch.no_grad():
+                linear_copy.weight.fill_(1)
+                linear_copy.bias.fill_(0)
+
+        # Assert
+        for linear_copy in linear_copies:
+            assert linear_copy.state_dict().keys() == linear.state_dict().keys()
+            assert linear_copy.forward._eager_forward.__self__ is linear_copy
+            assert torch.equal(linear_copy.forward._eager_forward(torch.ones((1, 4))), torch.full((1, 2), 4.0))
+
+    def test_learner_autocast_runs_in_bf16_only_when_enabled(self):
+        # Arrange
+        model_flags = ImpalaPolicyConfig()
+        model_flags.device = torch.device("cpu")
+        linear = torch.nn.Linear(4, 2)
+
+        # Act
+        model_flags.learner_bf16_autocast = False
+        with model_acceleration.learner_autocast(model_flags):
+            float_output = linear(torch.ones((1, 4)))
+
+        model_flags.learner_bf16_autocast = True
+        with model_acceleration.learner_autocast(model_flags):
+            bf16_output = linear(torch.ones((1, 4)))
+        bf16_output.sum().backward()
+
+        # Assert
+        assert float_output.dtype == torch.float32
+        assert bf16_output.dtype == torch.bfloat16
+        assert linear.weight.dtype == torch.float32
+        assert linear.weight.grad.dtype == torch.float32
@@ -0,0 +1,68 @@
+import torch
+from torch import multiprocessing as mp
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+from continual_rl.policies.impala.torchbeast.core.param_store import ParamStore
+from continual_rl.policies.impala.torchbeast.monobeast import Monobeast
+
+
+class TestParamStore(object):
+
+    def test_pull_gets_latest_published_weights(self):
+        # Arrange
+        learner_model = torch.nn.Sequential(torch.nn.Linear(3, 2), torch.nn.BatchNorm1d(2))
+        actor_model = torch.nn.Sequential(torch.nn.Linear(3, 2), torch.nn.BatchNorm1d(2))
+        store = ParamStore(learner_model, mp.get_context("fork"))
+
+        # Act
+        with torch.no_grad():
+            for parameter in learner_model.parameters():
+                parameter.add_(1)
+        learner_model[1].num_batches_tracked.fill_(5)
+        published_version = store.publish(learner_model)
+        pulled_version = store.pull(actor_model)
+
+        # Assert
+        assert published_version == 2  # The store publishes once on creation
+        assert pulled_version == published_version
+        for learner_tensor, actor_tensor in zip(learner_model.state_dict().values(), actor_model.state_dict().values()):
+            assert torch.equal(learner_tensor, actor_tensor)
+
+    def test_pull_skipped_when_version_known(self):
+        # Arrange
+        learner_model = torch.nn.Linear(3, 2)
+        actor_model = torch.nn.Linear(3, 2)
+        store = ParamStore(learner_model, mp.get_context("fork"))
+        original_weight = actor_model.weight.detach().clone()
+
+        # Act
+        version = store.pull(actor_model, known_version=store.version)
+
+        # Assert
+        assert version == store.version
+        assert torch.equal(actor_model.weight, original_weight)
+
+    def test_checkpoint_saves_learner_weights_between_syncs(self, tmpdir):
+        # Arrange: only the checkpointing is under test, so skip the (process-starting) setup
+        model_flags = ImpalaPolicyConfig()
+        model_flags.param_sync_every_n_steps = 3
+        monobeast = Monobeast.__new__(Monobeast)
+        monobeast.learner_model = torch.nn.Linear(3, 2)
+        monobeast.actor_model = torch.nn.Linear(3, 2)
+        monobeast.optimizer = torch.optim.SGD(monobeast.learner_model.parameters(), lr=0.1)
+        monobeast._scheduler = None
+        monobeast.last_timestep_returned = 0
+        monobeast._param_store = ParamStore(monobeast.learner_model, mp.get_context("fork"))
+        monobeast._param_store.pull(monobeast.actor_model)
+        monobeast._steps_since_param_sync = 0
+        monobeast._last_param_sync_time = 0
+
+        # Act: a step that isn't synced to the actors yet
+        with torch.no_grad():
+            monobeast.learner_model.weight.add_(1)
+        monobeast._maybe_publish_params(model_flags, monobeast.learner_model, monobeast.actor_model)
+        checkpoint_files = monobeast.get_checkpoint_files(str(tmpdir))
+
+        # Assert
+        saved_weight = checkpoint_files[0].data["model_state_dict"]["weight"]
+        assert not torch.equal(monobeast.actor_model.weight, monobeast.learner_model.weight)
+        assert torch.equal(saved_weight, monobeast.learner_model.weight)
@@ -0,0 +1,100 @@
+import os
+import gymnasium as gym
+import numpy as np
+import psutil
+import torch
+from dotmap import DotMap
+from pathlib import Path
+from continual_rl.policies.impala.impala_policy import ImpalaPolicy
+from continual_rl.policies.impala.impala_policy_config import ImpalaPolicyConfig
+from continual_rl.utils.env_wrappers import LazyFrames
+
+
+class FixedLengthEnv(object):
+    """
+    Every episode lasts episode_length steps, with a reward of 1 each. Observations are a stack of two blank frames.
+    """
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(2, 1, 64, 64), dtype=np.uint8)
+    action_space = gym.spaces.Discrete(4)
+
+    def __init__(self, episode_length=10):
+        self._episode_length = episode_length
+        self._step = 0
+
+    def _observation(self):
+        return LazyFrames([torch.zeros((1, 64, 64), dtype=torch.uint8)] * 2)
+
+    def reset(self):
+        self._step = 0
+        return self._observation()
+
+    def step(self, action):
+        self._step += 1
+        return self._observation(), 1.0, self._step >= self._episode_length, {}
+
+    def render(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def create_config(output_dir):
+    config = ImpalaPolicyConfig()
+    config.num_actors = 2
+    config.batch_size = 2
+    config.unroll_length = 8
+    config.num_learner_threads = 1
+    config.seconds_between_yields = 1
+    config.device = "cpu"
+    config.persistent_actors = True
+    config.set_output_dir(output_dir)
+    return config
+
+
+class TestPersistentActors(object):
+
+    def test_actors_reused_across_tasks_and_shut_down(self, set_tmp_directory, cleanup_experiment, request):
+        """
+        Not a unit test - two (very short) consecutive tasks with persistent_actors, checking the actors parked at the
+        end of the first are the ones that act on the second.
+        """
+        # Arrange
+        output_dir = Path(request.node.experiment_output_dir, "impala_persistent_actors")
+        os.makedirs(output_dir)
+        policy = ImpalaPolicy(create_config(output_dir), FixedLengthEnv.observation_space,
+                              {0: FixedLengthEnv.action_space})
+        monobeast = policy.impala_trainer
+
+        # Record how many actors each task's start reuses
+        num_actors_reused = []
+        start_actors = monobeast._start_actors
+
+        def record_start_actors(*args, **kwargs):
+            num_actors_reused.append(start_actors(*args, **kwargs))
+            return num_actors_reused[-1]
+
+        monobeast._start_actors = record_start_actors
+        actor_pids = []
+        children_before_training = psutil.Process().children()
+
+        # Act
+        try:
+            for task_id in range(2):
+                task_flags = DotMap(task_id=task_id, action_space_id=0, env_spec=lambda: FixedLengthEnv(),
+                                    mode="train", total_steps=100000)
+                train_generator = monobeast.train(task_flags)
+                for _ in range(2):
+                    next(train_generator)
+                actor_pids.append([actor.pid for actor in monobeast._actor_processes])
+                monobeast.cleanup()
+                train_generator.close()
+        finally:
+            monobeast._shutdown_actor_pool()
+
+        # Assert
+        assert num_actors_reused == [0, 2]
+        assert actor_pids[0] == actor_pids[1]
+        assert not any(psutil.pid_exists(pid) and psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+                       for pid in actor_pids[0])
+        assert psutil.Process().children() == children_before_training
@@ -0,0 +1,105 @@
+import os
+import torch
+from continual_rl.policies.impala.torchbeast.core import replay_storage
+from continual_rl.utils.utils import Utils
+
+
+SPECS = dict(frame=dict(size=(3, 2), dtype=torch.uint8), reward=dict(size=(3,), dtype=torch.float32))
+
+
+class TestReplayStorage(object):
+
+    def test_gather_matches_stacked_entries(self, tmpdir):
+        # Arrange
+        buffers, _, created_keys = replay_storage.create_replay_buffers(tmpdir, SPECS, num_actors=3,
+                                                                        entries_per_actor=4)
+        for key, buffer in buffers.items():
+            buffer.copy_(torch.arange(buffer.numel()).view(buffer.shape))
+        actor_indices = [2, 0, 1, 2]
+        entry_indices = [3, 1, 0, 0]
+
+        # Act
+        batch = replay_storage.gather_replay_entries(buffers, actor_indices, entry_indices)
+
+        # Assert: the same entries as stacking them, in the order they're stored
+        assert sorted(created_keys) == ["frame", "reward"]
+        for key, buffer in buffers.items():
+            stored_order = sorted(zip(actor_indices, entry_indices))
+            expected = torch.stack([buffer[actor_index][entry_index] for actor_index, entry_index in stored_order],
+                                   dim=1)
+            assert torch.equal(batch[key], expected)
+
+    def test_per_actor_files_not_loaded(self, tmpdir):
+        # Arrange: buffers as the baseline stored them, one file per actor, with actions as int64
+        old_specs = dict(action=dict(size=(3,), dtype=torch.int64), reward=dict(size=(3,), dtype=torch.float32))
+        old_file_names = []
+        for actor_index in range(2):
+            for key, spec in old_specs.items():
+                old_tensor, old_file_name, _ = Utils.create_file_backed_tensor(
+                    tmpdir, (4, *spec["size"]), spec["dtype"], permanent_file_name=f"replay_{actor_index}_{key}.fbt")
+                old_tensor.copy_(torch.arange(old_tensor.numel()).view(old_tensor.shape) + 1)
+                old_file_names.append(old_file_name)
+                del old_tensor
+        new_specs = dict(action=dict(size=(3,), dtype=torch.uint8), reward=dict(size=(3,), dtype=torch.float32))
+
+        # Act
+        buffers, file_names, created_keys = replay_storage.create_replay_buffers(tmpdir, new_specs, num_actors=2,
+                                                                                 entries_per_actor=4)
+
+        # Assert: fresh buffers, reported as created (so e.g. the reservoir values get reset), and the old files kept
+        assert sorted(created_keys) == ["action", "reward"]
+        assert buffers["action"].dtype == torch.uint8
+        assert all(torch.all(buffer == 0) for buffer in buffers.values())
+        assert sorted(os.listdir(tmpdir)) == sorted(os.path.basename(file_name)
+                                                    for file_name in file_names + old_file_names)
+
+    def test_compressed_entries_read_back_after_overwrites(self, tmpdir):
+        # Arrange
+        buffers, _, created_keys = replay_storage.create_replay_buffers(tmpdir, SPECS, num_actors=2,
+                                                                        entries_per_actor=4, compressed_keys=("frame",))
+        expected = {key: torch.zeros(buffer.shape, dtype=buffer.dtype) for key, buffer in buffers.items()}
+
+        # Act: fill every entry, then overwrite them, with entries of different compressibility
+        for value in range(3):
+            for actor_index in range(2):
+                for entry_index in range(4):
+                    new_entry = {key: torch.full(spec["size"], value, dtype=spec["dtype"]) for key, spec in SPECS.items()}
+                    new_entry["frame"][0] = torch.tensor([actor_index * 4 + entry_index, value])
+                    replay_storage.write_replay_entry(buffers, actor_index, entry_index, new_entry)
+                    for key in SPECS:
+                        expected[key][actor_index][entry_index] = new_entry[key]
+
+        batch = replay_storage.gather_replay_entries(buffers, [1, 0, 1], [2, 3, 0])
+        stats = replay_storage.get_replay_stats(buffers)
+
+        # Assert
+        assert sorted(created_keys) == ["frame", "reward"]
+        for key in SPECS:
+            assert torch.equal(batch[key], torch.stack([expected[key][0][3], expected[key][1][0],
+                                                        expected[key][1][2]], dim=1))
+            assert torch.equal(replay_storage.read_replay_entry(buffers, 1, 3)[key], expected[key][1][3])
+        assert torch.equal(buffers["frame"].read_all(), expected["frame"])
+        assert stats["replay_frame_read_ms"] > 0
+
+        # The overwritten entries' space was reused: each section only takes a page per entry, plus one, since a new
+        # entry is written before the space of the one it replaces is freed
+        assert stats["replay_frame_segment_mb"] <= 2 * (4 + 1) * 4096 / 1e6
+
+    def test_compressed_entries_reloaded(self, tmpdir):
+        # Arrange
+        buffers, _, _ = replay_storage.create_replay_buffers(tmpdir, SPECS, num_actors=1, entries_per_actor=2,
+                                                             compressed_keys=("frame",))
+        entry = {"frame": torch.full((3, 2), 7, dtype=torch.uint8), "reward": torch.ones((3,))}
+        replay_storage.write_replay_entry(buffers, 0, 1, entry)
+
+        # Act
+        reloaded_buffers, _, created_keys = replay_storage.create_replay_buffers(
+            tmpdir, SPECS, num_actors=1, entries_per_actor=2, compressed_keys=("frame",))
+        replay_storage.write_replay_entry(reloaded_buffers, 0, 0, entry)
+
+        # Assert
+        assert created_keys == []
+        assert torch.equal(reloaded_buffers["frame"].read(0, 1), entry["frame"])
+        assert torch.equal(reloaded_buffers["frame"].read(0, 0), entry["frame"])
+        assert torch.equal(reloaded_buffers["frame"].read(0, 1), entry["frame"])
+        assert replay_storage.get_replay_stats(reloaded_buffers)["replay_frame_compression_ratio"] > 0
@@ -0,0 +1,83 @@
+import torch
+from continual_rl.policies.impala.torchbeast.core import frame_dedup
+from continual_rl.policies.impala.torchbeast.core.rollout_writer import RolloutWriter
+
+
+def create_buffers(num_buffers, unroll_length, observation_shape, deduplicate_frames):
+    frame_size = frame_dedup.deduplicated_frame_size(unroll_length, observation_shape) if deduplicate_frames \
+        else (unroll_length + 1, *observation_shape)
+    return dict(
+        frame=torch.zeros((num_buffers, *frame_size), dtype=torch.uint8),
+        reward=torch.zeros((num_buffers, unroll_length + 1)),
+        done=torch.zeros((num_buffers, unroll_length + 1), dtype=torch.bool),
+        episode_return=torch.zeros((num_buffers, unroll_length + 1)),
+        episode_step=torch.zeros((num_buffers, unroll_length + 1), dtype=torch.int32),
+        last_action=torch.zeros((num_buffers, unroll_length + 1), dtype=torch.int64),
+        action=torch.zeros((num_buffers, unroll_length + 1), dtype=torch.int64),
+    )
+
+
+class TestRolloutWriter(object):
+
+    def test_steps_written_to_each_envs_slot(self):
+        # Arrange
+        unroll_length, observation_shape = 3, (2, 1)
+        buffers = create_buffers(5, unroll_length, observation_shape, deduplicate_frames=False)
+        writer = RolloutWriter(buffers, num_envs=2, observation_shape=observation_shape)
+
+        # Act
+        writer.begin_unroll([4, 1])
+        for t in range(unroll_length + 1):
+            for env_id, env_output_view in enumerate(writer.env_output_views):
+                env_output_view["frame"].fill_(10 * t + env_id)
+                env_output_view["reward"].fill_(t + env_id / 10)
+            writer.write_env_output(t)
+            writer.write_agent_output(t, {"action": torch.tensor([[t, -t]])})
+
+        # Assert
+        assert torch.equal(buffers["frame"][4, :, 0, 0], torch.tensor([0, 10, 20, 30], dtype=torch.uint8))
+        assert torch.equal(buffers["frame"][1, :, 0, 0], torch.tensor([1, 11, 21, 31], dtype=torch.uint8))
+        assert torch.allclose(buffers["reward"][1], torch.tensor([0.1, 1.1, 2.1, 3.1]))
+        assert torch.equal(buffers["action"][1], torch.tensor([0, -1, -2, -3]))
+        assert torch.equal(buffers["frame"][0], torch.zeros_like(buffers["frame"][0]))  # Unused slots untouched
+
+    def test_deduplicated_frames_rebuild_to_written_stacks(self):
+        # Arrange
+        unroll_length, observation_shape = 4, (3, 1)
+        buffers = create_buffers(2, unroll_length, observation_shape, deduplicate_frames=True)
+        writer = RolloutWriter(buffers, num_envs=1, observation_shape=observation_shape, deduplicate_frames=True)
+        expected_stacks = []
+
+        # Act
+        writer.begin_unroll([1])
+        for t in range(unroll_length + 1):
+            stack = torch.arange(t, t + observation_shape[0], dtype=torch.uint8).view(observation_shape)
+            writer.env_output_views[0]["frame"][0, 0].copy_(stack)
+            writer.write_env_output(t)
+            expected_stacks.append(stack)
+
+        rebuilt = frame_dedup.gather_frame_stacks(buffers["frame"], torch.tensor([1]), buffers["done"][[1]].t())
+
+        # Assert
+        assert torch.equal(rebuilt[:, 0], torch.stack(expected_stacks))
+
+    def test_only_stored_keys_written_in_buffer_dtypes(self):
+        # Arrange
+        unroll_length, observation_shape = 2, (2, 1)
+        buffers = create_buffers(3, unroll_length, observation_shape, deduplicate_frames=False)
+        del buffers["episode_step"]
+        buffers["action"] = buffers["action"].to(torch.uint8)
+        writer = RolloutWriter(buffers, num_envs=1, observation_shape=observation_shape)
+
+        # Act
+        writer.begin_unroll([2])
+        for t in range(unroll_length + 1):
+            writer.env_output_views[0]["episode_step"].fill_(t)
+            writer.write_env_output(t)
+            writer.write_agent_output(t, {"action": torch.tensor([[t + 250]]), "baseline": torch.tensor([[0.5]])})
+
+        # Assert
+        assert writer.env_output["last_action"].dtype == torch.int64  # What the model acts on, whatever is stored
+        assert writer.env_output["episode_step"].dtype == torch.int32
+        assert torch.equal(buffers["action"][2], torch.tensor([250, 251, 252], dtype=torch.uint8))
+        assert "baseline" not in buffers and "episode_step" not in buffers
@@ -0,0 +1,102 @@
+import torch
+from torch.nn import functional as F
+from continual_rl.policies.impala.torchbeast.core import vtrace
+from continual_rl.policies.impala.torchbeast.monobeast import Monobeast
+
+
+def reference_vs_minus_v_xs(deltas, discounts, cs):
+    """
+    The original Python-loop recursion, kept here as the reference the TorchScript scan is checked against.
+    """
+    acc = torch.zeros_like(deltas[0])
+    result = []
+    for t in range(discounts.shape[0] - 1, -1, -1):
+        acc = deltas[t] + discounts[t] * cs[t] * acc
+        result.append(acc)
+    result.reverse()
+    return torch.stack(result)
+
+
+def reference_loss(behavior_policy_logits, target_policy_logits, actions, discounts, rewards, values, bootstrap_value,
+                   baseline_cost, entropy_cost):
+    """
+    The unfused path, as computed in Monobeast.compute_loss.
+    """
+    vtrace_returns = vtrace.from_logits(behavior_policy_logits, target_policy_logits, actions, discounts, rewards,
+                                        values, bootstrap_value)
+    cross_entropy = F.nll_loss(F.log_softmax(torch.flatten(target_policy_logits, 0, 1), dim=-1),
+                               target=torch.flatten(actions, 0, 1), reduction="none").view_as(actions)
+    pg_loss = torch.sum(cross_entropy * vtrace_returns.pg_advantages.detach())
+    baseline_loss = baseline_cost * 0.5 * torch.sum((vtrace_returns.vs - values) ** 2)
+    entropy_loss = entropy_cost * torch.sum(F.softmax(target_policy_logits, dim=-1) *
+                                            F.log_softmax(target_policy_logits, dim=-1))
+    return vtrace_returns, pg_loss, baseline_loss, entropy_loss
+
+
+def create_inputs(seed, unroll_length=80, batch_size=32, num_actions=6):
+    generator = torch.Generator().manual_seed(seed)
+    behavior_policy_logits = torch.randn((unroll_length, batch_size, num_actions), generator=generator)
+    target_policy_logits = torch.randn((unroll_length, batch_size, num_actions), generator=generator)
+    actions = torch.randint(0, num_actions, (unroll_length, batch_size), generator=generator)
+    dones = torch.rand((unroll_length, batch_size), generator=generator) < 0.05
+    discounts = (~dones).float() * 0.99
+    rewards = torch.randn((unroll_length, batch_size), generator=generator)
+    values = torch.randn((unroll_length, batch_size), generator=generator)
+    bootstrap_value = torch.randn((batch_size,), generator=generator)
+    return behavior_policy_logits, target_policy_logits, actions, discounts, rewards, values, bootstrap_value
+
+
+class TestVTrace(object):
+
+    def test_scan_matches_reference_recursion(self):
+        # Arrange
+        generator = torch.Generator().manual_seed(0)
+        deltas, discounts, cs = (torch.rand((80, 32), generator=generator) for _ in range(3))
+
+        # Act
+        result = vtrace._vs_minus_v_xs_scan(deltas, discounts, cs)
+
+        # Assert
+        assert torch.allclose(result, reference_vs_minus_v_xs(deltas, discounts, cs), atol=1e-6)
+
+    def test_fused_loss_matches_reference(self):
+        # Arrange
+        behavior_logits, target_logits, actions, discounts, rewards, values, bootstrap = create_inputs(seed=1)
+        reference_target_logits = target_logits.clone().requires_grad_()
+        reference_values = values.clone().requires_grad_()
+        fused_target_logits = target_logits.clone().requires_grad_()
+        fused_values = values.clone().requires_grad_()
+
+        # Act
+        reference_returns, *reference_losses = reference_loss(behavior_logits, reference_target_logits, actions,
+                                                              discounts, rewards, reference_values, bootstrap,
+                                                              baseline_cost=0.5, entropy_cost=0.0006)
+        sum(reference_losses).backward()
+
+        fused = vtrace.fused_from_logits_and_loss(behavior_logits, fused_target_logits, actions, discounts, rewards,
+                                                  fused_values, bootstrap, baseline_cost=0.5, entropy_cost=0.0006)
+        (fused.pg_loss + fused.baseline_loss + fused.entropy_loss).backward()
+
+        # Assert
+        for field in vtrace.VTraceFromLogitsReturns._fields:
+            assert torch.allclose(getattr(fused.vtrace_returns, field), getattr(reference_returns, field), atol=1e-5)
+
+        for fused_loss, reference in zip((fused.pg_loss, fused.baseline_loss, fused.entropy_loss), reference_losses):
+            assert torch.allclose(fused_loss, reference, rtol=1e-5)
+
+        assert torch.allclose(fused_target_logits.grad, reference_target_logits.grad, atol=1e-5)
+        assert torch.allclose(fused_values.grad, reference_values.grad, atol=1e-5)
+
+    def test_fused_loss_only_without_overridden_loss_hooks(self):
+        # Arrange
+        class EntropyBonusMonobeast(Monobeast):
+            def compute_entropy_loss(self, logits):
+                return 2 * super().compute_entropy_loss(logits)
+
+        # Act
+        monobeast_hooks = Monobeast.__new__(Monobeast)._get_overridden_loss_hooks()
+        subclass_hooks = EntropyBonusMonobeast.__new__(EntropyBonusMonobeast)._get_overridden_loss_hooks()
+
+        # Assert: the subclass's entropy loss would be bypassed by the fused loss
+        assert monobeast_hooks == []
+        assert subclass_hooks == ["compute_entropy_loss"]
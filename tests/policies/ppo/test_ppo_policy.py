@@ -1,11 +1,14 @@
 import os
+import gymnasium as gym
 import numpy as np
+import torch
 from pathlib import Path
 from torch.utils.tensorboard.writer import SummaryWriter
 from continual_rl.experiments.experiment import Experiment
 from continual_rl.experiments.tasks.image_task import ImageTask
 from continual_rl.policies.ppo.ppo_policy_config import PPOPolicyConfig
 from continual_rl.policies.ppo.ppo_policy import PPOPolicy
+from continual_rl.policies.ppo.a2c_ppo_acktr_gail.model import Policy
 
 
 class TestPPOPolicy(object):
@@ -41,3 +44,20 @@ class TestPPOPolicy(object):
         assert Path(policy._config.output_dir, "core_process.log").is_file(), "Log file not created"
         assert np.any(['event' in file_name for file_name in os.listdir(experiment.output_dir)]), \
             "Summary writer file not created"
+
+    def test_exported_ppo_policy_matches_eager(self):
+        # Arrange
+        policy = Policy(obs_shape=[4, 84, 84], action_space=gym.spaces.Discrete(6))
+        observation = torch.randint(0, 256, (2, 4, 84, 84)).float()
+        rnn_hxs = torch.zeros((2, 1))
+        masks = torch.ones((2, 1))
+
+        # Act
+        exported = policy.export_for_inference((observation, rnn_hxs, masks))
+        value, logits, _ = exported(observation, rnn_hxs, masks)
+        with torch.no_grad():
+            eager_value, eager_logits, _ = policy.compute_value_and_logits(observation, rnn_hxs, masks)
+
+        # Assert
+        assert torch.allclose(value, eager_value, atol=1e-5)
+        assert torch.allclose(logits, eager_logits, atol=1e-5)
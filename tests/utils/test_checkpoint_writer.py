@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+import torch
+from continual_rl.utils.checkpoint_writer import CheckpointFile, CheckpointWriter, snapshot, write_json
+
+
+class TestCheckpointWriter(object):
+
+    def test_file_replaced_and_backed_up(self, tmpdir):
+        # Arrange
+        path = os.path.join(tmpdir, "metadata.json")
+        backup_path = os.path.join(tmpdir, "metadata_bak.json")
+        writer = CheckpointWriter()
+
+        # Act
+        writer.submit([CheckpointFile(path, write_json, {"step": 1}, backup_path=backup_path)])
+        writer.flush()  # Otherwise it may be superseded
+        writer.submit([CheckpointFile(path, write_json, {"step": 2}, backup_path=backup_path)])
+        writer.flush()
+
+        # Assert
+        with open(path, "r") as file:
+            assert json.load(file) == {"step": 2}
+        with open(backup_path, "r") as file:
+            assert json.load(file) == {"step": 1}
+        assert not os.path.exists(f"{path}.tmp")
+        assert writer.get_stats()["checkpoint_bytes_written"] == 2 * len(json.dumps({"step": 1}))
+
+    def test_waiting_checkpoint_superseded(self, tmpdir):
+        # Arrange
+        path = os.path.join(tmpdir, "metadata.json")
+        writer = CheckpointWriter()
+        write_started = threading.Event()
+        release_write = threading.Event()
+        written_steps = []
+
+        def blocking_write(data, file):
+            write_started.set()
+            release_write.wait()
+            written_steps.append(data["step"])
+            write_json(data, file)
+
+        # Act
+        writer.submit([CheckpointFile(path, blocking_write, {"step": 1})])
+        write_started.wait()  # The first is in flight, so the next two wait
+        writer.submit([CheckpointFile(path, blocking_write, {"step": 2})])
+        writer.submit([CheckpointFile(path, blocking_write, {"step": 3})])
+        release_write.set()
+        writer.flush()
+
+        # Assert
+        assert written_steps == [1, 3]
+        assert writer.get_stats()["checkpoints_superseded"] == 1
+        with open(path, "r") as file:
+            assert json.load(file) == {"step": 3}
+
+    def test_snapshot_unaffected_by_later_changes(self):
+        # Arrange
+        state = {"weights": torch.zeros(3), "steps": [torch.ones(2)], "name": "model"}
+
+        # Act
+        state_snapshot = snapshot(state)
+        state["weights"].add_(1)
+        state["steps"][0].add_(1)
+
+        # Assert
+        assert torch.equal(state_snapshot["weights"], torch.zeros(3))
+        assert torch.equal(state_snapshot["steps"][0], torch.ones(2))
+        assert state_snapshot["name"] == "model"
@@ -0,0 +1,45 @@
+from continual_rl.utils.resource_planner import ResourcePlanner
+
+
+class TestResourcePlanner(object):
+
+    def test_learners_get_blocks_within_numa_nodes(self):
+        # Arrange
+        numa_nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+        # Act
+        planner = ResourcePlanner(num_actors=2, num_learner_processes=2, learner_threads=3, cpus=range(8),
+                                  numa_nodes=numa_nodes)
+
+        # Assert
+        assert planner.get_cpus("learner", 0) == [0, 1, 2]
+        assert planner.get_cpus("learner", 1) == [4, 5, 6]
+        assert planner.actor_pool == [3, 7]
+        assert planner.get_cpus("actor", 0) == [3]
+        assert planner.get_cpus("actor", 1) == [7]
+        assert planner.get_cpus("eval") == [3, 7]
+
+    def test_auto_learner_threads_use_what_actors_leave(self):
+        # Arrange, Act
+        planner = ResourcePlanner(num_actors=3, learner_threads=0, actor_threads=2, cpus=range(10), numa_nodes=[])
+
+        # Assert
+        assert planner.get_num_threads("learner") == 4
+        assert planner.get_num_threads("actor") == 2
+        assert planner.get_cpus("learner") == [0, 1, 2, 3]
+        assert planner.get_cpus("actor", 0) == [4, 5]
+        assert planner.get_cpus("actor", 2) == [8, 9]
+
+    def test_oversubscribed_roles_share_cpus(self):
+        # Arrange, Act
+        planner = ResourcePlanner(num_actors=4, learner_threads=0, actor_role="env_worker", cpus=[0],
+                                  numa_nodes=[[0]])
+
+        # Assert
+        assert planner.get_num_threads("learner") == 1
+        assert planner.get_cpus("learner") == [0]
+        assert planner.get_cpus("env_worker", 3) == [0]
+        assert "env_worker 3: 1 threads, CPUs [0]" in planner.describe()
+
+    def test_parse_cpulist(self):
+        assert ResourcePlanner._parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]